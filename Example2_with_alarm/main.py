@@ -16,8 +16,8 @@
 # It is a modified version of the micropython ntptime module
 # The micropython ntptime module does not contain a class but a few functions.
 # I added functions to be able to change the host, read the current host set.
-# In the script below I also added the function 'can_update_fm_NTP()'. 
-# This function prevents more than one request to the NTP server in 15 seconds,
+# The NTP syncs are done by class NTPSync (file ntp_sync.py), without blocking the main loop (see ntp_step()).
+# Its TokenBucket prevents more than one request to the NTP server in 15 seconds,
 # to not cause error replies from the NTP server.
 # A word about 12/24 time format and AM/PM:
 # If, in the file 'config.json, the item 'dt_str_usa' is set 'true', in the class State, the attribute 'dt_str_usa' will be
@@ -36,7 +36,12 @@
 # All the 12/24 hour and AM/PM settings and calculations will be done in this script, outside of the file mcp7940.py,
 # containing the MCP7940 class. 
 #
-from mcp7940 import MCP7940
+from mcp7940 import MCP7940, MCP7940Error, RetryPolicy, Alarm
+from mcp7940_mfp import AlarmDispatcher
+from mcp7940_clock import InterpClock
+from mcp7940_drift import DriftCalibrator
+from ntp_sync import NTPSync
+from posix_tz import tz_for
 from machine import Pin, SoftI2C, RTC, unique_id, idle   # Note I2C is deprecated!
 import utime
 import network
@@ -44,6 +49,7 @@ import socket
 #import time
 import struct
 import sys, gc
+from array import array
 from secrets import secrets
 import ubinascii
 import json
@@ -82,6 +88,7 @@ if my_debug:
 use_sh1107 = True  #                     |
 # ---------------------------------------+
 MCP7940_RTC_update = True  # Set to True to update the MCP7940 RTC datetime values (in function set_time())
+use_profiler = False  # Set to True to count and time the I2C transactions per MCP7940 method (see mcp7940_profiler.py)
 use_TAG = True
 
 led = Pin("LED_BLUE", Pin.OUT)
@@ -104,22 +111,34 @@ i2c0 = SoftI2C(sda=my_sda, scl=my_scl, freq = 400000) # Correct I2C pins for Fea
 
 
 #print(f"i2c0 is i2c1: {i2c0 is i2c1}")  # revealed False
+if use_profiler:
+    from mcp7940_profiler import I2CProfiler
+    i2c0 = I2CProfiler(i2c0)
 cnt = 0
 mcp = None
 
 while True:
     try:
-        mcp = MCP7940(i2c0, battery_enabled=True)
+        mcp = MCP7940(i2c0, battery_enabled=True, cache=True, retry=RetryPolicy(attempts=3),
+                      sram_writeback=True, sram_flush_ms=10000)  # cache=True: use the register shadow cache
         print(f"create mcp object try nr: {cnt+1}")
         cnt += 1
         if mcp is not None:
             print("mcp object created")
+            if use_profiler:
+                i2c0.attach(mcp)
             break
     except OSError as e:
         print(f"Error {e}")
         if cnt >= 9:
             raise
 
+clk = InterpClock(mcp, resync_ms=60000)  # time for the display and the log, with few I2C reads
+# Trims the MCP7940 oscillator from the NTP syncs. See upd_clocks(). Model kept in SRAM 0x48-0x5E:
+# this script uses only 0x20-0x29 (see upd_SRAM()), not the SRAMJournal of mcp7940_journal.py.
+# The map of the SRAM: see 'About the SRAM' in mcp7940.py
+drift = DriftCalibrator(mcp, clock=clk, sram_start=0x48)
+
 if use_sh1107:
     import sh1107  # driver from peter-I5
     # Width, height and rotation for Monochrome 1.12" 128x128 OLED
@@ -161,21 +180,6 @@ if len(devices) > 0:
         print("device nr {:d}, addres dec: {:3d}, addres hex: 0x{:02x}, {:s}".format(_+1, devices[_], devices[_], dev_dict[devices[_]]))
     print()
 
-# See: https://www.epochconverter.com/
-# Values are for timezone Europe/Portugal
-dst = {
-        2022:(1648342800, 1667095200),  # 2022-03-29 01:00:00 / 2022-10-30 02:00:00
-        2023:(1679792400, 1698544800),  # 2023-03-26 01:00:00 / 2023-10-29 02:00:00
-        2024:(1711846800, 1729994400),  # 2024-03-31 01:00:00 / 2024-10-27 02:00:00
-        2025:(1743296400, 1761444000),  # 2025 03-30 01:00:00 / 2025-10-28 02:00:00
-        2026:(1774746000, 1792893600),  # 2026-03-29 01:00:00 / 2026-10-25 02:00:00
-        2027:(1806195600, 1824948000),  # 2027-03-28 01:00:00 / 2027-10-31 02:00:00
-        2028:(1837645200, 1856397600),  # 2028-03-26 01:00:00 / 2028-10-29 02:00:00
-        2029:(1869094800, 1887847200),  # 2029-03-25 01:00:00 / 2029-10-28 02:00:00
-        2030:(1901149200, 1919296800),  # 2030-03-31 01:00:00 / 2030-10-27 02:00:00
-        2031:(1932598800, 1950746400),  # 2031-03-30 01:00:00 / 2031-10-26 02:00:00
-}
-
 state = None
 
 class State:
@@ -186,7 +190,7 @@ class State:
         self.loop_nr = -1
         self.max_loop_nr = 30
         self.tag_le_max = 26  # see tag_adj()
-        self.use_clr_SRAM = True
+        self.use_clr_SRAM = False  # not needed: write_to_SRAM() overwrites the stamp. See also mcp.sram (write-back)
         self.set_SYS_RTC = True
         self.NTP_dt_is_set = False
         self.SYS_RTC_is_set = False
@@ -194,6 +198,14 @@ class State:
         self.EXT_RTC_is_set = False
         self.save_dt_fm_int_rtc = False  # when save_to_SRAM, save datetime from INTernal RTC (True) or EXTernal RTC (False)
         self.ntp_last_sync_dt = 0
+        self.ntp_next_sync_dt = 0  # set by upd_next_sync() from the drift model of the MCP7940
+        self.upd_step = 0  # UPD_NONE. Step of the update of the MCP7940 after an NTP sync. See upd_clocks()
+        self.ofs_before = None  # offset of the MCP7940 to NTP in mSec, measured by upd_clocks()
+        self.ntp_min_interval = 3600  # seconds
+        self.ntp_max_interval = 86400
+        self.ntp_setup_timeout_ms = 30000  # setup() waits this long for the first NTP sync (a burst of 4 takes ~7 seconds)
+        self.max_err_ms = 100  # the MCP7940 time may be this much off before the next NTP sync
+        self.set_margin_ms = 100  # the MCP7940 time is set at the start of a second at least this far away. See upd_clocks()
         self.dt_str_usa = True
         self.MCP_dt = None
         self.ntp_server_idx = 0 # see ntp_servers_dict
@@ -230,6 +242,7 @@ class State:
         self.STATE = None
         self.tm_tmzone = None # was: 'Europe/Lisbon' # abbreviation of timezone name
         #tm_tmzone_dst = "WET0WEST,M3.5.0/1,M10.5.0"
+        self.tz = None  # PosixTZ of tm_tmzone (see posix_tz.py). Set by read_fm_config()
         self.UTC_OFFSET = None
         self.alarm1 = ()
         self.alarm2 = ()
@@ -273,17 +286,31 @@ class State:
 # through a 10kOhm resistor, connected to VCC (3.3V).
 rtc_mfp_int = Pin(33, mode=Pin.IN, pull=Pin.PULL_DOWN)
 
-def interrupt_handler(state):  # (pin):
+# Called by the AlarmDispatcher (see mcp7940_mfp.py and main()) after an MFP interrupt.
+# It runs from the scheduler, not in the IRQ. The ALMxIF bit is already cleared.
+def alarm_cb(alarm_nr, t_irq_us):
+    if alarm_nr == 1:
+        state.alarm1_int = True
+    else:
+        state.alarm2_int = True
+    state.mfp = True
+
+# Handle an alarm reported by alarm_cb(). Returns True if alarm1 went off
+def interrupt_handler(state):
     TAG = tag_adj(state, "interrupt_handler(): ")
-    if state.mfp:  # We have an interrupt!
+    if state.alarm1_int:  # We have an interrupt!
         print(TAG+"RING RING RING we have an interrupt from the RTC shield!")
+        if my_debug:
+            print(TAG+f"MFP IRQ to dispatch latency: {alarm_disp.latency_us} uSec")
         alarm_blink(state)
         clr_alarm(state, 1)
-        mcp._clr_ALMxIF_bit(1) # Clear the interrupt
+        state.alarm1_int = False
         state.mfp = False
-        raise KeyboardInterrupt
+        return True
+    return False
 
-# rtc_mfp_int.irq(handler=interrupt_handler, trigger=Pin.IRQ_RISING)
+# The MFP interrupt is handled by an AlarmDispatcher. It is created in main()
+alarm_disp = None
 
 
 def read_fm_config(state):
@@ -322,130 +349,137 @@ def read_fm_config(state):
                 state.UTC_OFFSET = v * 3600
             if k == "tmzone":
                 state.tm_tmzone = v
+    try:
+        state.tz = tz_for(state.tm_tmzone if state.tm_tmzone else "UTC")  # a zone name in posix_tz.ZONES or a POSIX TZ string
+    except ValueError as e:
+        print(TAG+f"Error: {e}. Using UTC, without DST")
+        state.tz = tz_for("UTC")
     if my_debug:
         print(TAG+f"for check:\n\tstate.COUNTRY: \'{state.COUNTRY}\', state.STATE: \'{state.STATE}\', state.UTC_OFFSET: {state.UTC_OFFSET}, state.tm_tmzone: \'{state.tm_tmzone}\'")
 
 save_config()
 
+# The transitions of the year are calculated once from the rules of state.tz. After that two integer comparisons
 def is_dst():
-    t = utime.time()
-    yr = utime.localtime(t)[0]
-
-    if yr in dst.keys():
-        start, end = dst[yr]
-        return False if t < start or t > end else True
-    else:
-        print("year: {} not in dst dictionary ({}).\nUpdate the dictionary! Exiting...".format(yr, dst.keys()))
-        raise SystemExit
+    return state.tz.is_dst(utime.time())
     
-def can_update_fm_NTP(state):
-    TAG = tag_adj(state, "can_update_fm_NTP(): ")
-    ret = False
-    if my_debug:
-        print(TAG+f"last NTP sync: {state.ntp_last_sync_dt}")
-    if state.ntp_last_sync_dt == 0:  # we did not NTP sync yet
-        return True   # yes go to do NTP sync
-    else:
-        t1 = state.ntp_last_sync_dt
-        while True:
-            t2 = utime.time() - state.UTC_OFFSET
-            if t2 >= t1:
-                t_diff = t2 - t1
-                if not my_debug:
-                    print(TAG+f"last time of sync: {t1}, current time {t1}, difference in seconds: {t_diff}")
-                if t_diff >= 15:
-                    ret = True
-                    break
-            utime.sleep(2)  # we have to wait 15 seconds
-    return ret
-         
-
-def set_time(state):
-    global config
-    TAG = tag_adj(state, "set_time(): ")
-    try_cnt = 0
-    good_NTP = False
-    tm = None
-    if can_update_fm_NTP(state):
-        tm_mcp = mcp.mcptime
-        mcp_dt = list(tm_mcp)  # create a list (which is mutable)
-        mcp_dt_hh = mcp_dt[state.tm_hour]
-        lcl_dt = utime.localtime(utime.time() + state.UTC_OFFSET)
-        lcl_dt_hh = lcl_dt[state.tm_hour]
-        # During a long sleep time it happened that the MCP7940 clock was not updated(updating)
-        # In that case the MCP7940 timekeeping registers have to be updated
-        # So, if the flag state.NTP_dt_is_set already had been set, it has to be reset.
-        if lcl_dt_hh != mcp_dt_hh:
-            state.NTP_dt_is_ist = False
-        if my_debug:
-            print(TAG+"synchronizing builtin RTC from NTP server, waiting...")
-        try_cnt = 0
-        while True:
-            try:
-                if not state.NTP_dt_is_set:
-                    if ntp.settime():   # this queries the time from an NTP server ant sets the builtin RTC 
-                        t = utime.time()
-                        if my_debug:
-                            print(TAG+f"time(): {t}")
-                        if t >= 0:
-                            good_NTP = True
-                            break
-                    print(TAG+"trying again. Wait...")
-                    utime.sleep(2)
-                    try_cnt += 1
-                    if try_cnt >= 3:
-                        break
-            except OSError as e:
-                print(TAG+f"Error: {e}")
-                try_cnt += 1
-                if try_cnt >= 5:
-                    raise
-        if good_NTP:
-            state.NTP_dt_is_set = True
-            print(TAG+"Succeeded to update the builtin RTC from an NTP server")
-            state.ntp_last_sync_dt = utime.time() # get the time serial
+# Steps of the update of the MCP7940 after an NTP sync, one per call of upd_clocks(). See ntp_synced()
+UPD_NONE = 0      # nothing to do
+UPD_MEASURE = 1   # compare the MCP7940 with the builtin RTC, trim its oscillator
+UPD_SET = 2       # set the MCP7940 time at the start of a second
+UPD_SET_DONE = 3  # measure the offset after the step
+
+# The builtin RTC in mSec since 2000-01-01, in local time like the MCP7940. Synced from NTP in ntp_synced()
+def ntp_ref_ms():
+    return utime.time_ns() // 1000000 + state.UTC_OFFSET * 1000
+
+# Update the MCP7940 after the builtin RTC was synced from NTP.
+# Does one step (see state.upd_step) per call, so the main loop is held up for max. about a second:
+# each step waits once for the seconds register to roll over (see InterpClock.sync()) or for a second boundary.
+# Called from ntp_step()
+def upd_clocks(state):
+    TAG = tag_adj(state, "upd_clocks(): ")
+    step = state.upd_step
+    if step == UPD_NONE:
+        return
+    if step == UPD_MEASURE:
+        ths = mcp.time_has_set()
+        print(TAG+f"mcp.time_has_set(): {ths}")
+        if ths:
+            # Compare the MCP7940 with the builtin RTC and trim its oscillator
+            state.ofs_before = drift.measure(ntp_ref_ms)
+            trim = drift.calibrate()
             if not my_debug:
-                print(TAG+f"Updating ntp_last_sync_dt to: {state.ntp_last_sync_dt}")
-            tm = utime.localtime(utime.time() + state.UTC_OFFSET)    
-            ths = mcp.time_has_set()
-            print(TAG+f"mcp.time_has_set(): {ths}")
-            if not ths:
-                print(TAG+f"setting MCP7940 timekeeping regs to: {tm}")
-                #if MCP7940_RTC_update:
-                #-----------------------------------------------------------
-                # Set MCP7940 RTC shield timekeeping registers
-                #-----------------------------------------------------------
-                mcp.mcptime = tm  # Set the External RTC Shiels's clock
-                state.MCP_dt = tm
-                #-----------------------------------------------------------
-                # The following 2 lines added because I saw that calls to 
-                # mcp.mcpget_time() always returns the same datetime stamp
-                if not mcp._is_started():
-                    print(TAG+"mcp was not started. Starting now")
-                    mcp.start()
-                    if mcp._is_started():
-                        print(TAG+"mcp now is running")
-                else:
-                    print(TAG+"mcp is running")
-            if not tm[state.tm_year] in dst.keys():
-                print("year: {} not in dst dictionary ({}).\nUpdate the dictionary! Exiting...".format(tm[state.tm_year], dst.keys()))
-                raise SystemExit
-            if state.set_SYS_RTC:
-                if not state.SYS_RTC_is_set:
-                    tm2 = (tm[state.tm_year], tm[state.tm_mon], tm[state.tm_mday], tm[state.tm_wday] + 1,
-                        tm[state.tm_hour], tm[state.tm_min], tm[state.tm_sec], 0)
-                    mRTC.datetime(tm2)  # was: mRTC().datetime(tm2)
-                    state.SYS_dt = tm2
-                    state.SYS_RTC_is_set = True
-                    if not my_debug:
-                        print(TAG+f"builtin RTC set to: {state.SYS_dt}")
-            if my_debug and tm is not None:
-                print(TAG+"date/time updated from: \"{}\"".format(ntp.get_host()))
+                print(TAG+f"MCP7940 offset to NTP: {state.ofs_before} mSec, drift: {drift.last_ppm} ppm, trim: {trim}")
+        else:
+            state.ofs_before = drift.offset(ntp_ref_ms)[1] if mcp._is_started() else None
+        if not ths or state.ofs_before is None or abs(state.ofs_before) > state.max_err_ms:
+            state.upd_step = UPD_SET
         else:
-            print(TAG+"failed to update builtin RTC from an NTP server")
+            upd_next_sync(state)
+            state.upd_step = UPD_NONE
+    elif step == UPD_SET:
+        #if MCP7940_RTC_update:
+        #-----------------------------------------------------------
+        # Set MCP7940 RTC shield timekeeping registers
+        #-----------------------------------------------------------
+        # At the start of the next second of the builtin RTC (exact to the mSec after ntp_synced()),
+        # so the MCP7940 seconds roll over in phase with NTP
+        ms = ntp_ref_ms()
+        secs = ms // 1000 + 1
+        if secs * 1000 - ms < state.set_margin_ms:  # not enough time to stop the oscillator and write the registers
+            secs += 1
+        tm = utime.localtime(secs)
+        print(TAG+f"setting MCP7940 timekeeping regs to: {tm}")
+        late = mcp.set_time_epoch_at(secs, utime.ticks_add(utime.ticks_ms(), secs * 1000 - ms))  # Set the External RTC Shiels's clock
+        clk.invalidate()
+        state.MCP_dt = tm
+        if not my_debug:
+            print(TAG+f"MCP7940 started {late} mSec after the second boundary")
+        state.upd_step = UPD_SET_DONE
     else:
-        if my_debug:
-            print(TAG+"not updating builtin RTC from NTP in this moment")
+        ofs_after = drift.time_was_set(ntp_ref_ms, state.ofs_before)  # the drift model goes on across the step
+        if not my_debug:
+            print(TAG+f"MCP7940 offset to NTP now: {ofs_after} mSec")
+        upd_next_sync(state)
+        state.upd_step = UPD_NONE
+
+# Schedule the next NTP sync from the drift model. Called by upd_clocks() after its last step
+def upd_next_sync(state):
+    TAG = tag_adj(state, "upd_next_sync(): ")
+    # Next NTP sync when the MCP7940 is predicted to be state.max_err_ms off
+    t_next = drift.time_to_error(state.max_err_ms, mcp.time())
+    t_next = max(state.ntp_min_interval, min(state.ntp_max_interval, t_next))
+    state.ntp_next_sync_dt = state.ntp_last_sync_dt + t_next
+    if not my_debug:
+        print(TAG+f"next NTP sync in {t_next} seconds")
+
+# Called by ntp_sync (see ntp_sync.py) after an NTP sync, with the answer of the burst that had the lowest delay.
+# Sets the builtin RTC to UTC, like ntp.settime() does, with mSec precision. It is not set to local time afterwards:
+# it is the reference of upd_clocks() (see ntp_ref_ms()) and of is_dst().
+# The MCP7940 is updated in the next passes of the main loop (see upd_clocks()), not here: measuring and setting
+# it takes a few seconds
+def ntp_synced(ntp_ms, t_ticks, delay_ms):
+    TAG = tag_adj(state, "ntp_synced(): ")
+    ms = ntp_ms + utime.ticks_diff(utime.ticks_ms(), t_ticks)
+    tm = utime.localtime(ms // 1000)
+    if state.set_SYS_RTC:
+        mRTC.datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], (ms % 1000) * 1000))
+        state.SYS_dt = tm
+        state.SYS_RTC_is_set = True
+    state.NTP_dt_is_set = True
+    state.ntp_last_sync_dt = utime.time() # get the time serial
+    if not my_debug:
+        print(TAG+f"builtin RTC synced from \"{ntp_sync.host}\", delay: {delay_ms} mSec")
+    state.upd_step = UPD_MEASURE
+    gc.collect()
+
+def ntp_failed(e):
+    TAG = tag_adj(state, "ntp_failed(): ")
+    print(TAG+f"failed to update builtin RTC from an NTP server: {e}")
+    state.ntp_next_sync_dt = utime.time() + state.ntp_min_interval  # try again later
+
+# A burst of 4 requests per sync: the answer with the lowest delay is used (see ntp_sync.py).
+# Max. one sync per 15 seconds (the TokenBucket of ntp_sync)
+ntp_sync = NTPSync(host=ntp.get_host(), burst=4)
+ntp_sync.on_sync(ntp_synced)
+ntp_sync.on_fail(ntp_failed)
+
+# One step of the NTP sync and of the update of the MCP7940. Never blocks for more than about a second.
+# Called in each pass of the loop in main()
+def ntp_step(state):
+    if not ntp_sync.busy and state.upd_step == UPD_NONE and utime.time() >= state.ntp_next_sync_dt:
+        ntp_sync.request()  # see upd_next_sync(): adaptive, from the drift of the MCP7940
+    ntp_sync.poll()  # never blocks. Calls ntp_synced() when the answer is there
+    upd_clocks(state)
+
+# Request an NTP sync. It does not wait: ntp_step() sends the request when the rate limiter of ntp_sync allows,
+# ntp_synced() sets the builtin RTC and upd_clocks() the MCP7940
+def set_time(state):
+    TAG = tag_adj(state, "set_time(): ")
+    if my_debug:
+        print(TAG+"NTP sync requested")
+    ntp_sync.request()
 
 def neopixel_color(state, color):
     global pixels
@@ -708,7 +742,7 @@ def upd_SRAM(state):
     
     # Decide which datetime stamp to save: from INTernal RTC or from EXTernal RTC. Default: from EXTernal RTC
     if state.save_dt_fm_int_rtc:
-        tm = utime.localtime() # Using INTernal RTC
+        tm = utime.localtime(utime.time() + state.UTC_OFFSET) # Using INTernal RTC (UTC, see ntp_synced())
         s_tm = "utime.localtime()"
         s_tm2 = "INT"
     else:
@@ -809,11 +843,6 @@ def upd_SRAM(state):
     msg = ["Write to SRAM:", dt1, dt2, dt3, dt6, dt7]
     pr_msg(state, msg)
 
-    mcp.clr_SRAM()  # Empty the total SRAM
-    
-    if my_debug:
-        mcp.show_SRAM() # Show the values in the cleared SRAM space
-    
     if my_debug:
         print(TAG+f"type({s_tm}): {type(tm)},")
         print(TAG+f"{s_tm2}ernal_dt: {tm}")
@@ -960,7 +989,7 @@ def set_alarm(state, alarm_nr = 1, mins_fm_now=10):
     alarm1en = mcp.alarm_is_enabled(1)
     alarm2en = mcp.alarm_is_enabled(2)
 
-    t1 = utime.time()  # get seconds since epoch
+    t1 = clk.time()  # local seconds since 2000-01-01 of the MCP7940. The builtin RTC keeps UTC (see ntp_synced())
     dt = utime.localtime(t1+(mins_fm_now*60)) # convert mins_fm_now to seconds
 
     month   = dt[state.tm_mon]
@@ -974,48 +1003,26 @@ def set_alarm(state, alarm_nr = 1, mins_fm_now=10):
 
     t = month, date, hours, minutes, seconds, weekday
 
-    if alarm1en and alarm_nr == 1:
+    if (alarm_nr == 1 and alarm1en) or (alarm_nr == 2 and alarm2en):
         if my_debug:
-            print(TAG+f"setting alarm1 for: {t[:5]}, {dow}")
+            print(TAG+f"setting alarm{alarm_nr} for: {t[:5]}, {dow}")
         # ---------------------------------------------------------------
-        # SET ALARM1
+        # SET ALARMx
         # ---------------------------------------------------------------
-        mcp.alarm1 = t  # Set alarm1
+        # Time, match type (minutes), ALMPOL (so the MFP follows the ALMxIF) and enable bit
+        # are written at once. This also clears the ALMxIF bit.
+        alarm = Alarm(alarm_nr, t, match=Alarm.MATCH_MIN, polarity=1, enabled=True)
+        mcp.program_alarm(alarm, verify=True)
         # ---------------------------------------------------------------
-        t_ck = mcp.alarm1[:6]  # check result
+        t_ck = (mcp.alarm1 if alarm_nr == 1 else mcp.alarm2)[:6]  # check result
         if my_debug:
             print(TAG+f"check: alarm{alarm_nr} is set for: {t_ck}")
-        state.alarm1 = t_ck
-        state.alarm1_set = True
-        mcp._clr_ALMxIF_bit(alarm_nr)     # Clear the interrupt of alarm1
-        mcp._set_ALMxMSK_bits(alarm_nr,1) # Set the alarm1 mask bits for a minutes match
-        # IMPORTANT NOTE:
-        # ===============
-        # I experienced that if mcp.alarm1 (or mcp.alarm2) is called earlier, the setting of the ALMPOL bit is reset,
-        # that is why we set the ALMPOL bit again (below)
-        # YES: and the setting of the ALMPOL_bit has to done as last of these commands here!!!
-        # ===============
-        if not mcp._read_ALM_POL_IF_MSK_bits(1, state.POL):
-            mcp._set_ALMPOL_bit(alarm_nr) # Set ALMPOL bit of Alarm1 (so the MFP follows the ALM1IF)
-        
-    if alarm2en and alarm_nr == 2:
-        if my_debug:
-            print(TAG+f"setting alarm2 for: {t[:5]}, {dow}")
-        # ---------------------------------------------------------------
-        # SET ALARM2
-        # ---------------------------------------------------------------
-        mcp.alarm2 = t  # Set alarm2
-        # ---------------------------------------------------------------
-        
-        t_ck = mcp.alarm2[:6]  # check result
-        if my_debug:
-            print(TAG+f"check: alarm2 is set for: {t_ck}")
-        state.alarm2 = t_ck
-        state.alarm2_set = True
-        mcp._clr_ALMxIF_bit(alarm_nr)     # Clear the interrupt of alarm1
-        mcp._set_ALMxMSK_bits(alarm_nr,1) # Set the alarm1 mask bits for a minutes match
-        if not mcp._read_ALM_POL_IF_MSK_bits(alarm_nr, state.POL):
-            mcp._set_ALMPOL_bit(alarm_nr) # Set ALMPOL bit of alarm1 (so the MFP follows the ALM1IF)
+        if alarm_nr == 1:
+            state.alarm1 = t_ck
+            state.alarm1_set = True
+        else:
+            state.alarm2 = t_ck
+            state.alarm2_set = True
 
 def clr_alarm(state, alarm_nr=None):
     TAG = tag_adj(state, "clr_alarm(): ")
@@ -1117,17 +1124,20 @@ def show_alm_match_type(msk=None):
         print(TAG+f"match type: {mcp._match_lst[msk]}")
 
 
-def show_mfp_output_mode_status(stete):
+# Param snap: a MCP7940.Snapshot. If None, a new snapshot is read (one I2C transaction)
+def show_mfp_output_mode_status(stete, snap=None):
     if state.loop_nr < 3:
         return
+    if snap is None:
+        snap = mcp.snapshot()
     print()
     print("MCP7940 MFP output mode:")
     s1 = "+--------+--------+--------+--------------------------+"
     s2 = "| SQWEN  | ALM0EN | ALM1EN |          Mode            |"
     aio = "Alarm Interruput output "
-    sqwen =  mcp._read_SQWEN_bit()
-    alm1en = mcp.alarm_is_enabled(1)
-    alm2en = mcp.alarm_is_enabled(2)
+    sqwen =  snap._read_SQWEN_bit()
+    alm1en = snap.alarm_is_enabled(1)
+    alm2en = snap.alarm_is_enabled(2)
 
     if not sqwen:
         if not alm1en:
@@ -1155,12 +1165,15 @@ def show_mfp_output_mode_status(stete):
     print()
 
 
-def show_alarm_output_truth_table(state, alarm_nr=None):
+# Param snap: a MCP7940.Snapshot. If None, a new snapshot is read (one I2C transaction)
+def show_alarm_output_truth_table(state, alarm_nr=None, snap=None):
     TAG = tag_adj(state, "show_alarm_output_truth_table(): ")
     if alarm_nr is None:
         return
     if not alarm_nr in [1, 2]:
         return
+    if snap is None:
+        snap = mcp.snapshot()
 
     s_ALMxIF = "ALM"+str(alarm_nr)+"IF"
 
@@ -1173,7 +1186,7 @@ def show_alarm_output_truth_table(state, alarm_nr=None):
     alarm_IF = 0
     alarm_MSK = 0
     for _ in range(3):
-        itm = mcp._read_ALM_POL_IF_MSK_bits(alarm_nr, _)
+        itm = snap._read_ALM_POL_IF_MSK_bits(alarm_nr, _)
         if _ == 0:
             alarm_POL = itm # Read alarm1 or alarm2 ALMPOL bit
         elif _ == 1:
@@ -1207,16 +1220,19 @@ def get_ampm(hh):
             ret = str(hh)
     return ret
 
-def show_alm_int_status(state):
+# Param snap: a MCP7940.Snapshot. If None, a new snapshot is read (one I2C transaction)
+def show_alm_int_status(state, snap=None):
     TAG = tag_adj(state, "show_alm_int_status(): ")
+    if snap is None:
+        snap = mcp.snapshot()
     match1 = ""
     match2 = ""
     s_sec = "AM/PM" if state.dt_str_usa else "SECOND"
     s1 = "+-------------+----------+-------+-----+------+--------+--------+---------+---------------------+--------------------+"
     s2 = "|  ALARM  Nr  | ENABLED? | MONTH | DAY | HOUR | MINUTE | {:6s} | WEEKDAY | INTERRUPT OCCURRED? | NOTES:             |".format(s_sec)
     
-    ae1=mcp.alarm_is_enabled(1)
-    ae2=mcp.alarm_is_enabled(2)
+    ae1=snap.alarm_is_enabled(1)
+    ae2=snap.alarm_is_enabled(2)
     is_12hr = mcp._is_12hr
     
     if my_debug:
@@ -1236,7 +1252,7 @@ def show_alm_int_status(state):
             if hh1 >= 12:
                 hh1 -= 12
 
-        match1 = mcp._match_lst[mcp._read_ALM_POL_IF_MSK_bits(1, state.MSK)]
+        match1 = mcp._match_lst[snap._read_ALM_POL_IF_MSK_bits(1, state.MSK)]
         if match1 == "mm" and not state.dt_str_usa:
             ss1 = None
     if ae2:
@@ -1253,11 +1269,11 @@ def show_alm_int_status(state):
             if hh2 >= 12:
                 hh2 -= 12
        
-        match2 = mcp._match_lst[mcp._read_ALM_POL_IF_MSK_bits(2, state.MSK)]
+        match2 = mcp._match_lst[snap._read_ALM_POL_IF_MSK_bits(2, state.MSK)]
         if match2 == "mm" and not state.dt_str_usa:
             ss2 = None
 
-    tm_current = mcp.mcptime # Get current datetime stamp from the External UM MCP7940 RTC shield
+    tm_current = snap.mcptime # Current datetime stamp from the External UM MCP7940 RTC shield
     if my_debug:
         print(TAG+f"mcp.mcptime: {tm_current}")
 
@@ -1338,21 +1354,11 @@ def get_dt(state):
     if state.lStart:
         state.lStart = False
         while True:
-            dt = mcp.mcptime
-            le = len(dt)
-            if le < 2:
-                if not my_debug:
-                    print(TAG+f"call to mcp.mcptime() failed")
-                return (0,)
+            dt = clk.localtime()  # interpolated: the wait does not poll the I2C bus
             if dt[state.tm_sec] == 0: # align for 0 seconds (only at startup)
                 break
     else:
-        dt = mcp.mcptime
-        le = len(dt)
-        if le < 2:
-            if not my_debug:
-                print(TAG+f"call to mcp.mcptime() failed")
-            return (0,)
+        dt = clk.localtime()
     state.MCP_dt = dt
     if my_debug:
         print(TAG+f"returning value: dt: {dt}")
@@ -1362,39 +1368,25 @@ def get_dt_S(state):
     TAG = tag_adj(state,"get_dt_S(): ")
     if my_debug:
         print(TAG+f"state.UTC_OFFSET: {state.UTC_OFFSET}")
-    lcl_dt = utime.localtime(utime.time()) # + state.UTC_OFFSET)
+    lcl_dt = utime.localtime(utime.time() + state.UTC_OFFSET)  # the builtin RTC keeps UTC (see ntp_synced())
     lcl_dt_hh = lcl_dt[state.tm_hour]
-    tm = mcp.mcptime
-    if len(tm) < 2:
-        return ""
+    ts = clk.now()  # interpolated: no I2C read, except at a resync. Weekday name, yearday and AM/PM are derived from it
     if my_debug:
-        print(TAG+f"tm: {tm}, len(tm): {len(tm)}")
-    if len(tm) < 2:
-        print(TAG+"Reading the MCP7940.time() failed")
-        return
-    mcp_dt = list(tm)  # create a list (which is mutable)
-    mcp_dt_hh = mcp_dt[state.tm_hour]
-    yrday = mcp.yearday()
+        print(TAG+f"ts: {ts}")
+    yrday = ts.yearday
     is_12hr = mcp._is_12hr
-    
-    if is_12hr:
-        if mcp_dt_hh >= 12:
-            mcp_dt_hh -= 12
+    mcp_dt_hh = ts.hour12 if is_12hr else ts.hour
+    s_PM = get_ampm(ts.hour)
     
     if my_debug:
         print(TAG+f"is_12hr: {is_12hr}, lcl_dt_hh: {lcl_dt_hh}, mcp_dt_hh: {mcp_dt_hh} ")
-        # print(TAG+f"utime.localtime(utime.time() + state.UTC_OFFSET (= lcl_dt): {lcl_dt})")
-        print(TAG+f"utime.localtime(utime.time()) (= lcl_dt): {lcl_dt})")
+        print(TAG+f"utime.localtime(utime.time() + state.UTC_OFFSET) (= lcl_dt): {lcl_dt})")
 
-    s_PM = get_ampm( mcp_dt[state.tm_hour])  # don't use mcp_dt_hh because it has been changed
-
-    if my_debug:
-        print(TAG+f"mcp.mcptime: {mcp_dt}")
     try:
-        dt_s = "{:3s} {:02d} {:4d}".format(state.month_dict[mcp_dt[state.tm_mon]], mcp_dt[state.tm_mday], mcp_dt[state.tm_year])
-        tm_s = "{:d}:{:02d}:{:02d} {:2s}".format(mcp_dt_hh, mcp_dt[state.tm_min], mcp_dt[state.tm_sec], s_PM)
-        ret = "{} {}, {}. Day of year: {:>3d}".format(mcp.weekday_S(), dt_s, tm_s, yrday)
-        wd = mcp.weekday_S()
+        dt_s = "{:3s} {:02d} {:4d}".format(state.month_dict[ts.month], ts.mday, ts.year)
+        tm_s = "{:d}:{:02d}:{:02d} {:2s}".format(mcp_dt_hh, ts.minute, ts.second, s_PM)
+        wd = ts.weekday_S
+        ret = "{} {}, {}. Day of year: {:>3d}".format(wd, dt_s, tm_s, yrday)
         yd = str(yrday)
     except KeyError as e:
         print(TAG+f"Error: {e}")
@@ -1511,7 +1503,14 @@ def setup(state):
     do_connect(state)
     
     if wlan.isconnected():
-        set_time(state)  # call at start  
+        set_time(state)  # call at start
+        # Wait once for the first sync and the update of the MCP7940, so SYS_dt, is_dst() and the first alarm
+        # use synced clocks. After that the loop in main() syncs without blocking (see ntp_step())
+        if ntp_sync.wait(timeout_ms=state.ntp_setup_timeout_ms):
+            while state.upd_step != UPD_NONE:
+                upd_clocks(state)
+        elif not my_debug:
+            print(TAG+"no NTP sync yet. The loop in main() goes on trying")
         gc.collect()
 
     state.MCP_dt = mcp.mcptime
@@ -1522,49 +1521,38 @@ def setup(state):
         print(TAG+f"Current ntp host: \'{ntp.get_host()}\'")
 
     is_started = mcp._is_started()
-    if is_started > -1:
-        if not is_started:
-            if not my_debug:
-                print(TAG+f"{s_mcp} not started yet...")
-            mcp.start()
-            is_started2 = mcp._is_started()
-            if is_started2 > -1:
-                if not my_debug:
-                    print(TAG+f"{s_mcp} now started")
-            else:
-                print(TAG+f"failed to start {s_mcp}")
-        else:
-            if my_debug:
-                print(TAG+f"{s_mcp} is running")
+    if not is_started:
+        if not my_debug:
+            print(TAG+f"{s_mcp} not started yet...")
+        mcp.start()  # raises MCP7940TimeoutError if the oscillator does not start
+        if not my_debug:
+            print(TAG+f"{s_mcp} now started")
+    else:
+        if my_debug:
+            print(TAG+f"{s_mcp} is running")
             
     pf = mcp.has_pwr_failed()
-    if pf > -1:
-        spf = "Yes" if pf else "No"
-        print(TAG+f"MCP7940 power failure occurred? {spf}")
-        if pf:
-            mcp.clr_pwr_fail_bit()
-            pwrup = mcp.pwr_updn_dt(True)
-            pwrdn = mcp.pwr_updn_dt(False)
-            print(TAG+f"power up   timestamp: {pwrup}")
-            print(TAG+f"power down timestamp: {pwrdn}")
-    else:
-        print(TAG+"Unable to read the pwr failed bit")
+    spf = "Yes" if pf else "No"
+    print(TAG+f"MCP7940 power failure occurred? {spf}")
+    if pf:
+        mcp.clr_pwr_fail_bit()
+        pwrup = mcp.pwr_updn_dt(True)
+        pwrdn = mcp.pwr_updn_dt(False)
+        print(TAG+f"power up   timestamp: {pwrup}")
+        print(TAG+f"power down timestamp: {pwrdn}")
         
     bbe = mcp._is_battery_backup_enabled()
-    if bbe > -1:
-        s = "" if bbe else " not"
-        print(TAG+f"{s_mcp} backup battery is{s} enabled")
-
-        if not bbe:
-            print(TAG+"going to enable")
-            mcp.battery_backup_enable(True)
-            bbe = mcp._is_battery_backup_enabled()
-            if bbe:
-                print(TAG+"backup battery is now enabled")
-            else:
-                print(TAG+"failed to enable backup battery")
-    else:
-        print(TAG+"Unable to read the battery backup enable bit")
+    s = "" if bbe else " not"
+    print(TAG+f"{s_mcp} backup battery is{s} enabled")
+
+    if not bbe:
+        print(TAG+"going to enable")
+        mcp.battery_backup_enable(True)
+        bbe = mcp._is_battery_backup_enabled()
+        if bbe:
+            print(TAG+"backup battery is now enabled")
+        else:
+            print(TAG+"failed to enable backup battery")
     
     if state.dt_str_usa == True:
         print(TAG+"setting MCP7940 for 12hr time format")
@@ -1590,13 +1578,10 @@ def setup(state):
             print(TAG+"Going to start the RTC\'s MCP oscillator")
         mcp.start() # Start MCP oscillator
         is_started = mcp._is_started()
-        if is_started > -1:
-            if is_started:
-                print(TAG+"RTC\'s ocillator is running now")
-            else:
-                print(TAG+"failed to start the oscillator of the MCP7940 RTC")
+        if is_started:
+            print(TAG+"RTC\'s ocillator is running now")
         else:
-            print(TAG+"unable to read the start bit")
+            print(TAG+"failed to start the oscillator of the MCP7940 RTC")
 
     
     print(TAG+f"Microcontroller (utime.localtime()) year = {state.SYS_dt[state.tm_year]}")
@@ -1638,7 +1623,6 @@ def main():
     read_fm_config(state)
     setup(state)
     t = utime.localtime()  
-    o_hour = t[state.tm_hour] # Set hour for set_time(state) call interval
     o_sec = t[state.tm_sec]
     t_start = utime.ticks_ms()
     state.loop_nr = 1
@@ -1649,16 +1633,17 @@ def main():
     if use_sh1107:
         clr_scrn()
     alarm_start = True
+    curr_dt = array('H', [0]*7)  # allocated once. Filled by mcp.read_time_into()
+    global alarm_disp
+    alarm_disp = AlarmDispatcher(mcp, rtc_mfp_int)  # rising edge: the ALMPOL bit is set in set_alarm()
+    alarm_disp.on_alarm(alarm_cb)
+    alarm_disp.enable()
     
     while True:
         try:
-            t = utime.localtime()
+            t = utime.localtime(utime.time() + state.UTC_OFFSET)  # the builtin RTC keeps UTC (see ntp_synced())
             #     yr,   mo, dd, hh, mm, ss, wd, yd, dst
             #t = (2022, 10, 30, 2, 10, 0,  0,  201, -1)  # For testing purposes
-            if o_hour != t[state.tm_hour]:
-                o_hour = t[state.tm_hour] # remember current hour
-                set_time(state)
-                gc.collect()
             if o_sec != t[state.tm_sec]:
                 o_sec = t[state.tm_sec] # remember current second
                 led.on()
@@ -1669,13 +1654,16 @@ def main():
             rd_sram = True
             if not rd_sram:
                 print(TAG+"\nTo see a printout of SRAM ? Set flag \'rd_sram\' to True")
-            curr_dt = mcp.mcptime # get the MCP7940 timekeeping data
+            mcp.read_time_into(curr_dt) # get the MCP7940 timekeeping data
             print(TAG+f"Current MCP7940 RTC datetime: {get_dt_S(state)}")
             res = upd_SRAM(state)
             if res == -1:
                 if not my_debug:
                     print(TAG+f"call to upd_SRAM() failed")
             led.off()
+        except MCP7940Error as e:
+            # The driver already retried the I2C transaction (see RetryPolicy). Report and carry on.
+            print(TAG+f"Error: {e}")
         except KeyboardInterrupt:
             print("", end='\n')
             raise SystemExit
@@ -1686,6 +1674,7 @@ def main():
         #print("Waiting 10 secs so you can copy REPL output")
         #utime.sleep(10)
         while True:
+            ntp_step(state)  # the NTP syncs: non-blocking, max. one per 15 seconds
              # ------------------------------------------------------------------------------------------------
             if alarm_start:
                 alarm_nr = 1
@@ -1698,14 +1687,13 @@ def main():
                     state.alarm1_set = True
                     alarm_start = False
                 #pol_alarm_int(state)  # Check alarm interrupt
-            ck_rtc_mfp_int(state)
-            show_mfp_output_mode_status(state)
+            if interrupt_handler(state):  # state.alarm1_int is set by alarm_cb()
+                alarm_start = True  # set the next alarm
+            snap = mcp.snapshot()  # one I2C transaction for all the status info below
+            show_mfp_output_mode_status(state, snap)
             if state.loop_nr >= 3:  # Only perform this
-                show_alarm_output_truth_table(state, 1) # Show alarm output truth table for alarm1
-                show_alm_int_status(state)
-                state.alarm1_int = True if mcp._read_ALM_POL_IF_MSK_bits(1, state.IF) else False
-                if state.alarm1_int:
-                    interrupt_handler(state)
+                show_alarm_output_truth_table(state, 1, snap) # Show alarm output truth table for alarm1
+                show_alm_int_status(state, snap)
             # pol_alarm_int(state)  # Check alarm interrupt
             """
             if state.mfp:  # We have an interrupt!
@@ -1720,6 +1708,8 @@ def main():
             t_elapsed = t_current - t_start      
             if t_elapsed >= 1000: # was: 10000:
                 print("\n"+TAG+f"loop_nr: {state.loop_nr}, t_elapsed: {t_elapsed} mSec")
+                if use_profiler:
+                    print(TAG+f"I2C (reads, writes, bytes, errors, uSec) so far: {mcp.bus_stats()}")
                 t_start = t_current
                 #dt = get_dt(state)  # Get datetime
                 #if len(dt) >= 2:
@@ -1735,6 +1725,9 @@ def main():
                         clr_scrn()
                         msg = ["That\'s all folks!",""]
                         pr_msg(state, msg)
+                    mcp.sram.flush()  # write the SRAM changes that are still in the write-back cache
+                    if use_profiler:
+                        i2c0.report()
                     gc.collect()
                     sys.exit() # stop to give user oppertunity to copy REPL output.
 
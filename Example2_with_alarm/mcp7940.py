@@ -14,6 +14,11 @@
 # - clr_pwr_failure_bit()
 # - _clr_SQWEN_bit()
 # - _read_SQWEN_bit()
+# - set_sqw()
+# - sqw()
+# - trim (property)
+# - set_CRSTRIM_bit()
+# - _read_CRSTRIM_bit()
 # . _read_ALM_POL_IF_MSK_bits()
 # - _set_ALMPOL_bit()
 # - _clr_ALMPOL_bit()
@@ -25,6 +30,36 @@
 # - write_to_SRAM()
 # - read_fm_SRAM()
 # - pr_regs()
+# - _read_reg()
+# - _read_regs()
+# - _write_reg()
+# - _write_regs()
+# - cache_invalidate()
+# - cache_stats()
+# - bus_stats()
+# - snapshot()
+# - _decode_time()
+# - _decode_pwrstamp()
+# - read_time_into()
+# - localtime()
+# - now()
+# - time()
+# - set_time_epoch()
+# - set_time_epoch_at()
+# - _wait_oscrun()
+# - _bus_read()
+# - _bus_read_into()
+# - _bus_write()
+# - _bus_retry()
+# - _write_time()
+# - program_alarm()
+#
+# Added class:
+# - Snapshot
+# - Timestamp
+# Rewritten class:
+# - DATA (the SRAM, as self.sram)
+# - Alarm (module level)
 #
 # Added property:
 # - _is_12hr
@@ -33,29 +68,141 @@
 # Added self._match_lst
 #
 # Functions modified by @PaulskPt:
+# - yearday()
 # - start()
 # - stop()
 # - mcptime()  setter
 # - _mcpget_time()
 #
+# All BCD encoding/decoding and masking of register fields is done with the lookup tables
+# and pack/unpack functions in mcp7940_codec.py.
+#
 # In functions start() and stop() added functionality to wait for the osc_run_bit to change (See the MC=7940  datasheet DS20005010H-page 15, Note 2)
+# The waiting has a deadline and the polling of the OSCRUN bit backs off (see _wait_oscrun()).
+# When the deadline passes, a MCP7940TimeoutError is raised.
+#
 # For this in function mcptime() (Setter) I added calls to stop() and start() before and after writing a new time to the MC7940 RTC.
 # Be aware when setting an alarm time one loses the state ALMPOL bit, the ALMxIF bit and the three ALMxMSK bits. 
 # Thus when setting an alarm make sure to set ALMPOL, ALMx1F and ALMxMSK for alarm1 and/or alarm2 in your code.py script. 
 # See the example in function set_alarm() in my code.py example.
 # For the sake of readability: replaced index values like [0] ...[6] with [RTCSEC] ... [RTCYEAR]
 #
+# About errors. The functions of class MCP7940 don't return -1 or (0,) anymore when an I2C transaction fails.
+# Each transaction is retried according to a RetryPolicy (param `retry` of MCP7940.__init__()).
+# If it still fails, a MCP7940BusError (or MCP7940NACKError) is raised. See the exception classes below.
+# All of them are subclasses of MCP7940Error, which is a subclass of OSError.
+#
 # About clearing the alarm Interrupt Flag bit (ALMxIF). 
 # See MCP7940 datasheet  DS20005010H-page 23, note 2
 # See also paragraph 5.4.1 on page 21
 # Writing to the ALMxWKDAY register will always clear the ALMxIF bit.
 # This is what we do in function _clr_ALMxIF_bit().
 #
+# About the SRAM (self.sram, class DATA). clr_SRAM(), write_to_SRAM() and read_fm_SRAM() use self.sram.
+# With param `sram_writeback` of MCP7940.__init__() the SRAM changes are kept in RAM until self.sram.flush().
+# Params `sram_flush_ms` and `sram_flush_on_exit` flush them after a time and at sys.exit().
+# The map of the SRAM (0x20-0x5F) with the modules of this example:
+#   0x20-0x29  datetime stamp of write_to_SRAM()
+#   0x2A-0x5F  SRAMJournal (mcp7940_journal.py), 54 bytes: 10 records
+#   STORE_SIZE (23) bytes from param sram_start: DriftCalibrator (mcp7940_drift.py), off by default.
+#              To use it with the journal, give the journal a smaller size, e.g. size=30 (0x2A-0x47), and
+#              the drift model 0x48-0x5E
+# The journal and the drift model claim their part with self.sram.claim(). An overlap raises a ValueError.
+#
+# About the register shadow cache (param `cache` of MCP7940.__init__()).
+# The configuration registers (0x07, 0x08) and the alarm registers (0x0A-0x16) only change when we write them,
+# with exception of the ALMxIF bits, which the MCP7940 sets itself at an alarm match.
+# When the cache is enabled, each write to these registers is also stored in a shadow copy ('write-through').
+# Reads (and the 'read' part of read-modify-write in _set_bit()) are then served from the shadow copy.
+# Reading a volatile bit (ALMxIF) always goes to the MCP7940. The timekeeping registers (0x00-0x06),
+# which contain OSCRUN, PWRFAIL and the running counters, and the power-fail timestamps are never cached.
+#
 from micropython import const
 import time
+import random
+import mcp7940_codec as codec
 
 my_debug = False
 
+# Base class of the errors raised by class MCP7940
+# It is a subclass of OSError, so an 'except OSError' in a calling script still works
+class MCP7940Error(OSError):
+    pass
+
+# An I2C transaction failed, also after the retries of the RetryPolicy
+class MCP7940BusError(MCP7940Error):
+    pass
+
+# The MCP7940 did not acknowledge (ENODEV or EIO)
+class MCP7940NACKError(MCP7940BusError):
+    pass
+
+# The value read back differs from the value written
+class MCP7940VerifyError(MCP7940Error):
+    pass
+
+# The MCP7940 did not reach the expected state in time
+class MCP7940TimeoutError(MCP7940Error):
+    pass
+
+# Retry policy for the I2C transactions of class MCP7940
+# attempts:       total number of tries of a transaction (1 = no retry)
+# backoff_ms:     wait before the 2nd attempt. Each next wait is multiplied by factor
+# max_backoff_ms: upper limit of the wait
+# jitter_ms:      a random 0..jitter_ms is added to each wait,
+#                 so two masters on a shared bus don't keep colliding
+# To use another policy, pass a subclass with its own delay_ms() to MCP7940(i2c, retry=...)
+class RetryPolicy:
+
+    def __init__(self, attempts=3, backoff_ms=1, factor=2, max_backoff_ms=20, jitter_ms=1):
+        self.attempts = attempts
+        self.backoff_ms = backoff_ms
+        self.factor = factor
+        self.max_backoff_ms = max_backoff_ms
+        self.jitter_ms = jitter_ms
+
+    # Return the number of mSec to wait before the next attempt,
+    # or -1 if param attempt (the number of failed attempts so far) was the last one.
+    def delay_ms(self, attempt):
+        if attempt >= self.attempts:
+            return -1
+        delay = min(self.backoff_ms * self.factor ** (attempt - 1), self.max_backoff_ms)
+        if self.jitter_ms > 0:
+            delay += random.getrandbits(8) % (self.jitter_ms + 1)
+        return delay
+
+# The complete settings of alarm 1 or 2, to be written with MCP7940.program_alarm()
+# alarm_nr: 1 or 2
+# time:     (month, date, hours, minutes, seconds, weekday), as for the MCP7940.alarm1 setter
+# match:    ALMxMSK value. One of the MATCH_ constants below. See MCP7940 datasheet DS20005010H, register 5-10
+# polarity: ALMPOL bit. 1 = the MFP output goes high at an alarm
+# enabled:  ALMxEN bit in the control register (0x07)
+class Alarm:
+    __slots__ = ("alarm_nr", "time", "match", "polarity", "enabled")
+
+    MATCH_SEC = 0
+    MATCH_MIN = 1
+    MATCH_HOUR = 2
+    MATCH_WKDAY = 3
+    MATCH_DATE = 4
+    MATCH_ALL = 7  # seconds, minutes, hour, weekday, date and month
+
+    def __init__(self, alarm_nr, time, match=MATCH_MIN, polarity=1, enabled=True):
+        if alarm_nr not in (1, 2):
+            raise ValueError("alarm_nr must be 1 or 2")
+        self.alarm_nr = alarm_nr
+        self.time = time
+        self.match = match
+        self.polarity = polarity
+        self.enabled = enabled
+
+    # Return the 6 register values of the alarm (ALMxSEC ... ALMxMTH), incl. the ALMPOL and ALMxMSK bits.
+    # The ALMxIF bit is 0, so writing them also clears the alarm interrupt flag.
+    def regs(self, buf=None):
+        buf = codec.pack_alarm(self.time, buf)
+        buf[codec.WKDAY] |= ((self.polarity & 1) << 7) | ((self.match & 7) << 4)
+        return buf
+
 class MCP7940:
     """
         Example usage:
@@ -112,6 +259,17 @@ class MCP7940:
     SQWEN_BIT = 6
     ALMPOL_BIT = 7
     ALMxIF_BIT = 3
+    # SQWFS bits (RTCC control register bits 1:0): frequency of the square wave on the MFP pin
+    SQWFS_MASK = 0x03
+    SQWFS_1HZ = 0
+    SQWFS_4KHZ = 1   # 4.096 kHz
+    SQWFS_8KHZ = 2   # 8.192 kHz
+    SQWFS_32KHZ = 3  # 32.768 kHz
+    CRSTRIM_BIT = 2  # coarse trim mode (RTCC control register)
+    OSCTRIM_REGISTER = 0x08
+    TRIM_SIGN_BIT = 7  # 1 = add clocks (the clock was slow), 0 = subtract clocks (the clock was fast)
+    TRIM_MAX = 127
+    TRIM_PPM = 2 * 1000000 / (32768 * 60)  # ppm per trim step: 2 clock cycles, once per minute (~1.017 ppm)
  
     
     bits_dict = {3: "VBATEN",
@@ -133,6 +291,22 @@ class MCP7940:
     SRAM_START = 0X20  # 64 Bytes
     SRAM_END = 0X5F
     
+    # OSError numbers of a missing acknowledge. See _bus_retry()
+    NACK_ERRNOS = (5, 19)  # EIO, ENODEV
+    
+    # Waiting for the OSCRUN bit in start() and stop()
+    OSC_DEADLINE_MS = 1000
+    OSC_POLL_MIN_MS = 1
+    OSC_POLL_MAX_MS = 64
+    
+    # Shadow cache. Register 0x09 (EEUNLOCK) is write-only and 0x17 is reserved
+    CACHE_START = 0x07
+    CACHE_END = 0x16
+    CACHE_SKIP = (0x09, 0x17)
+    # Bits in the cached registers which are changed by the MCP7940 itself
+    VOLATILE_BITS = {0x0D: 0x08,  # ALM1IF
+                     0x14: 0x08}  # ALM2IF
+    
     
     """ Dictionary added by @Paulskpt. See weekday_S() """
     DOW = { 0: "Monday",
@@ -159,8 +333,10 @@ class MCP7940:
     """ End of definitions added by @PaulskPt """
 
     """ Function modified by @Paulskpt """
-    def __init__(self, i2c, status=True, battery_enabled=True):
+    def __init__(self, i2c, status=True, battery_enabled=True, cache=False, retry=None,
+                 sram_writeback=False, sram_flush_ms=0, sram_flush_on_exit=False):
         self._i2c = i2c
+        self._retry = retry if retry is not None else RetryPolicy()  # See _bus_retry()
         # lines added by @PaulskPt
         self._match_lst = ["ss", "mm", "hh", "dow", "dd", "res", "res", "all"]
         self._match_lst_long = ["second", "minute", "hour", "weekday", "date", "reserved", "reserved", "all"]
@@ -169,77 +345,79 @@ class MCP7940:
         self.last_time_set = ()
         self.sbf = "calling self._set_bit() failed"
         self.rbf = "calling self._read_bit() failed"
-        self.gtf = "calling self._mcpget_time() failed"
         self._status = status
         self._battery_enabled = battery_enabled
+        # register shadow cache, indexed by register address
+        self._cache = cache
+        self._shadow = bytearray(MCP7940.CACHE_END+1)
+        self._shadow_ok = bytearray(MCP7940.CACHE_END+1)  # 1 = shadow value is valid
+        self._cache_hits = 0
+        self._cache_misses = 0
+        # preallocated buffer for the timekeeping registers. See _mcpget_time() and read_time_into()
+        self._tk_buf = bytearray(MCP7940.TIME_AND_DATE_END+1)
+        self._alm_buf = bytearray(MCP7940.ALARM1_END - MCP7940.ALARM1_START)  # See program_alarm()
+        self.sram = MCP7940.DATA(self, sram_writeback, sram_flush_ms, sram_flush_on_exit)  # the 64 bytes of SRAM. See class DATA
+        self.osc_settle_ms = -1  # time it took the oscillator to start or stop. See _wait_oscrun()
+        self.osc_polls = 0
+        self.start_lead_ms = 0  # start up time of the oscillator. See set_time_epoch_at()
         
     def has_pwr_failed(self):
-        ret = True if self._read_bit(MCP7940.PWR_FAIL_REG, MCP7940.PWRFAIL_BIT) else False
-        if ret == -1:
-            if my_debug:
-                print("reading power fail bit failed")
-        return ret
+        return True if self._read_bit(MCP7940.PWR_FAIL_REG, MCP7940.PWRFAIL_BIT) else False
     
     """ Function modified by @Paulskpt """
     def clr_pwr_fail_bit(self):
         TAG = MCP7940.CLS_NAME+".clr_pwr_fail_bit(): "
         ret = self._set_bit(MCP7940.PWR_FAIL_REG, MCP7940.PWRFAIL_BIT, 0)
-        if ret == -1:
-            if my_debug:
-                print(TAG+self.sbf)
         return ret
     
-    # Function loops until the oscillator run bit becomes logical '1'
+    # Function waits until the oscillator run bit becomes logical '1'
+    # Param deadline_ms: maximum time to wait. Raises MCP7940TimeoutError when exceeded.
+    # The time it took is saved in self.osc_settle_ms
     """ Function modified by @Paulskpt """
-    def start(self):
+    def start(self, deadline_ms=None):
         TAG = MCP7940.CLS_NAME+".start(): "
-        ads = 0x3
-        osc_run_bit = 0
-        ret = self._set_bit(MCP7940.RTCSEC, MCP7940.ST, 1)
-        if ret == -1:
-            print(TAG+self.sbf)
-            return ret
-        while True:
-            osc_run_bit = self._read_bit(ads, MCP7940.OSCRUN_BIT)
-            if osc_run_bit == -1:
-                if my_debug:
-                    print(TAG+self.rbf)
-                break
-            #if my_debug:
-            #    print(f"MCP7940.start(): osc_run_bit: {osc_run_bit}")
-            if osc_run_bit:
-                break
-        return osc_run_bit
+        self._set_bit(MCP7940.RTCSEC, MCP7940.ST, 1)
+        return self._wait_oscrun(1, deadline_ms, TAG)
     
-    # Function loops until the oscillator run bit becomes logical '0'
+    # Function waits until the oscillator run bit becomes logical '0'
+    # Param deadline_ms: maximum time to wait. Raises MCP7940TimeoutError when exceeded.
+    # The time it took is saved in self.osc_settle_ms
     """ Function modified by @Paulskpt """
-    def stop(self):
+    def stop(self, deadline_ms=None):
         TAG = MCP7940.CLS_NAME+".stop(): "
-        ads = 0x3
-        osc_run_bit = 0
-        ret = self._set_bit(MCP7940.RTCSEC, MCP7940.ST, 0)
-        if ret == -1:
-            print(TAG+self.sbf)
-            return
+        self._set_bit(MCP7940.RTCSEC, MCP7940.ST, 0)
+        return self._wait_oscrun(0, deadline_ms, TAG)
+    
+    # Poll the OSCRUN bit until it has the value of param running.
+    # Between polls we sleep: 1, 2, 4, ... ms, up to OSC_POLL_MAX_MS,
+    # so the number of I2C reads is small, even when waiting until the deadline.
+    """ Function added by @Paulskpt """
+    def _wait_oscrun(self, running, deadline_ms, TAG):
+        if deadline_ms is None:
+            deadline_ms = MCP7940.OSC_DEADLINE_MS
+        t_start = time.ticks_ms()
+        delay = MCP7940.OSC_POLL_MIN_MS
+        polls = 0
         while True:
-            osc_run_bit = self._read_bit(ads, MCP7940.OSCRUN_BIT)
-            if osc_run_bit == -1:
-                if my_debug:
-                    print(TAG+self.rbf)
+            time.sleep_ms(delay)
+            osc_run_bit = self._read_bit(MCP7940.RTCWKDAY, MCP7940.OSCRUN_BIT)
+            polls += 1
+            elapsed = time.ticks_diff(time.ticks_ms(), t_start)
+            if osc_run_bit == running:
                 break
-            #if my_debug:
-            #    print(f"MCP7940.stop(): osc_run_bit: {osc_run_bit}")
-            if not osc_run_bit:
-                break   
+            if elapsed >= deadline_ms:
+                raise MCP7940TimeoutError(TAG+"OSCRUN bit not {:d} after {:d} mSec ({:d} polls)".format(running, elapsed, polls))
+            delay = min(delay * 2, MCP7940.OSC_POLL_MAX_MS, max(deadline_ms - elapsed, 1))
+        self.osc_settle_ms = elapsed
+        self.osc_polls = polls
+        if my_debug:
+            print(TAG+f"osc_run_bit: {osc_run_bit} after {elapsed} mSec ({polls} polls)")
         return osc_run_bit
     
     """ Function modified by @Paulskpt """
     def _is_started(self):
         TAG = MCP7940.CLS_NAME+"._is_started(): "
         ret = self._read_bit(MCP7940.RTCSEC, MCP7940.ST)
-        if ret == -1:
-            if not my_debug:
-                print(TAG+self.rbf)
         return ret
 
     """ Function modified by @Paulskpt """
@@ -248,18 +426,12 @@ class MCP7940:
         if enable is None:
             enable = self.battery_enabled  # use the value set at __init__()
         ret = self._set_bit(MCP7940.RTCWKDAY, MCP7940.VBATEN, enable)
-        if ret == -1:
-            if my_debug:
-                print(TAG+self.sbf)
         return ret
 
     """ Function modified by @Paulskpt """
     def _is_battery_backup_enabled(self):
         TAG = MCP7940.CLS_NAME+"._is_battery_backup_enabled(): "
         ret = self._read_bit(MCP7940.RTCWKDAY, MCP7940.VBATEN)
-        if ret == -1:
-            if my_debug:
-                print(TAG+self.rbf)
         return ret
 
     """ Function modified by @Paulskpt """
@@ -267,30 +439,150 @@ class MCP7940:
         """ Set only a single bit in a register. To do so, need to read
             the current state of the register and modify just the one bit.
         """
-        TAG = MCP7940.CLS_NAME+"._set_bit(): "
         mask = 1 << bit
-        try:
-            current = self._i2c.readfrom_mem(MCP7940.ADDRESS, register, 1)
-            updated = (current[0] & ~mask) | ((value << bit) & mask)
-            self._i2c.writeto_mem(MCP7940.ADDRESS, register, bytes([updated]))
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1  # indicate failure
+        current = self._read_reg(register, 0)  # we don't need the volatile bits to modify a bit
+        updated = (current & ~mask) | ((value << bit) & mask)
+        self._write_reg(register, updated)
         return 1  # indicate command execution was successful
        
     """ Function modified by @Paulskpt """
     def _read_bit(self, register, bit):
         TAG = MCP7940.CLS_NAME+"._read_bit(): "
-        ret = -1
-        try:
-            register_val = self._i2c.readfrom_mem(MCP7940.ADDRESS, register, 1)
-            ret = (register_val[0] & (1 << bit)) >> bit
-        except OSError as e:
-            print(f"Error: {e}")
+        register_val = self._read_reg(register, 1 << bit)
+        ret = (register_val & (1 << bit)) >> bit
         if my_debug:
             print(TAG+f"return value: {ret}")
         return ret
 
+    # All I2C transactions of this class go through _bus_read(), _bus_read_into() and _bus_write().
+    # An OSError is retried as set by the RetryPolicy self._retry.
+    # When all attempts failed, a MCP7940NACKError or MCP7940BusError is raised.
+    """ Function added by @Paulskpt """
+    def _bus_read(self, register, num_registers):
+        attempt = 0
+        while True:
+            try:
+                return self._i2c.readfrom_mem(MCP7940.ADDRESS, register, num_registers)
+            except OSError as e:
+                attempt += 1
+                self._bus_retry(e, attempt, register)
+
+    """ Function added by @Paulskpt """
+    def _bus_read_into(self, register, buf):
+        attempt = 0
+        while True:
+            try:
+                self._i2c.readfrom_mem_into(MCP7940.ADDRESS, register, buf)
+                return
+            except OSError as e:
+                attempt += 1
+                self._bus_retry(e, attempt, register)
+
+    """ Function added by @Paulskpt """
+    def _bus_write(self, register, buf):
+        attempt = 0
+        while True:
+            try:
+                self._i2c.writeto_mem(MCP7940.ADDRESS, register, buf)
+                return
+            except OSError as e:
+                attempt += 1
+                self._bus_retry(e, attempt, register)
+
+    # Wait before the next attempt or, if there are no attempts left, raise the error
+    """ Function added by @Paulskpt """
+    def _bus_retry(self, e, attempt, register):
+        delay = self._retry.delay_ms(attempt)
+        if delay < 0:
+            errno = e.args[0] if len(e.args) else 0
+            msg = "I2C error {} at register 0x{:02x} after {:d} attempt(s)".format(errno, register, attempt)
+            if errno in MCP7940.NACK_ERRNOS:
+                raise MCP7940NACKError(errno, msg)
+            raise MCP7940BusError(errno, msg)
+        if my_debug:
+            print(MCP7940.CLS_NAME+"._bus_retry(): "+f"attempt {attempt}, error: {e}, retry in {delay} mSec")
+        time.sleep_ms(delay)
+
+    # Is register in the range of the shadow cache?
+    """ Function added by @Paulskpt """
+    def _cacheable(self, register):
+        return MCP7940.CACHE_START <= register <= MCP7940.CACHE_END and register not in MCP7940.CACHE_SKIP
+
+    # Read one register. Served from the shadow cache if enabled and valid,
+    # unless one of the bits in param mask is a volatile bit.
+    # Raises MCP7940BusError on an I2C failure
+    """ Function added by @Paulskpt """
+    def _read_reg(self, register, mask=0xFF):
+        cacheable = self._cache and self._cacheable(register)
+        if cacheable:
+            if self._shadow_ok[register] and not (mask & MCP7940.VOLATILE_BITS.get(register, 0)):
+                self._cache_hits += 1
+                return self._shadow[register]
+            self._cache_misses += 1
+        value = self._bus_read(register, 1)[0]
+        if cacheable:
+            self._shadow[register] = value
+            self._shadow_ok[register] = 1
+        return value
+
+    # Read num_registers consecutive registers.
+    # Note: when served from the shadow cache, the volatile (ALMxIF) bits are not up to date.
+    # Raises MCP7940BusError on an I2C failure
+    """ Function added by @Paulskpt """
+    def _read_regs(self, start_reg, num_registers):
+        end_reg = start_reg + num_registers
+        cacheable = self._cache and all(self._cacheable(r) for r in range(start_reg, end_reg))
+        if cacheable:
+            if all(self._shadow_ok[start_reg:end_reg]):
+                self._cache_hits += 1
+                return bytes(self._shadow[start_reg:end_reg])
+            self._cache_misses += 1
+        buf = self._bus_read(start_reg, num_registers)
+        if cacheable:
+            self._shadow[start_reg:end_reg] = buf
+            for r in range(start_reg, end_reg):
+                self._shadow_ok[r] = 1
+        return buf
+
+    # Write one register and update the shadow cache
+    # Raises MCP7940BusError on an I2C failure
+    """ Function added by @Paulskpt """
+    def _write_reg(self, register, value):
+        self._bus_write(register, bytes([value]))
+        if self._cache and self._cacheable(register):
+            self._shadow[register] = value
+            self._shadow_ok[register] = 1
+
+    # Write consecutive registers and update the shadow cache
+    # Raises MCP7940BusError on an I2C failure
+    """ Function added by @Paulskpt """
+    def _write_regs(self, start_reg, buf):
+        self._bus_write(start_reg, buf)
+        if self._cache:
+            for i in range(len(buf)):
+                r = start_reg + i
+                if self._cacheable(r):
+                    self._shadow[r] = buf[i]
+                    self._shadow_ok[r] = 1
+
+    # Forget all shadowed register values, e.g. after another I2C master changed the MCP7940 settings
+    """ Function added by @Paulskpt """
+    def cache_invalidate(self):
+        for r in range(len(self._shadow_ok)):
+            self._shadow_ok[r] = 0
+
+    # Return the shadow cache counters (hits, misses)
+    """ Function added by @Paulskpt """
+    def cache_stats(self):
+        return (self._cache_hits, self._cache_misses)
+
+    # Return the I2C bus totals (reads, writes, bytes, errors, uSec)
+    # when the I2C object is an I2CProfiler (see mcp7940_profiler.py), else None
+    """ Function added by @Paulskpt """
+    def bus_stats(self):
+        totals = getattr(self._i2c, "totals", None)
+        return totals() if totals is not None else None
+
     """ Function renamed by @PaulskPt """
     @property
     def mcptime(self):
@@ -307,6 +599,17 @@ class MCP7940:
             (2019, 6, 3, 13, 12, 44, 0, 154)
             # 1:12:44pm on Monday (0) the 3 Jun 2019 (154th day of the year)
         """
+        self.stop()  # See:  MCP7940 DATASHEET: DS20005010H-page 15
+        try:
+            self._write_time(t_in)
+        finally:
+            self.start()  # also after a MCP7940Error: don't leave the oscillator stopped
+
+    # Write a new time to the timekeeping registers and check the result.
+    # Expects the oscillator to be stopped. Used by the mcptime setter and by AsyncMCP7940 (see mcp7940_async.py)
+    """ Function added by @Paulskpt """
+    def _write_time(self, t_in):
+        TAG = MCP7940.CLS_NAME+".mcptime() setter: "
         if my_debug:
             print(TAG+f"param t_in: {t_in}")
         t_in = t_in[:8]  # Slice off too many bytes
@@ -339,50 +642,23 @@ class MCP7940:
                 if not my_debug:
                     print(TAG+f"battery backup enable result: {res}")
         """
-        #print(time_reg)
-        reg_filter = (0x7F, 0x7F, 0x3F, 0x07, 0x3F, 0x3F, 0xFF)
-        """ Note @Paulskpt zip() is a built-in function of micropython. Works as follows:
-            >>> x = [1, 2, 3]
-            >>> y = [4, 5, 6]
-            >>> zipped = zip(x,y)
-            >>> list(zipped)
-            [(1, 4), (2, 5), (3, 6)]"""
-        t = [(self.int_to_bcd(reg) & filt) for reg, filt in zip(time_reg, reg_filter)]
-        # Note that some fields will be overwritten that are important!
-        # fixme!
-        bt = bytes(t)
+        bt = codec.pack_time(t_in)  # BCD encoded and masked. See mcp7940_codec.py
         #if my_debug:
-        #    print(TAG+f"t = {t}, bytes(t): {bt}")
-            
-        ret = self.stop()  # See:  MCP7940 DATASHEET: DS20005010H-page 15
-        if ret == -1:
-            if not my_debug:
-                print(TAG+"calling self.stop() failed")
-            return ret
-        try:
-            self._i2c.writeto_mem(MCP7940.ADDRESS, MCP7940.CONTROL_REGISTER, bt)
+        #    print(TAG+f"bytes: {list(bt)}")
             
-            if self._is_12hr_fmt > -1:
-                self.set_12hr(True) # Set the 12hr bit
-            # We check the result
-            # AM/PM bit is updated with the call to self._mcpget_time()
-            time_ck = self._mcpget_time(MCP7940.CONTROL_REGISTER)
-            print(TAG+f"time check: {time_ck}")
-            if len(time_ck) > 1 and time_ck[0] > 2001:  # we expect a datetime that is > 2001 (= 1)
-                self.time_is_set = True  # set flag
-                self.last_time_set = time_ck
-                            
-            #time.sleep(3)
-        
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1
+        self._write_regs(MCP7940.CONTROL_REGISTER, bt)
         
-        ret = self.start()
-        if ret == -1:
-            if not my_debug:
-                print(TAG+"calling self.start() failed.")
-            return ret
+        if self._is_12hr_fmt > -1:
+            self.set_12hr(True) # Set the 12hr bit
+        # We check the result
+        # AM/PM bit is updated with the call to self._mcpget_time()
+        time_ck = self._mcpget_time(MCP7940.CONTROL_REGISTER)
+        print(TAG+f"time check: {time_ck}")
+        if time_ck[:3] != tuple(t_in[:3]):
+            raise MCP7940VerifyError(TAG+f"wrote: {tuple(t_in[:3])}, read back: {time_ck[:3]}")
+        if time_ck[0] > 2001:  # we expect a datetime that is > 2001 (= 1)
+            self.time_is_set = True  # set flag
+            self.last_time_set = time_ck
     
     # Return state of the self.time_is_set flag
     # Function added to be useful for calling scripts
@@ -522,8 +798,6 @@ class MCP7940:
         value = 1 if onoff else 0
         
         ret = self._set_bit(reg, bit, value)
-        if ret == -1:
-            print(TAG+self.sbf)
         return ret
 
     # Check if alarm x is enabled
@@ -543,8 +817,6 @@ class MCP7940:
             bit = MCP7940.ALARM2EN_BIT
         
         ret= self._read_bit(reg, bit)
-        if ret == -1:
-            print(TAG+self.rbf)
         return ret
     
     @property
@@ -555,15 +827,7 @@ class MCP7940:
     @alarm1.setter
     def alarm1(self, t):
         TAG = MCP7940.CLS_NAME+"alarm1(): setter "
-        le = len(t)
-        if le == 6:
-            month, date, hours, minutes, seconds, weekday = t
-        if le == 8:
-            _, month, date, hours, minutes, seconds, weekday, _ = t  # Don't need year or yearday
-        # Reorder
-        time_reg = [seconds, minutes, hours, weekday + 1, date, month]
-        reg_filter = (0x7F, 0x7F, 0x3F, 0x07, 0x3F, 0x3F)  # No year field for alarms
-        t = [(self.int_to_bcd(reg) & filt) for reg, filt in zip(time_reg, reg_filter)]
+        t = codec.pack_alarm(t)  # No year field for alarms. Accepts 6 or 8 items
         if my_debug:
             print(TAG+"writing: | bcd |   binary    ||")
             le2 = len(t)
@@ -571,37 +835,19 @@ class MCP7940:
             for _ in range(le2):
                 print(" "*spc+"| {:02d}  | b\'{:08b}\' || ".format(t[_], t[_]), end='\n')
             print()
-        try:
-            self._i2c.writeto_mem(MCP7940.ADDRESS, MCP7940.ALARM1_START, bytes(t))
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1
+        self._write_regs(MCP7940.ALARM1_START, t)
         return 1
 
     """ Function modified by @Paulskpt """
     @property
     def alarm2(self):
-        TAG = MCP7940.CLS_NAME+"alarm2(): "
-        ret = self._mcpget_time(start_reg=MCP7940.ALARM2_START)
-        le = len(ret)
-        if len < 2:
-            if my_debug:
-                print(TAG+self.gtf)
-        return ret
+        return self._mcpget_time(start_reg=MCP7940.ALARM2_START)
 
     """ Function modified by @Paulskpt """  
     @alarm2.setter
     def alarm2(self, t):
         TAG = MCP7940.CLS_NAME+"alarm2(): setter "
-        le = len(t)
-        if le == 6:
-                month, date, hours, minutes, seconds, weekday = t
-        if le == 8:
-            _, month, date, hours, minutes, seconds, weekday, _ = t  # Don't need year or yearday
-        # Reorder
-        time_reg = [seconds, minutes, hours, weekday + 1, date, month]
-        reg_filter = (0x7F, 0x7F, 0x3F, 0x07, 0x3F, 0x3F)  # No year field for alarms
-        t = [(self.int_to_bcd(reg) & filt) for reg, filt in zip(time_reg, reg_filter)]
+        t = codec.pack_alarm(t)  # No year field for alarms. Accepts 6 or 8 items
         if my_debug:
             print(TAG+"writing: | bcd |   binary    ||")
             le2 = len(t)
@@ -609,26 +855,48 @@ class MCP7940:
             for _ in range(le2):
                 print(" "*spc+"| {:02d}  | b\'{:08b}\' || ".format(t[_], t[_]), end='\n')
             print()
-        try:
-            self._i2c.writeto_mem(MCP7940.ADDRESS, MCP7940.ALARM2_START, bytes(t))
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1
+        self._write_regs(MCP7940.ALARM2_START, t)
+        return 1
+
+    # Write all the settings of an Alarm object:
+    # one write of the 6 alarm registers (incl. ALMPOL and ALMxMSK, which clears ALMxIF)
+    # and one update of the ALMxEN bit in the control register.
+    # Param verify: read the registers back in one transaction. Raises MCP7940VerifyError on a difference
+    """ Function added by @Paulskpt """
+    def program_alarm(self, alarm, verify=False):
+        TAG = MCP7940.CLS_NAME+".program_alarm(): "
+        if alarm.alarm_nr == 1:
+            start_reg = MCP7940.ALARM1_START
+            bit = MCP7940.ALARM1EN_BIT
+        else:
+            start_reg = MCP7940.ALARM2_START
+            bit = MCP7940.ALARM2EN_BIT
+        buf = alarm.regs(self._alm_buf)
+        self._write_regs(start_reg, buf)
+        self._set_bit(MCP7940.RTCC_CONTROL_REGISTER, bit, 1 if alarm.enabled else 0)
+        if my_debug:
+            print(TAG+f"alarm{alarm.alarm_nr}: {list(buf)}, enabled: {alarm.enabled}")
+        if verify:
+            ofs = start_reg - MCP7940.RTCC_CONTROL_REGISTER
+            ck = self._bus_read(MCP7940.RTCC_CONTROL_REGISTER, ofs + len(buf))
+            en = (ck[0] >> bit) & 1
+            wkday_ofs = ofs + codec.WKDAY
+            for i in range(len(buf)):
+                v = ck[ofs + i]
+                if ofs + i == wkday_ofs:
+                    v &= ~(1 << MCP7940.ALMxIF_BIT) & 0xFF  # the alarm can have fired already
+                if v != buf[i] or en != (1 if alarm.enabled else 0):
+                    raise MCP7940VerifyError(TAG+f"alarm{alarm.alarm_nr}: wrote: {list(buf)}, enabled: {alarm.enabled}, read back: {list(ck[ofs:])}, enabled: {en}")
         return 1
 
+    """ Function modified by @Paulskpt """
     def bcd_to_int(self, bcd):
         """ Expects a byte encoded with 2x 4bit BCD values. """
-        # Alternative using conversions: int(str(hex(bcd))[2:])
-        ret = (bcd & 0xF) + (bcd >> 4) * 10
-        if my_debug:
-            print(MCP7940.CLS_NAME+"bcd_to_int(): "+"bcd: {:2d}, int: {:02d}".format(bcd, ret))
-        return ret
+        return codec.BCD_TO_INT[bcd]  # lookup table. See mcp7940_codec.py
 
+    """ Function modified by @Paulskpt """
     def int_to_bcd(self, i):
-        ret = (i // 10 << 4) + (i % 10)
-        if my_debug:
-            print(MCP7940.CLS_NAME+"int_to_bcd(): "+"int: {:2d}, bcd: {:02d}".format(i, ret))
-        return ret
+        return codec.INT_TO_BCD[i]  # lookup table. See mcp7940_codec.py
 
     """ https://stackoverflow.com/questions/725098/leap-year-calculation """
     def is_leap_year(self, year):
@@ -643,11 +911,6 @@ class MCP7940:
         if my_debug:
             print(TAG+f"self.mcptime = {self.mcptime}")
         dt = self._mcpget_time()
-        le = len(dt)
-        if le < 2:
-            if my_debug:
-                print(TAG+self.gtf)
-            return -1
         if my_debug:
             print(TAG+f"dt: {dt}")
         # Year, month, mday, hour, minute, second, weekday, yearday, is12hr, isPM
@@ -665,10 +928,6 @@ class MCP7940:
         TAG = MCP7940.CLS_NAME+".weekday_S(): "
         wd_s = ""
         wd_n = self.weekday_N()
-        if wd_n == -1:
-            if my_debug:
-                print(TAG+"calling self.weekday_N() failed")
-                return wd_s
         if wd_n in MCP7940.DOW:
             wd_s = MCP7940.DOW[wd_n]
             if my_debug:
@@ -676,37 +935,20 @@ class MCP7940:
         return wd_s
     
     # Calculate the yearday
-    """ Function added by @Paulskpt """
+    # Param dt0: (year, month, mday, ...). If None, the MCP7940 time is read.
+    # Better: use localtime(), which gives the yearday with the same I2C read
+    """ Function modified by @Paulskpt """
     def yearday(self, dt0=None):
         TAG = MCP7940.CLS_NAME+".yearday(): "
         if my_debug:
             print(TAG+f"param dt0: {dt0}")
-
-        if dt0 is not None: 
-            # Prevent 'hang' when called fm self._mcpget_time(),
-            # by having self._mcpget_time() furnish dt stamp
-            # Slicing [:3]. We need only year, month and mday
-            dt = dt0[:3]
-        else:
-            dt = self._mcpget_time()[:3]
-            le = len(dt)
-            if le < 2:
-                if my_debug:
-                    print(TAG+self.gtf)
-                    return -1
-        ndays = 0
-        curr_yr = dt[0]
-        curr_mo = dt[1]
-        curr_date = dt[2]
-        for _ in range(1, curr_mo):
-            try:
-                ndays += MCP7940.DOM[_]
-                if _ == 2 and self.is_leap_year(curr_yr):
-                    ndays += 1
-            except KeyError:
-                pass
-        ndays += curr_date
-        return ndays
+        if dt0 is None:
+            buf = self._tk_buf
+            self._bus_read_into(MCP7940.RTCSEC, buf)
+            return codec.yearday(2000 + codec.BCD_TO_INT[buf[codec.YEAR]],
+                                 codec.BCD_TO_INT[buf[codec.MTH] & 0x1F],
+                                 codec.BCD_TO_INT[buf[codec.DATE] & 0x3F])
+        return codec.yearday(dt0[0], dt0[1], dt0[2])  # cumulative days table. See mcp7940_codec.py
     
     # See datasheet: DS20005010H-page 18
     """ Function added by @Paulskpt """
@@ -715,12 +957,8 @@ class MCP7940:
         reg = MCP7940.RTCWKDAY
         bit = MCP7940.PWRFAIL_BIT
         ret = self._read_bit(reg, bit)
-        if ret == -1:
-            if my_debug:
-                print(TAG+self.rbf)
-        else:
-            if my_debug:
-                print(TAG+f"power failure bit: {ret}")
+        if my_debug:
+            print(TAG+f"power failure bit: {ret}")
         return ret
     
     # See datasheet DS20005010H-page 18, Note 2
@@ -734,8 +972,6 @@ class MCP7940:
     def _clr_SQWEN_bit(self):
         TAG = MCP7940.CLS_NAME+"._clr_SQWEN_bit(): "
         ret = self._set_bit(MCP7940.RTCC_CONTROL_REGISTER, MCP7940.SQWEN_BIT, 0)
-        if ret == -1:
-            print(TAG+self.sbf)
         return ret
     
     # Read state of the square wave output bit
@@ -743,10 +979,66 @@ class MCP7940:
     def _read_SQWEN_bit(self):
         TAG = MCP7940.CLS_NAME+"._read_SWEN_bit(): "
         ret = self._read_bit(MCP7940.RTCC_CONTROL_REGISTER, MCP7940.SQWEN_BIT)
-        if ret == -1:
-            print(TAG+self.rbf)
         return ret
     
+    # Put a square wave on the MFP pin. Param fs: MCP7940.SQWFS_1HZ, _4KHZ, _8KHZ or _32KHZ
+    # Param enable: False = the MFP pin is the alarm output again
+    # While the square wave is on, the MFP pin does not signal the alarms (the ALMxIF bits are still set).
+    # See datasheet DS20005010H, paragraph 5.3. One write of the RTCC control register, none if unchanged
+    """ Function added by @Paulskpt """
+    def set_sqw(self, fs=0, enable=True):
+        TAG = MCP7940.CLS_NAME+".set_sqw(): "
+        if not fs in [MCP7940.SQWFS_1HZ, MCP7940.SQWFS_4KHZ, MCP7940.SQWFS_8KHZ, MCP7940.SQWFS_32KHZ]:
+            raise ValueError(TAG+f"invalid fs: {fs}")
+        current = self._read_reg(MCP7940.RTCC_CONTROL_REGISTER, 0)
+        updated = (current & ~((1 << MCP7940.SQWEN_BIT) | MCP7940.SQWFS_MASK)) & 0xFF
+        if enable:
+            updated |= (1 << MCP7940.SQWEN_BIT) | fs
+        else:
+            updated |= current & MCP7940.SQWFS_MASK
+        if updated != current:
+            self._write_reg(MCP7940.RTCC_CONTROL_REGISTER, updated)
+        if my_debug:
+            print(TAG+f"control register: {hex(current)} -> {hex(updated)}")
+        return 1
+
+    # Return (SQWEN bit, SQWFS bits) of the square wave output
+    """ Function added by @Paulskpt """
+    def sqw(self):
+        current = self._read_reg(MCP7940.RTCC_CONTROL_REGISTER, (1 << MCP7940.SQWEN_BIT) | MCP7940.SQWFS_MASK)
+        return (current >> MCP7940.SQWEN_BIT) & 1, current & MCP7940.SQWFS_MASK
+
+    # Digital trim of the oscillator (OSCTRIM register). Signed, in steps of MCP7940.TRIM_PPM:
+    # positive = clocks are added (the clock runs faster), negative = clocks are subtracted, 0 = no trim.
+    # See datasheet DS20005010H, paragraph 5.6
+    """ Function added by @Paulskpt """
+    @property
+    def trim(self):
+        v = self._read_reg(MCP7940.OSCTRIM_REGISTER, 0)
+        return v & MCP7940.TRIM_MAX if v >> MCP7940.TRIM_SIGN_BIT else -(v & MCP7940.TRIM_MAX)
+
+    """ Function added by @Paulskpt """
+    @trim.setter
+    def trim(self, steps):
+        TAG = MCP7940.CLS_NAME+".trim(): setter "
+        if steps < -MCP7940.TRIM_MAX or steps > MCP7940.TRIM_MAX:
+            raise ValueError(TAG+f"trim {steps} out of range -{MCP7940.TRIM_MAX}...{MCP7940.TRIM_MAX}")
+        v = (1 << MCP7940.TRIM_SIGN_BIT) | steps if steps > 0 else -steps
+        self._write_reg(MCP7940.OSCTRIM_REGISTER, v)
+        if my_debug:
+            print(TAG+f"trim: {steps} ({steps * MCP7940.TRIM_PPM:.1f} ppm), OSCTRIM: {hex(v)}")
+
+    # Coarse trim mode: the trim is applied 128 times a second instead of once a minute,
+    # e.g. to measure the effect of a trim value quickly. With SQWEN set the MFP pin outputs 64 Hz.
+    # Not for normal use
+    """ Function added by @Paulskpt """
+    def set_CRSTRIM_bit(self, value=True):
+        return self._set_bit(MCP7940.RTCC_CONTROL_REGISTER, MCP7940.CRSTRIM_BIT, 1 if value else 0)
+
+    """ Function added by @Paulskpt """
+    def _read_CRSTRIM_bit(self):
+        return self._read_bit(MCP7940.RTCC_CONTROL_REGISTER, MCP7940.CRSTRIM_BIT)
+
     # Read ALMxPOL, ALMxIF or ALMxMSK bit(s)
     """ Function added by @Paulskpt """    
     def _read_ALM_POL_IF_MSK_bits(self, alarm_nr=None, itm=None):
@@ -769,22 +1061,16 @@ class MCP7940:
         elif alarm_nr == 2:
             ads = MCP7940.REGISTER_ALM2WKDAY
         
-        num_registers = 1
-        current = bytearray(num_registers)
-        try:
-            current = self._i2c.readfrom_mem(MCP7940.ADDRESS, ads, num_registers)
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1
-        
+        itm_mask = (0x80, 0x08, 0x70)[itm]
+        current = self._read_reg(ads, itm_mask)  # the IF bit will always be read from the MCP7940
         if my_debug:
             print(TAG+f"ALM{alarm_nr}{itm_dict[itm]}_bit current: {current}")
         if itm == 0:
-            ret = (current[0] & 0x80) >> 7
+            ret = (current & 0x80) >> 7
         elif itm == 1:
-            ret = (current[0] & 0x08) >> 3
+            ret = (current & 0x08) >> 3
         elif itm == 2:
-            ret = (current[0] & 0x70) >> 4
+            ret = (current & 0x70) >> 4
         
         if my_debug:
             print(TAG+"return value: {:d}, b\'{:08b}\'".format(ret, ret))
@@ -804,16 +1090,10 @@ class MCP7940:
         elif alarm_nr == 2:
             ads = MCP7940.REGISTER_ALM2WKDAY
         
-        num_registers = 1
-        current = bytearray(num_registers)
-        try:
-            current = self._i2c.readfrom_mem(MCP7940.ADDRESS, ads, num_registers)
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1
+        current = self._read_reg(ads, 0x80)
         if my_debug:
-            print(TAG+"for alarm{:d}: WEEKDAY register status before change: b\'{:08b}\'".format(alarm_nr, current[0]))
-        almpol = (current[0] & 0x80) >> 7
+            print(TAG+"for alarm{:d}: WEEKDAY register status before change: b\'{:08b}\'".format(alarm_nr, current))
+        almpol = (current & 0x80) >> 7
         if almpol == 0:  # Only set if not yet set
             self._set_bit(ads, MCP7940.ALMPOL_BIT, 1)
             if my_debug:
@@ -833,10 +1113,6 @@ class MCP7940:
         elif alarm_nr == 2:
             ads = MCP7940.REGISTER_ALM2WKDAY
         ret = self._set_bit(ads, MCP7940.ALMPOL_BIT, 0)
-        if ret == -1:
-            if my_debug:
-                print(TAG+self.sbf)
-            return ret
         return ret
     
     # See MCP7940 datasheet  DS20005010H-page 23, note 2
@@ -855,27 +1131,18 @@ class MCP7940:
         elif alarm_nr == 2:
             ads = MCP7940.REGISTER_ALM2WKDAY
 
-        num_registers = 1
-        current = bytearray(num_registers)
         reg_buf = bytearray()
         #reg_buf.append(ads)
-        out_buf = bytearray()
-        #out_buf.append(ads)
 
         # Get the current contents of the ALMxWKDAY register
-        try:
-            #self._i2c.writeto_then_readfrom(MCP7940.ADDRESS, reg_buf, current)
-            #self._i2c.writeto_mem(MCP7940.ADDRESS, ads, current)
-            #current = self._i2c.readfrom_mem(MCP7940.ADDRESS, ads, num_registers)
-            current = self._i2c.readfrom_mem(MCP7940.ADDRESS, ads, num_registers)
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1
-        
+        #self._i2c.writeto_then_readfrom(MCP7940.ADDRESS, reg_buf, current)
+        #self._i2c.writeto_mem(MCP7940.ADDRESS, ads, current)
+        #current = self._bus_read(ads, num_registers)
+        current = self._read_reg(ads, 0x08)  # The ALMxIF bit is volatile. Always read from the MCP7940
         if my_debug:
-            print(TAG+"received ALM{:d} weekday value register: lst(current): {}, value: 0x{:0x}, in binary: b\'{:08b}\'". \
-                format(alarm_nr, list(current), current[0], current[0]))
-        updated = current[0]
+            print(TAG+"received ALM{:d} weekday value register: value: 0x{:0x}, in binary: b\'{:08b}\'". \
+                format(alarm_nr, current, current))
+        updated = current
         ck_if_bit = updated & 0x08 # isolate b3
         ck_if_bit >> 3  # shift b3 to b0
         if ck_if_bit == 0: # bit already cleared. Nothing to do.
@@ -883,34 +1150,20 @@ class MCP7940:
                 print(TAG+f"ALM{alarm_nr}IF bit is already cleared.")
             return 1
         updated &= 0xF7 # clear the ALMxIF bit
-        out_buf.append(updated)
         
         if my_debug:
             print(TAG+"writing value, hex: 0x{:02x}, binary: b\'{:08b}\'".format(updated, updated) )
             
-        try:
-            self._i2c.writeto_mem(MCP7940.ADDRESS, ads, out_buf)  # send data
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1
-
+        self._write_reg(ads, updated)  # send data
+        num_registers = 1
         ck_buf = bytearray(num_registers)
-        try:
-            ck_buf = self._i2c.readfrom_mem(MCP7940.ADDRESS, ads, num_registers)
-            le = len(ck_buf)
-            if le < 2:
-                if my_debug:
-                    print(TAG+f"length ckeck weekday value register insufficient")
-                    return -1
-            ck_if_bit = ck_buf[0] & 0x08 # isolate b3
-            ck_if_bit >> 3  # shift b3 to b0
-            if my_debug:
-                print(TAG+"check weekday value register rcvd 2nd time: 0x{:02x}, IF bit: hex: 0x{:x}, binary: b\'{:b}\'". \
-                    format(ck_buf[0], ck_if_bit, ck_if_bit))
-                print()
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1
+        ck_buf = self._bus_read(ads, num_registers)  # check on the MCP7940 itself
+        ck_if_bit = ck_buf[0] & 0x08 # isolate b3
+        ck_if_bit >> 3  # shift b3 to b0
+        if my_debug:
+            print(TAG+"check weekday value register rcvd 2nd time: 0x{:02x}, IF bit: hex: 0x{:x}, binary: b\'{:b}\'". \
+                format(ck_buf[0], ck_if_bit, ck_if_bit))
+            print()
         return 1
     
     # Set the alarm mask (= alarm match) bits for alarm x
@@ -956,21 +1209,12 @@ class MCP7940:
         else:
             mask = 0x00 << 4 # seconds
         
-        num_registers = 1
-        current = bytearray(num_registers)       
-        out_buf = bytearray()
-        
-        try:
-            #self._i2c.writeto_mem(MCP7940.ADDRESS, ads, reg_buf)
-            current = self._i2c.readfrom_mem(MCP7940.ADDRESS, ads, num_registers)
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1
-            
+        #self._i2c.writeto_mem(MCP7940.ADDRESS, ads, reg_buf)
+        current = self._read_reg(ads, 0xF0)
         if my_debug:
-            print(TAG+"received ALM{:d}MSK_bits: lst(current): {}, value: 0x{:02x}, binary: b\'{:08b}\'". \
-                format(alarm_nr, list(current), current[0], current[0]))
-        updated = current[0]
+            print(TAG+"received ALM{:d}MSK_bits: value: 0x{:02x}, binary: b\'{:08b}\'". \
+                format(alarm_nr, current, current))
+        updated = current
         updated &= 0x8F  # mask bits b6-b4
         updated |= mask  # set for minutes
         
@@ -978,33 +1222,18 @@ class MCP7940:
             updated |= 0x80 # If the ALMPOL bit is 0 then set it
             if my_debug:
                 print(TAG+"setting also the ALMPOL bit: b\'{:08b}\'".format(updated))
-            
-        out_buf.append(updated)
         
         if my_debug:
             print(TAG+"writing value: 0x{:02x}, binary: b\'{:08b}\'".format(updated, updated))
             new_match_value = updated & 0x70 # isolate bits 6-4
             new_match_value = new_match_value >> 4
             print(TAG+f"= new_match_value: {new_match_value} = {self._match_lst_long[new_match_value]}")
-            print(TAG+f"out_buf: {out_buf}")
             
-        try:
-            self._i2c.writeto_mem(MCP7940.ADDRESS, ads, out_buf)  # send data
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1
-
-        num_registers = 1
-        ck_buf = bytearray(num_registers)
-        try:
-            ck_buf = self._i2c.readfrom_mem(MCP7940.ADDRESS, ads, num_registers)
-            if my_debug:
-                print(TAG+"check: list(ck_buf): {}, ck_buf[0] value: 0x{:02x}, binary: b\'{:08b}\'". \
-                    format(list(ck_buf), ck_buf[0], ck_buf[0]))
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1
-
+        self._write_reg(ads, updated)  # send data
+        ck_val = self._read_reg(ads, 0xF0)
+        if my_debug:
+            print(TAG+"check: value: 0x{:02x}, binary: b\'{:08b}\'". \
+                format(ck_val, ck_val))
         if my_debug and match_type >= 0 and match_type <= 7:
             print(TAG+"match type value set: 0x{:02x}, type of match: {:s}". \
                 format(match_type, self._match_lst[match_type]))
@@ -1023,7 +1252,6 @@ class MCP7940:
         num_registers = 7 if start_reg == 0x00 else 6
         if my_debug:
             print(TAG+f"param start_reg: {start_reg}, num_registers: {num_registers}")
-        time_reg = bytearray(num_registers)
         
         if start_reg == MCP7940.CONTROL_REGISTER:
             r = "control"
@@ -1045,52 +1273,132 @@ class MCP7940:
         if my_debug:
             print(TAG+f"using the MCP7940 {r} register")
             print(TAG+f"start_reg: {start_reg} ")
-            print(TAG+f"time_reg: {time_reg}")
-            print(TAG+f"list(time_reg): {list(time_reg)}")
         
-        lStop = False
         # --------------------------------------------------------------------------------------
         # GET THE TIMEKEEPING DATA FROM THE MCP7940 RTC SHIELD
         # --------------------------------------------------------------------------------------
-        try:
-            time_reg = self._i2c.readfrom_mem(MCP7940.ADDRESS, start_reg, num_registers)  # Reading too much here for alarms
-        except OSError as e:
-            print(TAG+f"Error: {e}") # . Trying again")
-            lStop = True
-        finally:
-            pass
+        if start_reg == MCP7940.RTCSEC:
+            time_reg = self._tk_buf
+            self._bus_read_into(start_reg, time_reg)
+        else:
+            time_reg = self._read_regs(start_reg, num_registers)  # Reading too much here for alarms
         # --------------------------------------------------------------------------------------
-        if lStop:
-            return (0,)
-        #             yy    mo    mday  hh    mm    ss    wd
-        reg_filter = (0x7F, 0x7F, 0x3F, 0x07, 0x3F, 0x3F, 0xFF)[:num_registers]
-        if my_debug:
-            print(time_reg)
-            print(reg_filter)
-        t = [self.bcd_to_int(reg & filt) for reg, filt in zip(time_reg, reg_filter)]
-        # Reorder
-        hh = t[MCP7940.RTCHOUR]
-        if my_debug:
-            print(TAG+f"self._is_12hr: {self._is_12hr}")
-            print(TAG+"hh: {:2d}, b\'{:08b}\'".format(hh, hh))
-        if self._is_12hr:
-            hh &= 0x1F  # mask 12/24 bit and mask AM/PM bit
-            #if hh >= 12:
-            #    hh -= 12
-        
-        if my_debug:
-            print(TAG+"hh (bits 7-5 masked): {:2d}, b\'{:08b}\'".format(hh, hh))
-            print(TAG+f"length t: {t}")
-        t2 = (t[MCP7940.RTCMTH], t[MCP7940.RTCDATE], hh, t[MCP7940.RTCMIN], t[MCP7940.RTCSEC], t[MCP7940.RTCWKDAY])
-        t3 = (t[MCP7940.RTCYEAR] + 2000,) + t2 if num_registers == 7 else t2
+        return self._decode_time(time_reg)
+
+    # Decode the 7 timekeeping registers or the 6 registers of an alarm
+    # Called from _mcpget_time() and from class Snapshot
+    """ Function added by @Paulskpt """
+    def _decode_time(self, time_reg):
+        TAG = MCP7940.CLS_NAME+"._decode_time():   "
+        if len(time_reg) == 7:
+            t3 = codec.unpack_time(time_reg)
+        else:
+            t3 = codec.unpack_alarm(time_reg)
         # now = (2019, 7, 16, 15, 29, 14, 6, 167)  # Sunday 2019/7/16 3:29:14pm (yearday=167)
         # year, month, date, hours, minutes, seconds, weekday, yearday = t
-        # time_reg = [seconds, minutes, hours, weekday, date, month, year % 100]
 
         if my_debug:
-            print(TAG+f"returning result t3: {t3}")
+            print(TAG+f"time_reg: {list(time_reg)}, returning result t3: {t3}")
         return t3
     
+    # Read the timekeeping registers into the caller's param dt,
+    # e.g. an array('H', [0]*7) or a list of 7 items, allocated once by the caller.
+    # dt will be filled with: year, month, mday, hour, minute, second, weekday
+    # and, if dt has 8 or more items, yearday (as utime.localtime())
+    # This function allocates no memory (the I2C read goes into a preallocated buffer),
+    # so it can be called from a soft IRQ (micropython.schedule()) and it does not cause gc pauses.
+    # Returns 1. Raises MCP7940BusError if reading failed
+    """ Function added by @Paulskpt """
+    def read_time_into(self, dt):
+        buf = self._tk_buf
+        self._bus_read_into(MCP7940.RTCSEC, buf)
+        if len(dt) >= 8:
+            codec.unpack_localtime(buf, dt)
+        else:
+            codec.unpack_time(buf, dt)
+        return 1
+
+    # Return the MCP7940 time in the format of utime.localtime():
+    # (year, month, mday, hour, minute, second, weekday, yearday), with one I2C read
+    """ Function added by @Paulskpt """
+    def localtime(self):
+        buf = self._tk_buf
+        self._bus_read_into(MCP7940.RTCSEC, buf)
+        return codec.unpack_localtime(buf)
+
+    # Return the MCP7940 time as a MCP7940.Timestamp, read in one I2C transaction.
+    # Its derived fields (weekday name, yearday, 12 hour format, ISO string, epoch) need no more I2C reads.
+    # Raises MCP7940BusError if reading failed
+    """ Function added by @Paulskpt """
+    def now(self):
+        buf = self._tk_buf
+        self._bus_read_into(MCP7940.RTCSEC, buf)
+        return MCP7940.Timestamp(buf)
+
+    # Return the MCP7940 time as seconds since 2000-01-01 (the epoch of utime.time() on most ports).
+    # Calculated directly from the register buffer: no tuples and no memory allocation.
+    # Raises MCP7940BusError if reading failed
+    """ Function added by @Paulskpt """
+    def time(self):
+        buf = self._tk_buf
+        self._bus_read_into(MCP7940.RTCSEC, buf)
+        return codec.regs_to_secs(buf)
+
+    # Set the MCP7940 time from param secs: seconds since 2000-01-01, e.g. utime.time() + UTC offset.
+    # Like the mcptime setter: the oscillator is stopped, the registers are written and checked and the
+    # oscillator is started again, also when writing or checking failed.
+    # Raises MCP7940VerifyError if the read back time differs
+    """ Function added by @Paulskpt """
+    def set_time_epoch(self, secs):
+        TAG = MCP7940.CLS_NAME+".set_time_epoch(): "
+        self.stop()  # See:  MCP7940 DATASHEET: DS20005010H-page 15
+        try:
+            self._write_regs(MCP7940.RTCSEC, codec.secs_to_regs(secs, self._tk_buf))
+            ck = self.time()
+            if ck != secs:
+                raise MCP7940VerifyError(TAG+f"wrote: {secs}, read back: {ck}")
+            self.time_is_set = True
+        finally:
+            self.start()
+
+    # Set the MCP7940 time to param secs exactly at time.ticks_ms() t_edge, e.g. the start of the next second
+    # of a reference clock (see upd_clocks() in main.py). The oscillator is stopped and the registers are
+    # written and checked before t_edge. At t_edge one write sets the ST bit: the MCP7940 starts counting second secs.
+    # Param lead_ms: start the oscillator this much earlier, for its start up time (default: self.start_lead_ms).
+    # Returns how many mSec the start was late (negative: early). Raises MCP7940VerifyError if the read back time differs.
+    # When writing or checking fails, the oscillator is started again at once
+    """ Function added by @Paulskpt """
+    def set_time_epoch_at(self, secs, t_edge, lead_ms=None):
+        TAG = MCP7940.CLS_NAME+".set_time_epoch_at(): "
+        if lead_ms is None:
+            lead_ms = self.start_lead_ms
+        self.stop()  # See:  MCP7940 DATASHEET: DS20005010H-page 15
+        started = False
+        try:
+            buf = self._tk_buf
+            self._write_regs(MCP7940.RTCSEC, codec.secs_to_regs(secs, buf))
+            ck = self.time()  # the oscillator is stopped: the registers do not change until the start
+            if ck != secs:
+                raise MCP7940VerifyError(TAG+f"wrote: {secs}, read back: {ck}")
+            st = bytes((buf[codec.SEC] | (1 << MCP7940.ST),))
+            t_start = time.ticks_add(t_edge, -lead_ms)
+            w = time.ticks_diff(t_start, time.ticks_ms())
+            if w > 2:
+                time.sleep_ms(w - 2)
+            while time.ticks_diff(t_start, time.ticks_ms()) > 0:  # the last mSecs: busy wait
+                pass
+            self._write_regs(MCP7940.RTCSEC, st)
+            started = True
+        finally:
+            if not started:
+                self.start()  # also after a MCP7940Error: don't leave the oscillator stopped
+        late = time.ticks_diff(time.ticks_ms(), t_start)
+        self.time_is_set = True
+        self._wait_oscrun(1, None, TAG)
+        if my_debug:
+            print(TAG+f"started {late} mSec after the edge")
+        return late
+
     # Read the datetime stamps of the pwr down / pwr up events
     """ Function added by @Paulskpt """
     def pwr_updn_dt(self, pwr_updn=True): # power up is default
@@ -1104,83 +1412,52 @@ class MCP7940:
         num_registers = 4
         time_reg = bytearray(num_registers)
         
-        try:
-            time_reg = self._i2c.readfrom_mem(MCP7940.ADDRESS, ads, num_registers)
-            if my_debug:
-                s = "up" if pwr_updn else "down"
-                print(TAG+f"received MCP7940 power {s} timestamp: {list(time_reg)}")
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return (0,)
-
-        #             min   hr    date  wd/month
-        reg_filter = (0x7F, 0x3F, 0x3F, 0xFF)[:num_registers]
-        if my_debug:
-            print(TAG+f"time_reg: {time_reg}")
-            print(TAG+f"reg_filter: {reg_filter}")
-        t = [self.bcd_to_int(reg & filt) for reg, filt in zip(time_reg, reg_filter)]
-
-        # extract 12/24  flag (True = 12, False = 24)
-        _12hr = t[MCP7940.PWRMIN] & 0x40 # (0x40 = 0100 0000)
-        _12hr = _12hr >> 6 # move b01000000 to b00000001
-        # print(TAG+"{:s} hour format".format("12" if _12hr else "24")))
-        # AM/PM flag (True = PM, False = AM)
-        _AMPM = t[MCP7940.PWRMIN] & 0x20 # (0x20 = 0010 0000)
-        _AMPM = _AMPM >> 5 # move b00100000 to b00000001
-        #if _12hr:
-        #    print("time: {:s}".format("PM" if _AMPM else "AM"))
-        
-        # extract weekday:
-        wd  = t[MCP7940.PWRMTH] & 0xE0  # (0xE0 = b1110 0000)
-        wd = wd >> 5  # move b11100000 to b00000111
-        # extract month
-        mth = t[MCP7940.PWRMTH] & 0x1F  # (0x1F = b0001 1111)
+        time_reg = self._bus_read(ads, num_registers)
         if my_debug:
-            print(TAG+f"t: {t}")
-        # Reorder
-        t2 = (mth, t[MCP7940.PWRDATE], t[MCP7940.PWRHOUR], t[MCP7940.PWRMIN], wd)
-       
-        if _12hr:
-            t3 = "PM" if _AMPM else "AM"
-            t2 += (t3,) 
-        else:
-            t3 = ""
-            
-        if my_debug:
-            print(TAG+f"result: {t2} {t3}")
+            s = "up" if pwr_updn else "down"
+            print(TAG+f"received MCP7940 power {s} timestamp: {list(time_reg)}")
+        return self._decode_pwrstamp(time_reg)
 
+    # Decode the 4 registers of a power-down or power-up timestamp
+    # Called from pwr_updn_dt() and from class Snapshot
+    """ Function added by @Paulskpt """
+    def _decode_pwrstamp(self, time_reg):
+        TAG = MCP7940.CLS_NAME+"._decode_pwrstamp(): "
+        t2 = codec.unpack_pwrstamp(time_reg)
+        if my_debug:
+            print(TAG+f"time_reg: {list(time_reg)}, result: {t2}")
         return t2
     
+    # Read all RTCC registers 0x00-0x1F in one I2C transaction
+    # Returns a MCP7940.Snapshot object. Its fields are decoded only when used.
+    # Raises MCP7940BusError if reading failed
+    """ Function added by @Paulskpt """
+    def snapshot(self):
+        TAG = MCP7940.CLS_NAME+".snapshot(): "
+        snap = MCP7940.Snapshot(self)
+        self._bus_read_into(MCP7940.RTCSEC, snap.regs)
+        if self._cache:  # We have fresh values. Refresh the shadow cache with them
+            for r in range(MCP7940.CACHE_START, MCP7940.CACHE_END+1):
+                if self._cacheable(r):
+                    self._shadow[r] = snap.regs[r]
+                    self._shadow_ok[r] = 1
+        return snap
+
     # Clear the 64 bytes of SRAM space
     """ Function added by @Paulskpt """
     def clr_SRAM(self):
         TAG = MCP7940.CLS_NAME+".clr_SRAM(): "
-        ads = MCP7940.SRAM_START_ADDRESS
         out_buf = bytearray(0x40)
         if my_debug:
             print(TAG+f"length data to write to clear SRAM data: {hex(len(out_buf)-1)}")
-        try:
-            self._i2c.writeto_mem(MCP7940.ADDRESS, ads, out_buf)
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1
+        self.sram[:] = out_buf  # in write-back mode only the bytes that were not 0 are written, at flush()
         return 1
     
     # Print contents of the 64 bytes of SRAM space
     """ Function added by @Paulskpt """
     def show_SRAM(self):
         TAG = MCP7940.CLS_NAME+".show_SRAM(): "
-        reg_buf = bytearray(num_registers)
-        ads = MCP7940.SRAM_START_ADDRESS
-        num_registers = 0x40
-        in_buf = bytearray(num_registers) # 0x5F-0x20+1)
-        try:   
-            self._i2c.writeto_mem(MCP7940.ADDRESS, ads, reg_buf)
-            in_buf = self._i2c.readfrom_mem(MCP7940.ADDRESS, ads, num_registers)
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1
-        
+        in_buf = self.sram[:]  # one I2C transaction
         print(TAG+"Contents of SRAM:")
         le = len(in_buf)
         for _ in range(le):
@@ -1260,11 +1537,7 @@ class MCP7940:
         if my_debug:
             print(TAG+f"out_buf: {out_buf}, type: {type(out_buf)}, number of bytes to be written: {nr_bytes}")
             print(TAG+f"writing to SRAM: list(out_buf): {list(out_buf)}")
-        try:
-            self._i2c.writeto_mem(MCP7940.ADDRESS, ads, out_buf)  # Write the data to SRAM
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return -1
+        self.sram[0:le] = out_buf  # Write the data to SRAM. In write-back mode: at flush()
         return nr_bytes  # return nr_bytes to show command was successful
 
     # Read datetime stamp from SRAM
@@ -1277,12 +1550,7 @@ class MCP7940:
         
         if my_debug:
             print(TAG+f"\nbefore reading from SRAM, dt: {dt} = list(dt): {list(dt)}")
-        try:
-            dt = self._i2c.readfrom_mem(MCP7940.ADDRESS, ads, num_registers)
-        except OSError as e:
-            print(TAG+f"Error: {e}")
-            return (0,)
-
+        dt = self.sram[0:num_registers]
         if not dt:
             return (0,)  # Indicate received 0 bytes
         if len(dt) == 0:
@@ -1309,40 +1577,441 @@ class MCP7940:
             print()
         return dt2
     
+    """ Function modified by @Paulskpt """
     def pr_regs(self):
-        # display the device values for the bits
-        print(f"pr_regs(): {list(self.dt_sram)}")
+        # display the contents of the SRAM
+        print(f"pr_regs(): {list(self.sram[:])}")
+
+
+
+    # Contents of the registers 0x00-0x1F read by MCP7940.snapshot()
+    # The names of the methods follow those of class MCP7940
+    """ Class added by @Paulskpt """
+    class Snapshot:
+
+        def __init__(self, mcp):
+            self._mcp = mcp
+            self.regs = bytearray(MCP7940.POWER_FAIL_TIMESTAMP_END+1)
+
+        def _bit(self, register, bit):
+            return (self.regs[register] >> bit) & 1
+
+        # Same format as MCP7940.mcptime
+        @property
+        def mcptime(self):
+            return self._mcp._decode_time(self.regs[MCP7940.TIME_AND_DATE_START:MCP7940.TIME_AND_DATE_END+1])
+
+        def _is_started(self):
+            return self._bit(MCP7940.RTCSEC, MCP7940.ST)
+
+        def is_osc_running(self):
+            return self._bit(MCP7940.RTCWKDAY, MCP7940.OSCRUN_BIT)
+
+        def has_pwr_failed(self):
+            return self._bit(MCP7940.RTCWKDAY, MCP7940.PWRFAIL_BIT)
+
+        def _is_battery_backup_enabled(self):
+            return self._bit(MCP7940.RTCWKDAY, MCP7940.VBATEN)
+
+        # Contents of the RTCC control register (0x07)
+        @property
+        def control(self):
+            return self.regs[MCP7940.RTCC_CONTROL_REGISTER]
+
+        # Contents of the OSCTRIM register (0x08)
+        @property
+        def raw_trim(self):
+            return self.regs[MCP7940.OSCTRIM_REGISTER]
+
+        # The trim in signed steps, like MCP7940.trim
+        @property
+        def trim(self):
+            v = self.regs[MCP7940.OSCTRIM_REGISTER]
+            return v & MCP7940.TRIM_MAX if v >> MCP7940.TRIM_SIGN_BIT else -(v & MCP7940.TRIM_MAX)
+
+        def _read_SQWEN_bit(self):
+            return self._bit(MCP7940.RTCC_CONTROL_REGISTER, MCP7940.SQWEN_BIT)
+
+        def alarm_is_enabled(self, alarm_nr=None):
+            if not alarm_nr in [1, 2]:
+                return
+            bit = MCP7940.ALARM1EN_BIT if alarm_nr == 1 else MCP7940.ALARM2EN_BIT
+            return self._bit(MCP7940.RTCC_CONTROL_REGISTER, bit)
+
+        # Same format as MCP7940.alarm1 and MCP7940.alarm2
+        def alarm(self, alarm_nr=None):
+            if not alarm_nr in [1, 2]:
+                return (0,)
+            ads = MCP7940.ALARM1_START if alarm_nr == 1 else MCP7940.ALARM2_START
+            return self._mcp._decode_time(self.regs[ads:ads+6])
+
+        # itm: 0 = ALMPOL, 1 = ALMxIF, 2 = ALMxMSK. See MCP7940._read_ALM_POL_IF_MSK_bits()
+        def _read_ALM_POL_IF_MSK_bits(self, alarm_nr=None, itm=None):
+            if not alarm_nr in [1, 2]:
+                return -1
+            if not itm in [0, 1, 2]:
+                return -1
+            ads = MCP7940.REGISTER_ALM1WKDAY if alarm_nr == 1 else MCP7940.REGISTER_ALM2WKDAY
+            current = self.regs[ads]
+            if itm == 0:
+                return (current & 0x80) >> 7
+            elif itm == 1:
+                return (current & 0x08) >> 3
+            return (current & 0x70) >> 4
+
+        # Same format as MCP7940.pwr_updn_dt()
+        def pwr_updn_dt(self, pwr_updn=True):
+            ads = MCP7940.PWRUP_ADDRESS if pwr_updn else MCP7940.PWRDN_ADDRESS
+            return self._mcp._decode_pwrstamp(self.regs[ads:ads+4])
+
+    # An MCP7940 time, read with one I2C transaction by MCP7940.now(). Holds a copy of the 7 timekeeping registers.
+    # Read only. The derived fields are computed when used; the tuple, the ISO string and the epoch only once.
+    # Indexing, len() and iteration work like the 8-tuple of utime.localtime() (see MCP7940.localtime()).
+    # The hour is 24 hour format, as stored in the MCP7940. hour12 and am_pm are for the 12 hour display
+    # Param ms: the mSec within the second, if known (see InterpClock.now() in mcp7940_clock.py)
+    """ Class added by @Paulskpt """
+    class Timestamp:
+
+        def __init__(self, regs, ms=0):
+            self._regs = bytes(regs)
+            self.ms = ms
+            self._lt = None
+            self._iso = None
+            self._epoch = None
+
+        @property
+        def regs(self):
+            return self._regs
+
+        # (year, month, mday, hour, minute, second, weekday, yearday)
+        @property
+        def localtime(self):
+            if self._lt is None:
+                self._lt = codec.unpack_localtime(self._regs)
+            return self._lt
+
+        def __len__(self):
+            return 8
+
+        def __getitem__(self, i):
+            return self.localtime[i]
+
+        def __iter__(self):
+            return iter(self.localtime)
+
+        def __eq__(self, other):
+            if isinstance(other, MCP7940.Timestamp):
+                return self._regs == other._regs
+            return self.localtime == tuple(other)
 
+        def __repr__(self):
+            return "Timestamp({})".format(self.iso)
 
+        @property
+        def year(self):
+            return 2000 + codec.BCD_TO_INT[self._regs[codec.YEAR]]
 
-    # This class is not used?
+        @property
+        def month(self):
+            return codec.BCD_TO_INT[self._regs[codec.MTH] & 0x1F]
+
+        @property
+        def mday(self):
+            return codec.BCD_TO_INT[self._regs[codec.DATE] & 0x3F]
+
+        @property
+        def hour(self):
+            return codec.BCD_TO_INT[self._regs[codec.HOUR] & 0x3F]
+
+        @property
+        def minute(self):
+            return codec.BCD_TO_INT[self._regs[codec.MIN] & 0x7F]
+
+        @property
+        def second(self):
+            return codec.BCD_TO_INT[self._regs[codec.SEC] & 0x7F]
+
+        # 0 = Monday. See MCP7940.DOW
+        @property
+        def weekday(self):
+            return self._regs[codec.WKDAY] & 0x07
+
+        @property
+        def weekday_S(self):
+            return MCP7940.DOW.get(self.weekday, "")
+
+        @property
+        def yearday(self):
+            return codec.yearday(self.year, self.month, self.mday)
+
+        # 1...12
+        @property
+        def hour12(self):
+            h = self.hour % 12
+            return h if h else 12
+
+        @property
+        def is_PM(self):
+            return 1 if self.hour >= 12 else 0
+
+        @property
+        def am_pm(self):
+            return "PM" if self.hour >= 12 else "AM"
+
+        # "2023-08-16T15:29:14"
+        @property
+        def iso(self):
+            if self._iso is None:
+                self._iso = "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}".format(
+                    self.year, self.month, self.mday, self.hour, self.minute, self.second)
+            return self._iso
+
+        # Seconds since 2000-01-01. See MCP7940.time()
+        @property
+        def epoch(self):
+            if self._epoch is None:
+                self._epoch = codec.regs_to_secs(self._regs)
+            return self._epoch
+
+    # The 64 bytes of battery backed SRAM (0x20-0x5F) as a sequence of bytes: mcp.sram
+    # - mcp.sram[5], mcp.sram[0:7], mcp.sram[::2]: a slice is read in one I2C transaction
+    #   (also a slice with a step: the bytes in between are read and skipped)
+    # - mcp.sram[5] = 0xAA, mcp.sram[0:3] = b'abc': a contiguous slice is written in one transaction.
+    #   A slice with a step is written as a read and a write of the covered range (2 transactions),
+    #   unless writing the bytes one by one takes fewer transactions
+    # - mcp.sram.readinto(buf, offset) and mcp.sram.write(offset, buf): block I/O
+    # Offsets are relative to the start of the SRAM (0 = register 0x20)
+    #
+    # Write-back mode (param sram_writeback of MCP7940.__init__()):
+    # A copy of the SRAM is read once. Reads are served from the copy. Assignments (mcp.sram[...] = ...)
+    # only change the copy and mark the bytes that really changed as dirty. flush() writes the dirty spans,
+    # merged when the gap between them is at most MERGE_GAP bytes (cheaper than a new transaction).
+    # - auto_flush_ms > 0 (param sram_flush_ms): an assignment or poll() flushes when the oldest dirty byte is older than this.
+    #   To flush on a timer, call poll() from it (via micropython.schedule()).
+    # - flush_on_exit (param sram_flush_on_exit of MCP7940.__init__()): flush at sys.exit() (if the port has sys.atexit()).
+    # - 'with mcp.sram:' flushes at the end of the block.
+    # write() is always written through at once, e.g. for the journal in mcp7940_journal.py, which depends on
+    # the order of its writes.
+    """ Class rewritten by @Paulskpt """
     class DATA:
-        
-        def __init__(self, i2c, address):
-            self._i2c = i2c
-            self._address = address
-            self._memory_start = 0x20
-            #self._memory_start = const(0x20)
+
+        SIZE = 0x40
+        MERGE_GAP = 2  # an I2C write transaction costs ~3 bytes (address, register) before the data
+
+        def __init__(self, mcp, writeback=False, auto_flush_ms=0, flush_on_exit=False):
+            self._mcp = mcp
+            self._memory_start = MCP7940.SRAM_START
+            self._wb = writeback
+            self._mirror = bytearray(MCP7940.DATA.SIZE) if writeback else None
+            self._loaded = False
+            self._dirty = bytearray(MCP7940.DATA.SIZE)  # 1 = byte changed in the copy, not yet written
+            self._n_dirty = 0
+            self._t_dirty = 0  # time.ticks_ms() when the first byte became dirty
+            self.auto_flush_ms = auto_flush_ms
+            self.flushes = 0  # number of write transactions done by flush()
+            self._claims = []  # [(start, end, name), ...] see claim()
+            if writeback and flush_on_exit:
+                try:
+                    import sys
+                    sys.atexit(self.flush)
+                except (ImportError, AttributeError):
+                    import atexit  # CPython
+                    atexit.register(self.flush)
+
+        def __len__(self):
+            return MCP7940.DATA.SIZE
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self.flush()
+
+        # Return the offsets of a slice in ascending order
+        def _indices(self, key):
+            idx = list(range(MCP7940.DATA.SIZE)[key])
+            if key.step is not None and key.step < 0:
+                idx.reverse()
+            return idx
+
+        # Is the (ascending) list of offsets one contiguous block?
+        def _contiguous(self, idx):
+            return idx[-1] - idx[0] + 1 == len(idx)
+
+        def _check(self, offset, n):
+            if offset < 0 or n < 0 or offset + n > MCP7940.DATA.SIZE:
+                raise IndexError("SRAM offset out of range")
+
+        # Read the SRAM into the copy (write-back mode), once
+        def _load(self):
+            if not self._loaded:
+                self._mcp._bus_read_into(self._memory_start, self._mirror)
+                self._loaded = True
+
+        # Change one byte of the copy (write-back mode)
+        def _put(self, offset, value):
+            if self._mirror[offset] == value:
+                return
+            self._mirror[offset] = value
+            if not self._dirty[offset]:
+                if not self._n_dirty:
+                    self._t_dirty = time.ticks_ms()
+                self._dirty[offset] = 1
+                self._n_dirty += 1
 
         def __getitem__(self, key):
-            get_byte = lambda x: self._i2c.readfrom_mem(self._address, x + self._memory_start, 1)(x)
-            if type(key) is int:
-                if my_debug:
-                    print('key: {}'.format(key))
-                return get_byte(key)
-            elif type(key) is slice:
+            if isinstance(key, int):
+                if key < 0:
+                    key += MCP7940.DATA.SIZE
+                self._check(key, 1)
+                if self._wb:
+                    self._load()
+                    return self._mirror[key]
+                return self._mcp._bus_read(self._memory_start + key, 1)[0]
+            if isinstance(key, slice):
+                idx = self._indices(key)
+                if len(idx) == 0:
+                    return b""
                 if my_debug:
                     print('start: {} stop: {} step: {}'.format(key.start, key.stop, key.step))
-                    # fixme: Could be more efficient if we check for a contiguous block
-                    # Loop over range(64)[slice]
-                    return [get_byte(i) for i in range(64)[key]]
-
-            def __setitem__(self, key, value):
-                if type(key) is int:
-                    if my_debug:
-                        print('key: {}'.format(key))
-                elif type(key) is slice:
-                    if my_debug:
-                        print('start: {} stop: {} step: {}'.format(key.start, key.stop, key.step))
-                if my_debug:
-                    print(value)
+                start = idx[0]
+                if self._wb:
+                    self._load()
+                    buf = self._mirror[start:idx[-1] + 1]
+                else:
+                    buf = self._mcp._bus_read(self._memory_start + start, idx[-1] - start + 1)
+                if key.step is not None and key.step < 0:
+                    idx.reverse()
+                elif self._contiguous(idx):
+                    return bytes(buf)
+                return bytes([buf[i - start] for i in idx])
+            raise TypeError("SRAM indices must be integers or slices")
+
+        def __setitem__(self, key, value):
+            if isinstance(key, int):
+                if key < 0:
+                    key += MCP7940.DATA.SIZE
+                self._check(key, 1)
+                if self._wb:
+                    self._load()
+                    self._put(key, value)
+                    self.poll()
+                    return
+                self._mcp._bus_write(self._memory_start + key, bytes([value]))
+                return
+            if not isinstance(key, slice):
+                raise TypeError("SRAM indices must be integers or slices")
+            idx = self._indices(key)
+            if key.step is not None and key.step < 0:
+                value = bytes(reversed(value))
+            if len(value) != len(idx):
+                raise ValueError("SRAM slice assignment cannot change the size")
+            if len(idx) == 0:
+                return
+            if my_debug:
+                print('start: {} stop: {} step: {}'.format(key.start, key.stop, key.step))
+            if self._wb:
+                self._load()
+                for i in range(len(idx)):
+                    self._put(idx[i], value[i])
+                self.poll()
+            elif self._contiguous(idx):
+                self._mcp._bus_write(self._memory_start + idx[0], value)
+            elif len(idx) <= 2:
+                for i in range(len(idx)):
+                    self._mcp._bus_write(self._memory_start + idx[i], bytes([value[i]]))
+            else:
+                # read the covered range, merge and write it back: 2 transactions
+                start = idx[0]
+                buf = bytearray(self._mcp._bus_read(self._memory_start + start, idx[-1] - start + 1))
+                for i in range(len(idx)):
+                    buf[idx[i] - start] = value[i]
+                self._mcp._bus_write(self._memory_start + start, buf)
+
+        # Read len(buf) bytes, from param offset, into buf (a bytearray or memoryview)
+        def readinto(self, buf, offset=0):
+            n = len(buf)
+            self._check(offset, n)
+            if self._wb:
+                self._load()
+                buf[:] = self._mirror[offset:offset + n]
+            else:
+                self._mcp._bus_read_into(self._memory_start + offset, buf)
+            return n
+
+        # Write the bytes of buf from param offset. Always written through, also in write-back mode
+        def write(self, offset, buf):
+            n = len(buf)
+            self._check(offset, n)
+            self._mcp._bus_write(self._memory_start + offset, buf)
+            if self._wb and self._loaded:
+                for i in range(n):
+                    self._mirror[offset + i] = buf[i]
+                    if self._dirty[offset + i]:
+                        self._dirty[offset + i] = 0
+                        self._n_dirty -= 1
+            return n
+
+        # Return the dirty spans [(offset, length), ...] as flush() would write them
+        def dirty_spans(self):
+            spans = []
+            if not self._n_dirty:
+                return spans
+            dirty = self._dirty
+            start = -1
+            last = -1
+            for i in range(MCP7940.DATA.SIZE):
+                if not dirty[i]:
+                    continue
+                if start < 0:
+                    start = i
+                elif i - last - 1 > MCP7940.DATA.MERGE_GAP:
+                    spans.append((start, last - start + 1))
+                    start = i
+                last = i
+            spans.append((start, last - start + 1))
+            return spans
+
+        # Write the dirty spans. Returns the number of I2C transactions
+        def flush(self):
+            TAG = MCP7940.CLS_NAME+".DATA.flush(): "
+            spans = self.dirty_spans()
+            mv = memoryview(self._mirror) if spans else None
+            for ofs, n in spans:
+                self._mcp._bus_write(self._memory_start + ofs, mv[ofs:ofs + n])
+                for i in range(ofs, ofs + n):
+                    self._dirty[i] = 0
+            self._n_dirty = 0
+            self.flushes += len(spans)
+            if my_debug and spans:
+                print(TAG+f"spans written: {spans}")
+            return len(spans)
+
+        # Flush when the oldest change is older than auto_flush_ms
+        def poll(self):
+            if self._n_dirty and self.auto_flush_ms > 0 and \
+                    time.ticks_diff(time.ticks_ms(), self._t_dirty) >= self.auto_flush_ms:
+                return self.flush()
+            return 0
+
+        # Reserve registers param start up to start + size for param name, e.g. the journal.
+        # Raises ValueError if they are not in 0x20-0x5F or overlap a part claimed by another user.
+        # Claiming the same part with the same name again (e.g. a new SRAMJournal object) is allowed
+        def claim(self, start, size, name):
+            end = start + size
+            if start < MCP7940.SRAM_START or end > MCP7940.SRAM_END + 1:
+                raise ValueError("{} does not fit in SRAM 0x20-0x5F".format(name))
+            for s, e, n in self._claims:
+                if s == start and e == end and n == name:
+                    return
+                if start < e and s < end:
+                    raise ValueError("{} ({}-{}) overlaps {} ({}-{}) in SRAM".format(
+                        name, hex(start), hex(end - 1), n, hex(s), hex(e - 1)))
+            self._claims.append((start, end, name))
+
+        # Forget the copy, e.g. after another I2C master changed the SRAM. Unwritten changes are lost
+        def invalidate(self):
+            self._loaded = False
+            for i in range(MCP7940.DATA.SIZE):
+                self._dirty[i] = 0
+            self._n_dirty = 0
@@ -0,0 +1,132 @@
+#
+# uasyncio version of class MCP7940 (file: mcp7940.py)
+# (c) 2023 Paulus Schulinck (@Paulskpt on GitHub)
+# License: MIT
+#
+# Class AsyncMCP7940 is a subclass of class MCP7940. All functions of MCP7940 are still there (blocking).
+# The awaitable functions:
+# - hold an asyncio Lock around each I2C access, so tasks sharing the I2C bus don't interfere.
+#   Pass the same lock to the drivers of the other devices on the bus (param `lock`).
+# - yield to the event loop while the oscillator starts or stops (start_async(), stop_async()),
+#   instead of sleeping like MCP7940.start() and MCP7940.stop().
+#   Setting the time (set_time_async()) holds the lock from stop to start,
+#   so no other task reads a half written time.
+#
+# Example usage:
+#
+#     import uasyncio as asyncio
+#     from mcp7940_async import AsyncMCP7940
+#     mcp = AsyncMCP7940(i2c)
+#
+#     async def clock_task():
+#         while True:
+#             print(await mcp.get_time_async())
+#             await asyncio.sleep(1)
+#
+# To call any other MCP7940 function with the lock held:
+#     await mcp.call_async(mcp.alarm_enable, 1, True)
+#
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # CPython
+import time
+from mcp7940 import MCP7940, MCP7940TimeoutError
+
+my_debug = False
+
+if hasattr(asyncio, "sleep_ms"):
+    _sleep_ms = asyncio.sleep_ms
+else:
+    def _sleep_ms(ms):
+        return asyncio.sleep(ms / 1000)
+
+class AsyncMCP7940(MCP7940):
+
+    CLS_NAME = "AsyncMCP7940"
+
+    def __init__(self, i2c, lock=None, **kwargs):
+        super().__init__(i2c, **kwargs)
+        self.lock = lock if lock is not None else asyncio.Lock()
+
+    # Call MCP7940 function fn with the lock held and return its result
+    async def call_async(self, fn, *args):
+        async with self.lock:
+            return fn(*args)
+
+    async def get_time_async(self):
+        async with self.lock:
+            return self._mcpget_time()
+
+    # Allocation-free. See MCP7940.read_time_into()
+    async def read_time_into_async(self, dt):
+        async with self.lock:
+            return self.read_time_into(dt)
+
+    # Param t: a time tuple like utime.localtime()
+    async def set_time_async(self, t):
+        async with self.lock:
+            await self._start_stop(0, None)  # See:  MCP7940 DATASHEET: DS20005010H-page 15
+            try:
+                self._write_time(t)
+            finally:
+                await self._start_stop(1, None)
+
+    async def start_async(self, deadline_ms=None):
+        async with self.lock:
+            return await self._start_stop(1, deadline_ms)
+
+    async def stop_async(self, deadline_ms=None):
+        async with self.lock:
+            return await self._start_stop(0, deadline_ms)
+
+    # Param alarm_nr: 1 or 2
+    async def get_alarm_async(self, alarm_nr):
+        async with self.lock:
+            return self.alarm1 if alarm_nr == 1 else self.alarm2
+
+    # Param alarm_nr: 1 or 2. Param t: see the MCP7940.alarm1 setter
+    async def set_alarm_async(self, alarm_nr, t):
+        async with self.lock:
+            if alarm_nr == 1:
+                self.alarm1 = t
+            else:
+                self.alarm2 = t
+
+    async def write_to_SRAM_async(self, dt):
+        async with self.lock:
+            return self.write_to_SRAM(dt)
+
+    async def read_fm_SRAM_async(self):
+        async with self.lock:
+            return self.read_fm_SRAM()
+
+    async def snapshot_async(self):
+        async with self.lock:
+            return self.snapshot()
+
+    # Set the ST bit and wait, without blocking the event loop, until the OSCRUN bit has the same value.
+    # Same deadline and backoff as MCP7940._wait_oscrun(). Expects the lock to be held.
+    async def _start_stop(self, running, deadline_ms):
+        TAG = AsyncMCP7940.CLS_NAME+(".start_async(): " if running else ".stop_async(): ")
+        if deadline_ms is None:
+            deadline_ms = MCP7940.OSC_DEADLINE_MS
+        self._set_bit(MCP7940.RTCSEC, MCP7940.ST, running)
+        t_start = time.ticks_ms()
+        delay = MCP7940.OSC_POLL_MIN_MS
+        polls = 0
+        while True:
+            await _sleep_ms(delay)
+            osc_run_bit = self._read_bit(MCP7940.RTCWKDAY, MCP7940.OSCRUN_BIT)
+            polls += 1
+            elapsed = time.ticks_diff(time.ticks_ms(), t_start)
+            if osc_run_bit == running:
+                break
+            if elapsed >= deadline_ms:
+                raise MCP7940TimeoutError(TAG+"OSCRUN bit not {:d} after {:d} mSec ({:d} polls)".format(running, elapsed, polls))
+            delay = min(delay * 2, MCP7940.OSC_POLL_MAX_MS, max(deadline_ms - elapsed, 1))
+        self.osc_settle_ms = elapsed
+        self.osc_polls = polls
+        if my_debug:
+            print(TAG+f"osc_run_bit: {osc_run_bit} after {elapsed} mSec ({polls} polls)")
+        return osc_run_bit
@@ -0,0 +1,172 @@
+#
+# Interpolated clock on top of the MCP7940 (file: mcp7940.py)
+# (c) 2023 Paulus Schulinck (@Paulskpt on GitHub)
+# License: MIT
+#
+# The MCP7940 counts whole seconds. Reading it several times a second (display, logging, main loop)
+# costs an I2C transaction each time and gives the same second over and over.
+# Class InterpClock reads the MCP7940 once, anchors that reading to time.ticks_ms()
+# and answers time_ms(), time(), localtime() and now() from the ticks, without I2C.
+# - sync(): anchors the clock. With align=True it waits (max. align_timeout_ms) until the seconds register
+#   rolls over, so the anchor is exact to a few mSec. Done at the first use and after invalidate().
+#   When there is no rollover in that time, the clock is anchored at the first read (aligned stays False,
+#   align_fails counts it).
+# - Every resync_ms the MCP7940 is read again (one I2C transaction) and the clock is pulled back into the
+#   second the MCP7940 shows. When the seconds register rolled over earlier than expected, the clock steps
+#   to the start of that second, so the sub-second phase is also kept right without waiting.
+#   This bounds the drift of the CPU clock to what it gains or loses in resync_ms.
+# - The returned time never goes back: when the clock was ahead, it holds until the MCP7940 catches up.
+#   Only a correction of more than STEP_MS (e.g. after the MCP7940 time was set) is a step back.
+# - Elapsed ticks are calculated with time.ticks_diff(), so the wraparound of ticks_ms() is handled.
+#   ticks_diff() is only valid up to half the ticks period (2**29 mSec on most ports, about 6 days),
+#   so resync_ms is capped at MAX_RESYNC_MS and the clock must be used at least once in that time.
+# - edge(): anchor at an edge of the 1 Hz square wave, without I2C (see SecondTicker in mcp7940_mfp.py)
+# Times are in mSec and seconds since 2000-01-01, like MCP7940.time(). The mSec values are long ints.
+#
+# Example usage:
+#
+#     from mcp7940_clock import InterpClock
+#     clk = InterpClock(mcp, resync_ms=60000)
+#     ts = clk.now()           # a MCP7940.Timestamp, with ts.ms
+#     t_ms = clk.time_ms()     # mSec since 2000-01-01
+#     mcp.set_time_epoch(t)
+#     clk.invalidate()         # resync at the next use
+#
+import time
+import mcp7940_codec as codec
+from mcp7940 import MCP7940
+
+my_debug = False
+
+MAX_RESYNC_MS = 1 << 28
+STEP_MS = 2000
+
+class InterpClock:
+
+    CLS_NAME = "InterpClock"
+
+    # Param resync_ms: read the MCP7940 again after this many mSec
+    # Param align: let sync() wait for the rollover of the seconds register
+    # Param poll_ms: interval of reading the seconds register while aligning (the accuracy of the anchor)
+    def __init__(self, mcp, resync_ms=60000, align=True, align_timeout_ms=1100, poll_ms=2):
+        self._mcp = mcp
+        self.resync_ms = min(resync_ms, MAX_RESYNC_MS)
+        self.align = align
+        self.align_timeout_ms = align_timeout_ms
+        self.poll_ms = poll_ms
+        self._sec_buf = bytearray(1)
+        self._buf = bytearray(7)  # register values of the interpolated time, for localtime() and now()
+        self._anchor_ms = 0       # mSec since 2000-01-01 at self._anchor_ticks
+        self._anchor_ticks = 0
+        self._last_ms = 0         # last value returned by time_ms()
+        self._synced = False
+        self.aligned = False      # True if the anchor is at a rollover of the seconds register
+        self.align_fails = 0      # number of syncs with align that saw no rollover. See sync()
+        self.syncs = 0            # number of I2C reads of the time
+        self.correction_ms = 0    # interpolated minus MCP7940 time at the last resync
+
+    # Resync at the next use, e.g. after the MCP7940 time was set
+    def invalidate(self):
+        self._synced = False
+
+    # Anchor the clock to the MCP7940 time. Param align: see __init__(). Returns the anchor in mSec
+    def sync(self, align=None):
+        TAG = InterpClock.CLS_NAME+".sync(): "
+        if align is None:
+            align = self.align
+        mcp = self._mcp
+        secs = mcp.time()
+        t = time.ticks_ms()
+        self.syncs += 1
+        ms = secs * 1000
+        self.aligned = False
+        if align:
+            first = mcp._tk_buf[codec.SEC]
+            buf = self._sec_buf
+            t_start = t
+            t_poll = t
+            while time.ticks_diff(t_poll, t_start) < self.align_timeout_ms:
+                time.sleep_ms(self.poll_ms)
+                mcp._bus_read_into(MCP7940.RTCSEC, buf)
+                t_poll = time.ticks_ms()
+                if buf[0] != first:
+                    ms += 1000
+                    t = t_poll
+                    self.aligned = True
+                    break
+            if not self.aligned:
+                # No rollover seen (e.g. the oscillator is stopped): anchor at the first read, like align=False
+                self.align_fails += 1
+                if my_debug:
+                    print(TAG+f"no rollover of the seconds register within {self.align_timeout_ms} mSec")
+        self._anchor(ms, t)
+        self._last_ms = ms
+        self._synced = True
+        self.correction_ms = 0
+        if my_debug:
+            print(TAG+f"anchor: {ms} mSec, aligned: {self.aligned}")
+        return ms
+
+    # Read the MCP7940 and pull the clock into the second it shows. One I2C transaction
+    def _resync(self):
+        TAG = InterpClock.CLS_NAME+"._resync(): "
+        lo = self._mcp.time() * 1000
+        t = time.ticks_ms()
+        est = self._anchor_ms + time.ticks_diff(t, self._anchor_ticks)
+        self.syncs += 1
+        if est < lo:
+            ms = lo          # the seconds register rolled over before the estimate: behind
+        elif est > lo + 999:
+            ms = lo + 999    # ahead
+        else:
+            ms = est
+        self.correction_ms = est - ms
+        if self.correction_ms > STEP_MS or self.correction_ms < -STEP_MS:
+            self._last_ms = ms  # the MCP7940 time was changed: allow a step back
+        self._anchor(ms, t)
+        if my_debug:
+            print(TAG+f"correction: {self.correction_ms} mSec")
+
+    # Anchor the clock at a rollover of the seconds register at time.ticks_ms() t_edge, e.g. an edge of the
+    # 1 Hz square wave (see SecondTicker in mcp7940_mfp.py). No I2C: the second is the nearest one of the
+    # interpolated time, so the clock must be synced and within half a second of the MCP7940
+    def edge(self, t_edge):
+        if not self._synced:
+            return
+        est = self._anchor_ms + time.ticks_diff(t_edge, self._anchor_ticks)
+        ms = (est + 500) // 1000 * 1000
+        self.correction_ms = est - ms
+        self._anchor(ms, t_edge)
+        self.aligned = True
+
+    def _anchor(self, ms, t):
+        self._anchor_ms = ms
+        self._anchor_ticks = t
+
+    # Interpolated mSec since 2000-01-01
+    def time_ms(self):
+        if not self._synced:
+            self.sync()
+        t = time.ticks_ms()
+        el = time.ticks_diff(t, self._anchor_ticks)
+        if el < 0 or el >= self.resync_ms:
+            self._resync()
+            el = time.ticks_diff(time.ticks_ms(), self._anchor_ticks)
+        ms = self._anchor_ms + el
+        if ms < self._last_ms:
+            return self._last_ms
+        self._last_ms = ms
+        return ms
+
+    # Interpolated seconds since 2000-01-01, like MCP7940.time()
+    def time(self):
+        return self.time_ms() // 1000
+
+    # Interpolated time like MCP7940.localtime(): (year, month, mday, hour, minute, second, weekday, yearday)
+    def localtime(self):
+        return codec.unpack_localtime(codec.secs_to_regs(self.time(), self._buf))
+
+    # Interpolated time as a MCP7940.Timestamp, like MCP7940.now(). Its field ms holds the mSec
+    def now(self):
+        ms = self.time_ms()
+        return MCP7940.Timestamp(codec.secs_to_regs(ms // 1000, self._buf), ms % 1000)
@@ -0,0 +1,205 @@
+#
+# BCD codec for the MCP7940 register map
+# (c) 2023 Paulus Schulinck (@Paulskpt on GitHub)
+# License: MIT
+#
+# All tables are built once, at import.
+# They are used by the read and write paths in class MCP7940 (file: mcp7940.py).
+# See: MCP7940N datasheet DS20005010H, Table 5-1 (RTCC register map)
+#
+# - BCD_TO_INT: 256 entries. BCD_TO_INT[0x59] = 59
+# - INT_TO_BCD: 100 entries. INT_TO_BCD[59] = 0x59
+# - TIME_MASKS, ALARM_MASKS, PWRSTAMP_MASKS: per register masks to filter out the control bits
+#   (ST, OSCRUN, PWRFAIL, VBATEN, 12/24, LPYR, ALMPOL, ALMxMSK, ALMxIF)
+# - CUM_DAYS: cumulative days before each month, for yearday()
+#
+# Register order of the timekeeping registers (0x00-0x06):
+#   sec, min, hour, wkday, date, month, year
+# Register order of an alarm (0x0A-0x0F and 0x11-0x16):
+#   sec, min, hour, wkday, date, month
+# Register order of a power-fail timestamp (0x18-0x1B and 0x1C-0x1F):
+#   min, hour, date, wkday/month
+#
+
+from array import array
+
+BCD_TO_INT = bytes(((b >> 4) * 10 + (b & 0x0F)) & 0xFF for b in range(256))
+INT_TO_BCD = bytes(((i // 10) << 4) | (i % 10) for i in range(100))
+
+#                  sec   min   hour  wkday date  month year
+TIME_MASKS  = bytes((0x7F, 0x7F, 0x3F, 0x07, 0x3F, 0x1F, 0xFF))
+ALARM_MASKS = TIME_MASKS[:6]
+#                     min   hour  date  month
+PWRSTAMP_MASKS = bytes((0x7F, 0x3F, 0x3F, 0x1F))
+
+# Days in the months before month m (index m-1) of a non leap year. See yearday()
+CUM_DAYS = array('H', (0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334))
+
+# Indexes in the register buffers
+SEC = 0
+MIN = 1
+HOUR = 2
+WKDAY = 3
+DATE = 4
+MTH = 5
+YEAR = 6
+
+# Convert a time tuple (year, month, mday, hour, minute, second, weekday[, yearday]),
+# e.g.: utime.localtime(), into the 7 timekeeping register values.
+# If param buf is given (a bytearray of at least 7 bytes), it is filled and returned.
+def pack_time(t, buf=None):
+    if buf is None:
+        buf = bytearray(7)
+    buf[SEC] = INT_TO_BCD[t[5]] & TIME_MASKS[SEC]
+    buf[MIN] = INT_TO_BCD[t[4]] & TIME_MASKS[MIN]
+    buf[HOUR] = INT_TO_BCD[t[3]] & TIME_MASKS[HOUR]
+    buf[WKDAY] = INT_TO_BCD[t[6]] & TIME_MASKS[WKDAY]
+    buf[DATE] = INT_TO_BCD[t[2]] & TIME_MASKS[DATE]
+    buf[MTH] = INT_TO_BCD[t[1]] & TIME_MASKS[MTH]
+    buf[YEAR] = INT_TO_BCD[t[0] % 100]
+    return buf
+
+# Convert the 7 timekeeping register values into:
+# (year, month, mday, hour, minute, second, weekday)
+# If param dt is given (a list or an array('H') of at least 7 items), it is filled in place
+# and no memory is allocated.
+def unpack_time(buf, dt=None):
+    if dt is None:
+        return (2000 + BCD_TO_INT[buf[YEAR]],
+                BCD_TO_INT[buf[MTH] & 0x1F],
+                BCD_TO_INT[buf[DATE] & 0x3F],
+                BCD_TO_INT[buf[HOUR] & 0x3F],
+                BCD_TO_INT[buf[MIN] & 0x7F],
+                BCD_TO_INT[buf[SEC] & 0x7F],
+                buf[WKDAY] & 0x07)
+    dt[0] = 2000 + BCD_TO_INT[buf[YEAR]]
+    dt[1] = BCD_TO_INT[buf[MTH] & 0x1F]
+    dt[2] = BCD_TO_INT[buf[DATE] & 0x3F]
+    dt[3] = BCD_TO_INT[buf[HOUR] & 0x3F]
+    dt[4] = BCD_TO_INT[buf[MIN] & 0x7F]
+    dt[5] = BCD_TO_INT[buf[SEC] & 0x7F]
+    dt[6] = buf[WKDAY] & 0x07
+    return dt
+
+# Day of the year, 1...366, as in utime.localtime(). O(1): one table lookup
+def yearday(y, m, d):
+    if m > 2 and y % 4 == 0 and (y % 100 != 0 or y % 400 == 0):
+        return CUM_DAYS[m - 1] + d + 1
+    return CUM_DAYS[m - 1] + d
+
+# Convert the 7 timekeeping register values into the 8 items of utime.localtime():
+# (year, month, mday, hour, minute, second, weekday, yearday)
+# If param dt is given (a list or an array('H') of at least 8 items), it is filled in place
+def unpack_localtime(buf, dt=None):
+    y = 2000 + BCD_TO_INT[buf[YEAR]]
+    m = BCD_TO_INT[buf[MTH] & 0x1F]
+    d = BCD_TO_INT[buf[DATE] & 0x3F]
+    if dt is None:
+        return (y, m, d,
+                BCD_TO_INT[buf[HOUR] & 0x3F],
+                BCD_TO_INT[buf[MIN] & 0x7F],
+                BCD_TO_INT[buf[SEC] & 0x7F],
+                buf[WKDAY] & 0x07,
+                yearday(y, m, d))
+    unpack_time(buf, dt)
+    dt[7] = yearday(y, m, d)
+    return dt
+
+# Convert an alarm tuple (month, date, hours, minutes, seconds, weekday)
+# or a time tuple of 8 items (year and yearday are not used)
+# into the 6 alarm register values.
+# As before, the weekday is stored + 1 and the ALMPOL, ALMxIF and ALMxMSK bits are cleared.
+def pack_alarm(t, buf=None):
+    if len(t) == 8:
+        t = t[1:7]
+    month, date, hours, minutes, seconds, weekday = t
+    if buf is None:
+        buf = bytearray(6)
+    buf[SEC] = INT_TO_BCD[seconds] & ALARM_MASKS[SEC]
+    buf[MIN] = INT_TO_BCD[minutes] & ALARM_MASKS[MIN]
+    buf[HOUR] = INT_TO_BCD[hours] & ALARM_MASKS[HOUR]
+    buf[WKDAY] = (weekday + 1) & ALARM_MASKS[WKDAY]
+    buf[DATE] = INT_TO_BCD[date] & ALARM_MASKS[DATE]
+    buf[MTH] = INT_TO_BCD[month] & ALARM_MASKS[MTH]
+    return buf
+
+# Convert the 6 alarm register values into:
+# (month, date, hours, minutes, seconds, weekday)
+def unpack_alarm(buf):
+    return (BCD_TO_INT[buf[MTH] & 0x1F],
+            BCD_TO_INT[buf[DATE] & 0x3F],
+            BCD_TO_INT[buf[HOUR] & 0x3F],
+            BCD_TO_INT[buf[MIN] & 0x7F],
+            BCD_TO_INT[buf[SEC] & 0x7F],
+            buf[WKDAY] & 0x07)
+
+# Convert the 4 register values of a power-down or power-up timestamp into:
+# (month, date, hours, minutes, weekday) and, if the 12hr bit is set: (..., "AM") or (..., "PM")
+def unpack_pwrstamp(buf):
+    hr = buf[1]
+    _12hr = (hr >> 6) & 1
+    if _12hr:
+        hours = BCD_TO_INT[hr & 0x1F]
+    else:
+        hours = BCD_TO_INT[hr & PWRSTAMP_MASKS[1]]
+    t = (BCD_TO_INT[buf[3] & PWRSTAMP_MASKS[3]],
+         BCD_TO_INT[buf[2] & PWRSTAMP_MASKS[2]],
+         hours,
+         BCD_TO_INT[buf[0] & PWRSTAMP_MASKS[0]],
+         buf[3] >> 5)
+    if _12hr:
+        t += ("PM" if hr & 0x20 else "AM",)
+    return t
+
+# Epoch: seconds since 2000-01-01 00:00:00, as utime.time() on most MicroPython ports.
+# The days are calculated with the days-from-civil algorithm of Howard Hinnant
+# (http://howardhinnant.github.io/date_algorithms.html), shifted from 1970-01-01 to 2000-01-01.
+# The functions work on the register buffer directly. They create no tuples and, as long as the
+# result is a small int (until 2034 on a 32-bit port), allocate no memory.
+DAYS_0000_TO_2000 = 730425  # from 0000-03-01 (the algorithm's day 0) to 2000-01-01
+
+# Number of days since 2000-01-01
+def days_from_civil(y, m, d):
+    if m <= 2:
+        y -= 1
+        mp = m + 9
+    else:
+        mp = m - 3
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * mp + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - DAYS_0000_TO_2000
+
+# Seconds since 2000-01-01 of the 7 timekeeping register values
+def regs_to_secs(buf):
+    days = days_from_civil(2000 + BCD_TO_INT[buf[YEAR]],
+                           BCD_TO_INT[buf[MTH] & 0x1F],
+                           BCD_TO_INT[buf[DATE] & 0x3F])
+    return ((days * 24 + BCD_TO_INT[buf[HOUR] & 0x3F]) * 60
+            + BCD_TO_INT[buf[MIN] & 0x7F]) * 60 + BCD_TO_INT[buf[SEC] & 0x7F]
+
+# Fill the 7 timekeeping register values (buf) for param secs (seconds since 2000-01-01).
+# The weekday is 0 = Monday ... 6 = Sunday, as utime.localtime() (see pack_time())
+def secs_to_regs(secs, buf=None):
+    if buf is None:
+        buf = bytearray(7)
+    days = secs // 86400
+    rem = secs - days * 86400
+    buf[SEC] = INT_TO_BCD[rem % 60]
+    buf[MIN] = INT_TO_BCD[(rem // 60) % 60]
+    buf[HOUR] = INT_TO_BCD[rem // 3600]
+    buf[WKDAY] = (days + 5) % 7  # 2000-01-01 was a Saturday
+    # civil-from-days
+    z = days + DAYS_0000_TO_2000
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    m = mp + 3 if mp < 10 else mp - 9
+    y = yoe + era * 400 + (1 if m <= 2 else 0)
+    buf[DATE] = INT_TO_BCD[doy - (153 * mp + 2) // 5 + 1]
+    buf[MTH] = INT_TO_BCD[m]
+    buf[YEAR] = INT_TO_BCD[y % 100]
+    return buf
@@ -0,0 +1,187 @@
+#
+# Recurring (cron-style) alarm rules for the MCP7940 (file: mcp7940.py)
+# (c) 2023 Paulus Schulinck (@Paulskpt on GitHub)
+# License: MIT
+#
+# Class CronRule holds a recurrence rule, e.g.: every 15 minutes on weekdays, or 07:30 on the 1st of the month.
+# - next_after(dt) computes the next occurrence after MCP7940 timestamp dt with calendar arithmetic.
+#   It steps month, day, hour, minute and second with bit masks. It does not step minute by minute
+#   and it does not call utime.localtime() or utime.mktime().
+# - hw_match(now, occ) picks the cheapest hardware match type (see MCP7940._match_lst) that fires
+#   first at the occurrence: the one that compares the fewest registers.
+# - program(mcp, alarm_nr) does both and programs the alarm with MCP7940.program_alarm().
+#   Call it again after the alarm fired (e.g. from an AlarmDispatcher callback, see mcp7940_mfp.py).
+#
+# Fields of a rule are sets of values, written like in crontab:
+#   "*", "5", "1,15", "9-17", "*/15", "0-30/10"
+# The weekday is 0 = Monday ... 6 = Sunday, like utime.localtime().
+# A rule matches when all fields match (also when both mday and wday are restricted).
+#
+# Example usage:
+#
+#     from mcp7940_cron import CronRule
+#     every_15 = CronRule.parse("*/15 * * * 0-4")     # minute hour mday month wday
+#     first_of_month = CronRule(minute="30", hour="7", mday="1")
+#     occ, match = every_15.program(mcp, 1)
+#
+from mcp7940 import Alarm
+import mcp7940_codec as codec
+from mcp7940_sched import rtc_weekday
+
+my_debug = False
+
+DIM = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+MAX_YEARS = 8  # give up when a rule (e.g. 31 February) does not occur within this many years
+
+def is_leap_year(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+def days_in_month(year, month):
+    return 29 if month == 2 and is_leap_year(year) else DIM[month - 1]
+
+# Number of days from 2000-01-01 to year-month-day
+days_since_2000 = codec.days_from_civil
+
+# 0 = Monday ... 6 = Sunday. 2000-01-01 was a Saturday
+def weekday(year, month, day):
+    return (days_since_2000(year, month, day) + 5) % 7
+
+def secs_since_2000(dt):
+    return ((days_since_2000(dt[0], dt[1], dt[2]) * 24 + dt[3]) * 60 + dt[4]) * 60 + dt[5]
+
+# Return the lowest value >= start and <= end that has its bit set in mask, or -1
+def _next_bit(mask, start, end):
+    m = mask >> start
+    while start <= end:
+        if m & 1:
+            return start
+        m >>= 1
+        start += 1
+    return -1
+
+# Convert a crontab field to a bit mask. Bit n set = value n matches
+def _parse_field(field, lo, hi):
+    if isinstance(field, int):
+        return 1 << field
+    mask = 0
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/")
+            step = int(step)
+        if part == "*":
+            a, b = lo, hi
+        elif "-" in part:
+            a, b = part.split("-")
+            a, b = int(a), int(b)
+        else:
+            a = int(part)
+            b = hi if step > 1 else a
+        if a < lo or b > hi or a > b or step < 1:
+            raise ValueError("field '{}' out of range {}-{}".format(field, lo, hi))
+        for v in range(a, b + 1, step):
+            mask |= 1 << v
+    return mask
+
+class CronRule:
+
+    CLS_NAME = "CronRule"
+
+    def __init__(self, minute="*", hour="*", mday="*", month="*", wday="*", second="0"):
+        self.seconds = _parse_field(second, 0, 59)
+        self.minutes = _parse_field(minute, 0, 59)
+        self.hours = _parse_field(hour, 0, 23)
+        self.mdays = _parse_field(mday, 1, 31)
+        self.months = _parse_field(month, 1, 12)
+        self.wdays = _parse_field(wday, 0, 6)
+
+    # Param spec: "minute hour mday month wday"
+    @classmethod
+    def parse(cls, spec, second="0"):
+        f = spec.split()
+        if len(f) != 5:
+            raise ValueError("expected 5 fields: minute hour mday month wday")
+        return cls(f[0], f[1], f[2], f[3], f[4], second)
+
+    # Return the next occurrence after param dt (a MCP7940 timestamp: year, month, mday, hour, minute, second, ...)
+    # as (year, month, mday, hour, minute, second, weekday), or None if there is none within MAX_YEARS
+    def next_after(self, dt):
+        y, mo, d, h, mi, s = dt[0], dt[1], dt[2], dt[3], dt[4], dt[5] + 1
+        y_end = y + MAX_YEARS
+        while y <= y_end:
+            mo2 = _next_bit(self.months, mo, 12)
+            if mo2 < 0:
+                y, mo, d, h, mi, s = y + 1, 1, 1, 0, 0, 0
+                continue
+            if mo2 != mo:
+                mo, d, h, mi, s = mo2, 1, 0, 0, 0
+            # day: check the mday and the weekday. At most 31 steps, the weekday is counted along
+            dim = days_in_month(y, mo)
+            wd = weekday(y, mo, d) if d <= dim else 0
+            d2 = d
+            while d2 <= dim and not ((self.mdays >> d2) & 1 and (self.wdays >> wd) & 1):
+                d2 += 1
+                wd = (wd + 1) % 7
+            if d2 > dim:
+                mo, d, h, mi, s = mo + 1, 1, 0, 0, 0
+                if mo > 12:
+                    y, mo = y + 1, 1
+                continue
+            if d2 != d:
+                d, h, mi, s = d2, 0, 0, 0
+            h2 = _next_bit(self.hours, h, 23)
+            if h2 < 0:
+                d, h, mi, s = d + 1, 0, 0, 0
+                continue
+            if h2 != h:
+                h, mi, s = h2, 0, 0
+            mi2 = _next_bit(self.minutes, mi, 59)
+            if mi2 < 0:
+                h, mi, s = h + 1, 0, 0
+                continue
+            if mi2 != mi:
+                mi, s = mi2, 0
+            s2 = _next_bit(self.seconds, s, 59)
+            if s2 < 0:
+                mi, s = mi + 1, 0
+                continue
+            return (y, mo, d, h, mi, s2, wd)
+        return None
+
+    # Return the cheapest hardware match type (Alarm.MATCH_...) that fires first at occurrence occ
+    # when programmed at time now. The MCP7940 sets the ALMxIF bit when the compared registers start to match,
+    # so a match on minutes fires at mm:00, a match on hours at hh:00:00 and so on.
+    # A match type is only used when the compared register does not already match now.
+    def hw_match(self, now, occ):
+        diff = secs_since_2000(occ) - secs_since_2000(now)
+        if diff < 60:
+            return Alarm.MATCH_SEC
+        if occ[5] == 0 and diff < 3600 and occ[4] != now[4]:
+            return Alarm.MATCH_MIN
+        if occ[5] == 0 and occ[4] == 0:
+            if diff < 86400 and occ[3] != now[3]:
+                return Alarm.MATCH_HOUR
+            if occ[3] == 0 and diff < 7 * 86400 and \
+                    weekday(occ[0], occ[1], occ[2]) != weekday(now[0], now[1], now[2]):
+                return Alarm.MATCH_WKDAY
+            if occ[3] == 0 and diff < 28 * 86400 and occ[2] != now[2]:
+                return Alarm.MATCH_DATE
+        return Alarm.MATCH_ALL
+
+    # Program the next occurrence into alarm alarm_nr (1 or 2) of mcp.
+    # Returns (occurrence, match type), or None when the rule does not occur anymore (the alarm is then disabled)
+    def program(self, mcp, alarm_nr):
+        TAG = CronRule.CLS_NAME+".program(): "
+        now = mcp.mcptime
+        occ = self.next_after(now)
+        if occ is None:
+            mcp.alarm_enable(alarm_nr, False)
+            return None
+        match = self.hw_match(now, occ)
+        days = days_since_2000(occ[0], occ[1], occ[2]) - days_since_2000(now[0], now[1], now[2])
+        # Alarm.regs() stores weekday + 1
+        t = (occ[1], occ[2], occ[3], occ[4], occ[5], rtc_weekday(now[6], days) - 1)
+        mcp.program_alarm(Alarm(alarm_nr, t, match=match, polarity=1, enabled=True))
+        if my_debug:
+            print(TAG+f"next occurrence: {occ}, match type: {mcp._match_lst[match]}")
+        return occ, match
@@ -0,0 +1,251 @@
+#
+# Drift calibration of the MCP7940 oscillator (file: mcp7940.py)
+# (c) 2023 Paulus Schulinck (@Paulskpt on GitHub)
+# License: MIT
+#
+# Class DriftCalibrator compares the MCP7940 with a reference clock (e.g. the builtin RTC just after an NTP sync),
+# fits the drift in ppm and programs the digital trim (MCP7940.trim) to cancel it.
+# - measure(ref_ms_fn) adds a sample: the offset of the MCP7940 to the reference, in mSec. With an InterpClock
+#   (param clock, see mcp7940_clock.py) the MCP7940 is read at the rollover of its seconds register, so the
+#   offset is exact to a few mSec. Without a clock the MCP7940 time has a resolution of 1 second.
+#   A sample taken less than min_interval_s after the one before it replaces the last sample,
+#   so the few samples that are kept span a long time.
+# - ppm() is the least squares slope of the offsets over the reference time. Positive = the MCP7940 runs fast.
+#   It needs samples spanning at least min_span_s. The resolution of the reference and of the MCP7940
+#   divided by the span is the accuracy: 10 mSec over 6 hours is 0.5 ppm.
+# - calibrate() changes the trim by -ppm / MCP7940.TRIM_PPM steps. The samples taken with the old trim
+#   are dropped, except the last one, which is the start of the next fit.
+#   rate_ppm is the drift that is left with the new trim.
+# - time_was_set(): call it right after the MCP7940 time was set, with the offset from offset() taken right before.
+#   The older samples are shifted by the step, so the fit goes on.
+# - time_to_error(max_ms, now_s): the predicted number of seconds until the offset is more than max_ms.
+#   Use it to schedule the next NTP sync.
+#
+# The model (rate_ppm and the last STORE_SAMPLES samples) can be saved in the battery backed SRAM (param sram_start,
+# STORE_SIZE bytes, e.g. 0x48-0x5E), so it survives a reset and keeps learning when there is no NTP for a while.
+# It is off by default: the SRAMJournal (see mcp7940_journal.py) uses 0x2A-0x5F by default. Give the journal
+# a smaller size (e.g. SRAMJournal(mcp, size=30): 5 records, 0x2A-0x47) or don't use it. An overlap with the
+# journal raises a ValueError (see 'About the SRAM' in mcp7940.py). The layout:
+#   MAGIC, count, rate_ppm * 100 (int16, 0x8000 = unknown), samples: reference seconds (uint32), offset mSec (int16),
+#   CRC-8 (see mcp7940_journal.py) over the bytes before it. All big endian.
+#
+# Example usage:
+#
+#     from mcp7940_drift import DriftCalibrator
+#     cal = DriftCalibrator(mcp, clock=clk, sram_start=0x48)   # loads the model from the SRAM
+#     ref = lambda: utime.time_ns() // 1000000
+#     # after each NTP sync:
+#     cal.measure(ref)
+#     cal.calibrate()
+#     next_sync = utime.time() + cal.time_to_error(100, mcp.time())
+#     # when setting the MCP7940 time:
+#     before = cal.offset(ref)[1]
+#     mcp.set_time_epoch(t)
+#     cal.time_was_set(ref, before)
+#
+from mcp7940 import MCP7940
+from mcp7940_journal import crc8
+
+my_debug = False
+
+# Indexes in a sample
+S_REF = 0     # reference time in mSec
+S_OFS = 1     # offset of the MCP7940 in mSec: MCP7940 time - reference time
+
+MAGIC = 0xD7
+STORE_SAMPLES = 3
+STORE_SIZE = 4 + STORE_SAMPLES * 6 + 1
+RATE_UNKNOWN = 0x8000
+MAX_OFS_MS = 32767  # a larger offset means the MCP7940 time is wrong, not drifting: the samples are dropped
+
+class DriftCalibrator:
+
+    CLS_NAME = "DriftCalibrator"
+
+    # Param clock: an InterpClock for mSec resolution, or None
+    # Param min_span_s: minimum time between the first and the last sample for ppm()
+    # Param min_interval_s: minimum time between two samples that are kept
+    # Param max_samples: the oldest sample is dropped when there are more
+    # Param sram_start: SRAM address of the saved model, or None to keep it in RAM only
+    def __init__(self, mcp, clock=None, min_span_s=6*3600, min_interval_s=3*3600, max_samples=8, sram_start=None):
+        if sram_start is not None:
+            mcp.sram.claim(sram_start, STORE_SIZE, "drift model")  # see 'About the SRAM' in mcp7940.py
+        self._mcp = mcp
+        self._clock = clock
+        self.min_span_s = min_span_s
+        self.min_interval_s = min_interval_s
+        self.max_samples = max_samples
+        self._sram_start = sram_start
+        self._buf = bytearray(STORE_SIZE)
+        self._samples = []
+        self.last_ppm = None  # drift found by the last calibrate()
+        self.rate_ppm = None  # drift with the current trim, if known
+        if sram_start is not None:
+            self.load()
+
+    def __len__(self):
+        return len(self._samples)
+
+    # Samples [[ref_ms, offset_ms], ...], oldest first
+    def samples(self):
+        return self._samples
+
+    # Drop all samples
+    def reset(self):
+        self._samples = []
+        self.save()
+
+    # Return (ref_ms, offset_ms) without adding a sample. Param ref_ms_fn: function returning the reference
+    # time in mSec, on the scale of the MCP7940 time (seconds since 2000-01-01, the same time zone)
+    def offset(self, ref_ms_fn):
+        if self._clock is not None:
+            rtc_ms = self._clock.sync(align=True)  # returns right after the rollover of the seconds register
+        else:
+            rtc_ms = self._mcp.time() * 1000 + 500  # somewhere in this second
+        ref_ms = ref_ms_fn()
+        return ref_ms, rtc_ms - ref_ms
+
+    # Add a sample. See offset(). Returns the offset in mSec
+    def measure(self, ref_ms_fn):
+        TAG = DriftCalibrator.CLS_NAME+".measure(): "
+        ref_ms, ofs = self.offset(ref_ms_fn)
+        self.add(ref_ms, ofs)
+        self.save()
+        if my_debug:
+            print(TAG+f"offset: {ofs} mSec")
+        return ofs
+
+    def add(self, ref_ms, offset_ms):
+        smp = self._samples
+        if offset_ms > MAX_OFS_MS or offset_ms < -MAX_OFS_MS:
+            smp.clear()
+            return
+        if len(smp) >= 2 and ref_ms - smp[-2][S_REF] < self.min_interval_s * 1000:
+            smp[-1] = [ref_ms, offset_ms]
+        else:
+            smp.append([ref_ms, offset_ms])
+            if len(smp) > self.max_samples:
+                smp.pop(0)
+
+    # Call right after the MCP7940 time was set. Param before: the offset in mSec (see offset()) right before.
+    # Without it the samples are dropped. Returns the offset in mSec after the step
+    def time_was_set(self, ref_ms_fn, before=None):
+        ref_ms, ofs = self.offset(ref_ms_fn)
+        if before is None or before > MAX_OFS_MS or before < -MAX_OFS_MS:
+            self._samples = []
+        else:
+            step = ofs - before
+            for s in self._samples:
+                s[S_OFS] += step
+            if self._samples and ref_ms - self._samples[-1][S_REF] < self.min_interval_s * 1000:
+                self._samples.pop()  # the sample taken right before the step tells the same
+        self.add(ref_ms, ofs)
+        self.save()
+        return ofs
+
+    # Drift of the MCP7940 in ppm (positive = fast), or None if the samples span less than min_span_s
+    def ppm(self):
+        smp = self._samples
+        n = len(smp)
+        if n < 2 or smp[-1][S_REF] - smp[0][S_REF] < self.min_span_s * 1000:
+            return None
+        x0 = smp[0][S_REF]
+        y0 = smp[0][S_OFS]
+        sx = sy = 0
+        for s in smp:
+            sx += s[S_REF] - x0
+            sy += s[S_OFS] - y0
+        mx = sx / n
+        my = sy / n
+        sxx = sxy = 0
+        for s in smp:
+            dx = s[S_REF] - x0 - mx
+            sxx += dx * dx
+            sxy += dx * (s[S_OFS] - y0 - my)
+        return sxy / sxx * 1000000
+
+    # Program the trim that cancels the measured drift. Returns the new trim, or None if there is no drift estimate yet
+    def calibrate(self):
+        TAG = DriftCalibrator.CLS_NAME+".calibrate(): "
+        ppm = self.ppm()
+        if ppm is None:
+            return None
+        self.last_ppm = ppm
+        old = self._mcp.trim
+        new = old - int(round(ppm / MCP7940.TRIM_PPM))
+        new = max(-MCP7940.TRIM_MAX, min(MCP7940.TRIM_MAX, new))
+        if new != old:
+            self._mcp.trim = new
+            self._samples = self._samples[-1:]
+        self.rate_ppm = ppm + (new - old) * MCP7940.TRIM_PPM
+        self.save()
+        if my_debug:
+            print(TAG+f"drift: {ppm:.2f} ppm, trim: {old} -> {new}, drift left: {self.rate_ppm:.2f} ppm")
+        return new
+
+    # Predicted number of seconds from now_s (MCP7940.time() scale) until the offset is more than max_ms.
+    # The offset is extrapolated from the last sample with rate_ppm, or with default_ppm when it is not known yet.
+    # The drift is taken as at least half a trim step: the trim can not correct it better
+    def time_to_error(self, max_ms, now_s, default_ppm=20.0):
+        rate = self.rate_ppm if self.rate_ppm is not None else default_ppm
+        if -MCP7940.TRIM_PPM / 2 < rate < MCP7940.TRIM_PPM / 2:
+            rate = MCP7940.TRIM_PPM / 2 if rate >= 0 else -MCP7940.TRIM_PPM / 2
+        ofs = 0
+        if self._samples:
+            ref_ms, ofs = self._samples[-1]
+            ofs += rate * (now_s * 1000 - ref_ms) / 1000000
+        if rate < 0:
+            rate = -rate
+            ofs = -ofs
+        if ofs >= max_ms:
+            return 0
+        return int((max_ms - ofs) * 1000 / rate)
+
+    # Read the model from the SRAM. Returns False if there was no valid model
+    def load(self):
+        TAG = DriftCalibrator.CLS_NAME+".load(): "
+        if self._sram_start is None:
+            return False
+        buf = self._buf
+        self._mcp.sram.readinto(buf, self._sram_start - 0x20)
+        n = buf[1]
+        if buf[0] != MAGIC or n > STORE_SAMPLES or buf[STORE_SIZE-1] != crc8(buf, 0, STORE_SIZE-1):
+            if my_debug:
+                print(TAG+"no drift model found")
+            return False
+        rate = (buf[2] << 8) | buf[3]
+        self.rate_ppm = None if rate == RATE_UNKNOWN else (rate - 0x10000 if rate & 0x8000 else rate) / 100
+        self._samples = []
+        for i in range(n):
+            o = 4 + i * 6
+            secs = (buf[o] << 24) | (buf[o+1] << 16) | (buf[o+2] << 8) | buf[o+3]
+            ofs = (buf[o+4] << 8) | buf[o+5]
+            self._samples.append([secs * 1000, ofs - 0x10000 if ofs & 0x8000 else ofs])
+        if my_debug:
+            print(TAG+f"rate: {self.rate_ppm} ppm, samples: {self._samples}")
+        return True
+
+    # Write the model to the SRAM (one I2C transaction, also when mcp.sram is in write-back mode)
+    def save(self):
+        if self._sram_start is None:
+            return
+        buf = self._buf
+        smp = self._samples[-STORE_SAMPLES:]
+        buf[0] = MAGIC
+        buf[1] = len(smp)
+        rate = RATE_UNKNOWN if self.rate_ppm is None else int(round(self.rate_ppm * 100))
+        if rate != RATE_UNKNOWN:
+            rate = max(-0x7FFF, min(0x7FFF, rate)) & 0xFFFF
+        buf[2] = rate >> 8
+        buf[3] = rate & 0xFF
+        for i in range(STORE_SAMPLES):
+            o = 4 + i * 6
+            secs, ofs = (smp[i][S_REF] // 1000, smp[i][S_OFS] & 0xFFFF) if i < len(smp) else (0, 0)
+            buf[o] = (secs >> 24) & 0xFF
+            buf[o+1] = (secs >> 16) & 0xFF
+            buf[o+2] = (secs >> 8) & 0xFF
+            buf[o+3] = secs & 0xFF
+            buf[o+4] = ofs >> 8
+            buf[o+5] = ofs & 0xFF
+        buf[STORE_SIZE-1] = crc8(buf, 0, STORE_SIZE-1)
+        self._mcp.sram.write(self._sram_start - 0x20, buf)
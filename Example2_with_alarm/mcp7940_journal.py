@@ -0,0 +1,181 @@
+#
+# Event journal in the battery backed SRAM of the MCP7940 (file: mcp7940.py)
+# (c) 2023 Paulus Schulinck (@Paulskpt on GitHub)
+# License: MIT
+#
+# Class SRAMJournal keeps the last events (e.g. boot, power fail, alarm) in a ring buffer in the SRAM.
+# The SRAM keeps its contents as long as the backup battery is OK, so no flash writes are needed.
+#
+# Layout (default: 0x2A-0x5F, after the datetime stamp of MCP7940.write_to_SRAM() at 0x20-0x29).
+# To keep the drift model of DriftCalibrator in the SRAM as well (see mcp7940_drift.py), give the journal a smaller size.
+# The map of the SRAM: see 'About the SRAM' in mcp7940.py. The layout:
+#   header, 4 bytes: MAGIC, head (slot for the next record), count, CRC-8
+#   records, 5 bytes each: epoch (4 bytes, big endian, seconds since 2000-01-01 like MCP7940.time()), event code (1 byte)
+# The CRC-8 (polynomial 0x31) is calculated over the first 3 header bytes and all the record slots.
+#
+# A copy of the journal is kept in RAM. It is read from the SRAM once, in load().
+# All I/O goes through mcp.sram. The writes are write-through, also when mcp.sram is in write-back mode.
+# An append writes the CRC and the records up to the new one in one transaction, then the head and the count.
+# When the power fails in between, the CRC matches the header as it would be after the append:
+# load() then counts the new record in. Any other CRC error (e.g. other data in this part of the SRAM)
+# formats the journal (see load()).
+#
+# Example usage:
+#
+#     from mcp7940_journal import SRAMJournal, EV_BOOT
+#     jnl = SRAMJournal(mcp)
+#     jnl.load()
+#     jnl.append(EV_BOOT)
+#     for t, code in jnl.records():
+#         print(t, code)
+#
+my_debug = False
+
+MAGIC = 0xA5
+HDR_SIZE = 4
+REC_SIZE = 5
+# Indexes in the header
+H_MAGIC = 0
+H_HEAD = 1
+H_COUNT = 2
+H_CRC = 3
+
+# Event codes. Codes from EV_USER up are free for the application
+EV_BOOT = 1
+EV_PWRFAIL = 2
+EV_PWRUP = 3
+EV_ALARM1 = 4
+EV_ALARM2 = 5
+EV_TIME_SET = 6
+EV_USER = 0x80
+
+def _crc8_table():
+    tbl = bytearray(256)
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            c = ((c << 1) ^ 0x31) & 0xFF if c & 0x80 else (c << 1) & 0xFF
+        tbl[i] = c
+    return bytes(tbl)
+
+CRC8_TABLE = _crc8_table()
+
+def crc8(buf, start=0, end=None, crc=0):
+    if end is None:
+        end = len(buf)
+    for i in range(start, end):
+        crc = CRC8_TABLE[crc ^ buf[i]]
+    return crc
+
+class SRAMJournal:
+
+    CLS_NAME = "SRAMJournal"
+
+    # Param start, size: the part of the SRAM (0x20-0x5F) used. The default gives 10 records
+    def __init__(self, mcp, start=0x2A, size=54):
+        if size < HDR_SIZE + REC_SIZE:
+            raise ValueError("journal size too small")
+        mcp.sram.claim(start, size, "journal")  # see 'About the SRAM' in mcp7940.py
+        self._mcp = mcp
+        self._start = start
+        self.slots = (size - HDR_SIZE) // REC_SIZE
+        self._buf = bytearray(HDR_SIZE + self.slots * REC_SIZE)  # RAM copy of the journal
+        self.repaired = False
+
+    def __len__(self):
+        return self._buf[H_COUNT]
+
+    # Read the journal from the SRAM. Returns True if it was valid.
+    # An invalid journal (other MAGIC, bad head or count, CRC error) is formatted.
+    def load(self):
+        TAG = SRAMJournal.CLS_NAME+".load(): "
+        buf = self._buf
+        self._mcp.sram.readinto(buf, self._start - 0x20)
+        self.repaired = False
+        if buf[H_MAGIC] != MAGIC or buf[H_HEAD] >= self.slots or buf[H_COUNT] > self.slots:
+            if my_debug:
+                print(TAG+"no journal found. Formatting")
+            self.format()
+            return False
+        if buf[H_CRC] != self._crc():
+            # The power failed between the two writes of append(): the CRC and the new record were written,
+            # the head and the count not. Then the CRC is the one of the header after the append
+            crc = buf[H_CRC]
+            self._advance()
+            if buf[H_CRC] != crc:
+                if my_debug:
+                    print(TAG+"CRC error. Formatting")
+                self.format()
+                return False
+            if my_debug:
+                print(TAG+"CRC of an interrupted append. Repairing the header")
+            self._write(0, HDR_SIZE)
+            self.repaired = True
+        return True
+
+    # Make the journal empty
+    def format(self):
+        buf = self._buf
+        for i in range(len(buf)):
+            buf[i] = 0
+        buf[H_MAGIC] = MAGIC
+        buf[H_CRC] = self._crc()
+        self._mcp.sram.write(self._start - 0x20, buf)
+
+    # Add an event. Param t: seconds since 2000-01-01 (MCP7940.time() scale). Default: the current MCP7940 time
+    def append(self, code, t=None):
+        TAG = SRAMJournal.CLS_NAME+".append(): "
+        if t is None:
+            t = self._mcp.time()
+        t = int(t)
+        buf = self._buf
+        slot = buf[H_HEAD]
+        ofs = HDR_SIZE + slot * REC_SIZE
+        buf[ofs] = (t >> 24) & 0xFF
+        buf[ofs+1] = (t >> 16) & 0xFF
+        buf[ofs+2] = (t >> 8) & 0xFF
+        buf[ofs+3] = t & 0xFF
+        buf[ofs+4] = code & 0xFF
+        self._advance()
+        if slot == 0:
+            self._write(0, HDR_SIZE + REC_SIZE)  # header and record are adjacent: one transaction
+        else:
+            self._write(H_CRC, ofs + REC_SIZE - H_CRC)  # the CRC and the records up to the new one
+            self._write(H_HEAD, H_CRC - H_HEAD)         # then the head and the count
+        if my_debug:
+            print(TAG+f"slot: {slot}, t: {t}, code: {code}")
+
+    # Return the events [(t, code), ...], oldest first
+    def records(self):
+        buf = self._buf
+        n = buf[H_COUNT]
+        first = (buf[H_HEAD] - n) % self.slots
+        res = []
+        for i in range(n):
+            ofs = HDR_SIZE + ((first + i) % self.slots) * REC_SIZE
+            t = (buf[ofs] << 24) | (buf[ofs+1] << 16) | (buf[ofs+2] << 8) | buf[ofs+3]
+            res.append((t, buf[ofs+4]))
+        return res
+
+    # Return the last event (t, code), or None
+    def last(self):
+        if not self._buf[H_COUNT]:
+            return None
+        ofs = HDR_SIZE + ((self._buf[H_HEAD] - 1) % self.slots) * REC_SIZE
+        buf = self._buf
+        return ((buf[ofs] << 24) | (buf[ofs+1] << 16) | (buf[ofs+2] << 8) | buf[ofs+3], buf[ofs+4])
+
+    def _advance(self):
+        buf = self._buf
+        buf[H_HEAD] = (buf[H_HEAD] + 1) % self.slots
+        if buf[H_COUNT] < self.slots:
+            buf[H_COUNT] += 1
+        buf[H_CRC] = self._crc()
+
+    def _crc(self):
+        buf = self._buf
+        return crc8(buf, HDR_SIZE, len(buf), crc8(buf, 0, H_CRC))
+
+    # Write n bytes of the RAM copy, from offset ofs, to the SRAM
+    def _write(self, ofs, n):
+        self._mcp.sram.write(self._start - 0x20 + ofs, memoryview(self._buf)[ofs:ofs+n])
@@ -0,0 +1,230 @@
+#
+# Interrupt driven handling of the MCP7940 MFP (Multi Function Pin) output
+# (c) 2023 Paulus Schulinck (@Paulskpt on GitHub)
+# License: MIT
+#
+# Class AlarmDispatcher replaces the polling of the ALMxIF bits and of the MFP line.
+# - A hard IRQ on the MFP edge only saves a time.ticks_us() timestamp in a preallocated slot
+#   and hands off to micropython.schedule(). It does not allocate memory and does no I2C.
+# - The scheduled function reads ALM1WKDAY up to ALM2WKDAY (0x0D-0x14) in one I2C transaction,
+#   clears the ALMxIF bit of each alarm that fired (one write each)
+#   and calls the callbacks registered for that alarm.
+#   Then it reads the registers again, until both ALMxIF bits are clear: when the other alarm fired between the read
+#   and the clearing write, the MFP output stays active and gives no new edge, so that alarm is only seen this way.
+#
+# The MFP output follows the ALMxIF bit when the ALMPOL bit is set (see MCP7940._set_ALMPOL_bit()),
+# so the default trigger is the rising edge. With ALMPOL cleared, use the falling edge.
+# See MCP7940 datasheet DS20005010H, paragraph 5.4 and table 5-10 (alarm output truth table)
+#
+# Class SecondTicker puts the 1 Hz square wave on the MFP pin (see MCP7940.set_sqw()) and counts its edges in a hard IRQ.
+# - wait_second_edge() waits for the next second of the MCP7940 without any I2C read.
+# - on_second() registers callbacks, run via micropython.schedule() at each edge.
+# - With param clock (an InterpClock, see mcp7940_clock.py) each edge anchors the clock, so it stays
+#   aligned to the seconds of the MCP7940 without I2C reads.
+# While the square wave is on, the MFP pin does not signal the alarms, so don't use both on the same pin.
+# The alarms can still be checked with AlarmDispatcher.poll(), e.g. from an on_second() callback.
+#
+# Example usage:
+#
+#     from mcp7940_mfp import AlarmDispatcher
+#     disp = AlarmDispatcher(mcp, Pin(33, Pin.IN))
+#     disp.on_alarm(my_callback, 1)  # my_callback(alarm_nr, t_irq_us)
+#     disp.enable()
+#
+#     from mcp7940_mfp import SecondTicker
+#     tick = SecondTicker(mcp, Pin(33, Pin.IN), clock=clk)
+#     tick.on_second(my_second_callback)  # my_second_callback(edges, t_edge_us)
+#     tick.enable()
+#     tick.wait_second_edge()
+#
+import time
+import micropython
+from array import array
+from mcp7940 import MCP7940
+
+my_debug = False
+
+# Indexes in the slot filled by the hard IRQ handler
+T_IRQ = 0    # time.ticks_us() of the last MFP edge
+PENDING = 1  # 1 = the scheduled dispatch did not run yet
+IRQS = 2     # number of MFP edges
+
+# Indexes in the slot filled by the hard IRQ handler of SecondTicker
+E_US = 0      # time.ticks_us() of the last edge
+E_MS = 1      # time.ticks_ms() of the last edge
+E_PENDING = 2 # 1 = the scheduled callbacks did not run yet
+EDGES = 3     # number of edges
+
+class AlarmDispatcher:
+
+    CLS_NAME = "AlarmDispatcher"
+    FIRST_REG = MCP7940.REGISTER_ALM1WKDAY
+    # offsets of the ALMxWKDAY registers in self._buf
+    OFFSETS = (0, MCP7940.REGISTER_ALM2WKDAY - MCP7940.REGISTER_ALM1WKDAY)
+    IF_MASK = 1 << MCP7940.ALMxIF_BIT
+    MAX_ROUNDS = 4  # reads of the ALMxIF bits per dispatch. See _dispatch()
+
+    def __init__(self, mcp, pin, trigger=None, hard=True):
+        self._mcp = mcp
+        self._pin = pin
+        self._trigger = trigger if trigger is not None else pin.IRQ_RISING
+        self._hard = hard
+        self._slot = array('i', [0, 0, 0])
+        self._buf = bytearray(MCP7940.REGISTER_ALM2WKDAY - MCP7940.REGISTER_ALM1WKDAY + 1)
+        self._callbacks = []  # list of [alarm_nr, callback]. alarm_nr None = both alarms
+        self._dispatch_ref = self._dispatch  # bound method created once, not in the IRQ handler
+        self.latency_us = -1  # time from the MFP edge to the start of the last dispatch
+        self.dispatches = 0
+        self.spurious = 0     # dispatches without an ALMxIF bit set
+        self.sched_fails = 0  # edges lost because the schedule queue was full
+
+    # Register function cb(alarm_nr, t_irq_us) for alarm_nr 1, 2 or None (both)
+    # It is called from the scheduler, so it may allocate memory and use I2C
+    def on_alarm(self, cb, alarm_nr=None):
+        self._callbacks.append([alarm_nr, cb])
+
+    def remove(self, cb):
+        self._callbacks = [c for c in self._callbacks if c[1] is not cb]
+
+    def enable(self):
+        TAG = AlarmDispatcher.CLS_NAME+".enable(): "
+        self._pin.irq(handler=self._irq, trigger=self._trigger, hard=self._hard)
+        if my_debug:
+            print(TAG+"MFP interrupt enabled")
+        # An alarm that fired before the IRQ was set up gives no edge anymore
+        self.poll()
+
+    def disable(self):
+        self._pin.irq(handler=None)
+
+    # Hard IRQ handler. No memory allocation allowed here
+    def _irq(self, pin):
+        slot = self._slot
+        slot[T_IRQ] = time.ticks_us()
+        slot[IRQS] += 1
+        if slot[PENDING]:
+            return
+        slot[PENDING] = 1
+        try:
+            micropython.schedule(self._dispatch_ref, 0)
+        except RuntimeError:  # schedule queue full
+            slot[PENDING] = 0
+            self.sched_fails += 1
+
+    # Check the ALMxIF bits without an MFP edge, e.g. at startup. Returns the number of alarms handled
+    def poll(self):
+        self._slot[T_IRQ] = time.ticks_us()
+        return self._dispatch(0)
+
+    def _dispatch(self, _):
+        TAG = AlarmDispatcher.CLS_NAME+"._dispatch(): "
+        slot = self._slot
+        t_irq = slot[T_IRQ]
+        slot[PENDING] = 0
+        self.latency_us = time.ticks_diff(time.ticks_us(), t_irq)
+        self.dispatches += 1
+        mcp = self._mcp
+        buf = self._buf
+        fired = 0
+        for _ in range(AlarmDispatcher.MAX_ROUNDS):
+            mcp._bus_read_into(AlarmDispatcher.FIRST_REG, buf)
+            n = 0
+            for i in range(2):
+                ofs = AlarmDispatcher.OFFSETS[i]
+                if not buf[ofs] & AlarmDispatcher.IF_MASK:
+                    continue
+                alarm_nr = i + 1
+                n += 1
+                # Writing to the ALMxWKDAY register clears the ALMxIF bit. The other bits are written back unchanged
+                mcp._write_reg(AlarmDispatcher.FIRST_REG + ofs, buf[ofs] & ~AlarmDispatcher.IF_MASK & 0xFF)
+                if my_debug:
+                    print(TAG+f"alarm{alarm_nr} fired. Latency: {self.latency_us} uSec")
+                for nr, cb in self._callbacks:
+                    if nr is None or nr == alarm_nr:
+                        cb(alarm_nr, t_irq)
+            if not n:  # both ALMxIF bits clear: the MFP output is inactive, the next alarm gives an edge
+                break
+            fired += n
+        if not fired:
+            self.spurious += 1
+        return fired
+
+class SecondTicker:
+
+    CLS_NAME = "SecondTicker"
+
+    # Param trigger: the edge of the 1 Hz square wave at which the seconds register increments.
+    # Default: the falling edge. Param clock: an InterpClock to anchor at each edge, or None
+    def __init__(self, mcp, pin, trigger=None, hard=True, clock=None):
+        self._mcp = mcp
+        self._pin = pin
+        self._trigger = trigger if trigger is not None else pin.IRQ_FALLING
+        self._hard = hard
+        self._clock = clock
+        self._slot = array('i', [0, 0, 0, 0])
+        self._callbacks = []
+        self._run_ref = self._run  # bound method created once, not in the IRQ handler
+        self.sched_fails = 0  # edges without callbacks because the schedule queue was full
+
+    # Register function cb(edges, t_edge_us). It is called from the scheduler, so it may allocate memory and use I2C
+    def on_second(self, cb):
+        self._callbacks.append(cb)
+
+    def remove(self, cb):
+        self._callbacks = [c for c in self._callbacks if c is not cb]
+
+    # Number of edges since enable()
+    @property
+    def edges(self):
+        return self._slot[EDGES]
+
+    # Switch the 1 Hz square wave on and set up the IRQ
+    def enable(self):
+        TAG = SecondTicker.CLS_NAME+".enable(): "
+        self._slot[EDGES] = 0
+        self._mcp.set_sqw(MCP7940.SQWFS_1HZ, True)
+        self._pin.irq(handler=self._irq, trigger=self._trigger, hard=self._hard)
+        if my_debug:
+            print(TAG+"1 Hz square wave and MFP interrupt enabled")
+
+    # Remove the IRQ and switch the square wave off: the MFP pin is the alarm output again
+    def disable(self):
+        self._pin.irq(handler=None)
+        self._mcp.set_sqw(enable=False)
+
+    # Hard IRQ handler. No memory allocation allowed here
+    def _irq(self, pin):
+        slot = self._slot
+        slot[E_US] = time.ticks_us()
+        slot[E_MS] = time.ticks_ms()
+        slot[EDGES] += 1
+        if slot[E_PENDING] or not (self._callbacks or self._clock):
+            return
+        slot[E_PENDING] = 1
+        try:
+            micropython.schedule(self._run_ref, 0)
+        except RuntimeError:  # schedule queue full
+            slot[E_PENDING] = 0
+            self.sched_fails += 1
+
+    def _run(self, _):
+        slot = self._slot
+        slot[E_PENDING] = 0
+        edges = slot[EDGES]
+        t_edge = slot[E_US]
+        if self._clock is not None:
+            self._clock.edge(slot[E_MS])
+        for cb in self._callbacks:
+            cb(edges, t_edge)
+
+    # Wait for the next edge: the start of the next second of the MCP7940. No I2C.
+    # Returns the time.ticks_us() of the edge, or None after timeout_ms (e.g. the square wave is off)
+    def wait_second_edge(self, timeout_ms=1100):
+        slot = self._slot
+        n = slot[EDGES]
+        t_start = time.ticks_ms()
+        while slot[EDGES] == n:
+            if time.ticks_diff(time.ticks_ms(), t_start) >= timeout_ms:
+                return None
+            time.sleep_ms(1)
+        return slot[E_US]
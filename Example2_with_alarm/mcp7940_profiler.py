@@ -0,0 +1,148 @@
+#
+# I2C transaction profiler for class MCP7940 (file: mcp7940.py)
+# (c) 2023 Paulus Schulinck (@Paulskpt on GitHub)
+# License: MIT
+#
+# Class I2CProfiler is a proxy around the I2C object that is passed to MCP7940(i2c).
+# It counts the reads, the writes and the bytes transferred and it times each transaction with time.ticks_us().
+# After attach(mcp) the cost of each transaction is booked on the MCP7940 method that caused it,
+# e.g.: '_mcpget_time', '_set_bit' or '_clr_ALMxIF_bit'.
+# When methods call each other, the transaction is booked on the innermost one.
+# Transactions done directly in a property setter (e.g.: mcptime = ...) are booked on UNATTRIBUTED.
+#
+# It works on a MicroPython board and in CPython with a fake I2C bus object.
+#
+# Example usage:
+#
+#     from mcp7940_profiler import I2CProfiler
+#     prof = I2CProfiler(i2c)
+#     mcp = MCP7940(prof)
+#     prof.attach(mcp)
+#     ...
+#     print(mcp.bus_stats())  # (reads, writes, bytes, errors, us)
+#     prof.report()
+#
+import time
+
+UNATTRIBUTED = "(direct)"
+
+# Indexes in the per method statistics list
+READS = 0
+WRITES = 1
+BYTES = 2
+ERRORS = 3
+US = 4
+MAX_US = 5
+
+class I2CProfiler:
+
+    # MCP7940 methods that are not attributed themselves.
+    # They are the bus primitives and helpers that are called by the methods we want to see in the report.
+    SKIP = ("_bus_read", "_bus_read_into", "_bus_write", "_bus_retry",
+            "_read_reg", "_read_regs", "_write_reg", "_write_regs", "_cacheable",
+            "cache_invalidate", "cache_stats", "bus_stats")
+
+    def __init__(self, i2c):
+        self._i2c = i2c
+        self._stack = []  # names of the MCP7940 methods that are running (innermost last)
+        self._stats = {}
+
+    # Calls of the I2C methods that are not profiled, e.g.: scan(), go to the real I2C object
+    def __getattr__(self, name):
+        return getattr(self._i2c, name)
+
+    def readfrom_mem(self, addr, memaddr, nbytes, *args):
+        t0 = time.ticks_us()
+        try:
+            buf = self._i2c.readfrom_mem(addr, memaddr, nbytes, *args)
+        except OSError:
+            self._book(READS, 0, t0, True)
+            raise
+        self._book(READS, nbytes, t0, False)
+        return buf
+
+    def readfrom_mem_into(self, addr, memaddr, buf, *args):
+        t0 = time.ticks_us()
+        try:
+            self._i2c.readfrom_mem_into(addr, memaddr, buf, *args)
+        except OSError:
+            self._book(READS, 0, t0, True)
+            raise
+        self._book(READS, len(buf), t0, False)
+
+    def writeto_mem(self, addr, memaddr, buf, *args):
+        t0 = time.ticks_us()
+        try:
+            self._i2c.writeto_mem(addr, memaddr, buf, *args)
+        except OSError:
+            self._book(WRITES, 0, t0, True)
+            raise
+        self._book(WRITES, len(buf), t0, False)
+
+    def _book(self, kind, nbytes, t0, failed):
+        dt = time.ticks_diff(time.ticks_us(), t0)
+        name = self._stack[-1] if self._stack else UNATTRIBUTED
+        s = self._stats.get(name)
+        if s is None:
+            s = [0, 0, 0, 0, 0, 0]
+            self._stats[name] = s
+        s[kind] += 1
+        s[BYTES] += nbytes
+        if failed:
+            s[ERRORS] += 1
+        s[US] += dt
+        if dt > s[MAX_US]:
+            s[MAX_US] = dt
+
+    # Wrap the methods of MCP7940 object mcp, so that the transactions are booked on the method that caused them.
+    # Only the instance is changed. Other MCP7940 objects are not profiled.
+    def attach(self, mcp):
+        cls = type(mcp)
+        for name in dir(cls):
+            if name.startswith("__") or name in I2CProfiler.SKIP:
+                continue
+            attr = getattr(cls, name)
+            if isinstance(attr, (type, property)) or not callable(attr):
+                continue  # nested classes (Snapshot) and properties (mcptime, alarm1, ...)
+            setattr(mcp, name, self._wrap(name, getattr(mcp, name)))
+        return mcp
+
+    def _wrap(self, name, fn):
+        stack = self._stack
+        def wrapper(*args, **kwargs):
+            stack.append(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stack.pop()
+        return wrapper
+
+    # Return the per method statistics: {name: [reads, writes, bytes, errors, us, max_us]}
+    def stats(self):
+        return self._stats
+
+    # Return the totals: (reads, writes, bytes, errors, us)
+    def totals(self):
+        t = [0, 0, 0, 0, 0]
+        for s in self._stats.values():
+            for i in range(5):
+                t[i] += s[i]
+        return tuple(t)
+
+    def reset(self):
+        self._stats = {}
+
+    # Print the methods ranked by the total time they spent on the I2C bus
+    def report(self, top=None):
+        ranked = sorted(self._stats.items(), key=lambda kv: kv[1][US], reverse=True)
+        if top is not None:
+            ranked = ranked[:top]
+        r, w, nb, err, us = self.totals()
+        print("I2C profile: {} reads, {} writes, {} bytes, {} errors, {} uSec".format(r, w, nb, err, us))
+        print("{:<32s} {:>6s} {:>6s} {:>6s} {:>4s} {:>8s} {:>6s} {:>6s}".format(
+            "method", "reads", "writes", "bytes", "err", "uSec", "avg", "max"))
+        for name, s in ranked:
+            n = s[READS] + s[WRITES]
+            avg = s[US] // n if n else 0
+            print("{:<32s} {:>6d} {:>6d} {:>6d} {:>4d} {:>8d} {:>6d} {:>6d}".format(
+                name, s[READS], s[WRITES], s[BYTES], s[ERRORS], s[US], avg, s[MAX_US]))
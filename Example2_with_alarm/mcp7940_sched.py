@@ -0,0 +1,191 @@
+#
+# Software alarms for the MCP7940 (file: mcp7940.py)
+# (c) 2023 Paulus Schulinck (@Paulskpt on GitHub)
+# License: MIT
+#
+# The MCP7940 has two hardware alarms. Class AlarmScheduler keeps any number of software alarms
+# in a binary heap, ordered by deadline, and always programs the nearest deadline into one hardware alarm.
+# When that alarm fires, the due software alarms are run and the next deadline is programmed.
+# - at(), after() and cancel() are O(log n). next_deadline() is O(1).
+# - Deadlines are in seconds since 2000-01-01 on the calendar of the MCP7940, like MCP7940.time() (see now()),
+#   InterpClock.time() and the rules of mcp7940_cron.py. They don't depend on the epoch or time zone of the port.
+# - Between two alarms the CPU does not need to poll. With an AlarmDispatcher (see mcp7940_mfp.py)
+#   run_due() is called after the MFP interrupt. Without one, call run_due() e.g. after waking up from a (deep) sleep.
+#
+# Example usage:
+#
+#     from mcp7940_sched import AlarmScheduler
+#     sched = AlarmScheduler(mcp, slot=1, dispatcher=disp)
+#     h = sched.after(90, my_callback, "pump on")     # my_callback("pump on") in 90 seconds
+#     sched.after(3600, log_temp, None, period=3600)  # every hour
+#     sched.cancel(h)
+#
+import mcp7940_codec as codec
+from mcp7940 import Alarm
+
+my_debug = False
+
+# Indexes in a heap entry. An entry is also the handle returned by at() and after()
+DEADLINE = 0
+SEQ = 1      # insertion order. Makes entries with the same deadline run first in, first out
+CALLBACK = 2
+ARG = 3
+PERIOD = 4   # seconds. 0 = one shot
+INDEX = 5    # position in the heap. -1 = not scheduled (anymore)
+
+# Return the value the weekday register of the MCP7940 will have in param days days,
+# when it is param rtc_wd now. An alarm that matches on the weekday needs this value.
+# The MCP7940 counts the weekday 1...7
+def rtc_weekday(rtc_wd, days):
+    return rtc_wd if days == 0 else (rtc_wd + days - 1) % 7 + 1
+
+class AlarmScheduler:
+
+    CLS_NAME = "AlarmScheduler"
+
+    # Param slot: the hardware alarm (1 or 2) used by the scheduler. The other one stays free.
+    # Param dispatcher: an AlarmDispatcher. If given, run_due() is called when the hardware alarm fires
+    def __init__(self, mcp, slot=1, dispatcher=None):
+        self._mcp = mcp
+        self._slot = slot
+        self._heap = []
+        self._seq = 0
+        self._armed = None  # deadline programmed in the hardware alarm
+        self._buf = bytearray(7)  # register values of the deadline. See _program()
+        if dispatcher is not None:
+            dispatcher.on_alarm(self._on_alarm, slot)
+
+    def __len__(self):
+        return len(self._heap)
+
+    # Current MCP7940 time in seconds since 2000-01-01
+    def now(self):
+        return self._mcp.time()
+
+    # Schedule cb(arg) at t_secs. Returns a handle for cancel()
+    def at(self, t_secs, cb, arg=None, period=0):
+        self._seq += 1
+        entry = [t_secs, self._seq, cb, arg, period, len(self._heap)]
+        self._heap.append(entry)
+        self._sift_up(entry[INDEX])
+        if entry[INDEX] == 0:
+            self._program()
+        return entry
+
+    # Schedule cb(arg) in secs seconds from now
+    def after(self, secs, cb, arg=None, period=0):
+        return self.at(self.now() + secs, cb, arg, period)
+
+    # Remove a scheduled alarm. Returns False if it was not scheduled (anymore)
+    def cancel(self, entry):
+        i = entry[INDEX]
+        if i < 0:
+            return False
+        self._remove(i)
+        entry[PERIOD] = 0
+        if i == 0:
+            self._program()
+        return True
+
+    # Deadline of the next software alarm in seconds, or None
+    def next_deadline(self):
+        return self._heap[0][DEADLINE] if self._heap else None
+
+    # Run all alarms that are due and program the next deadline. Returns the number of alarms run
+    def run_due(self):
+        TAG = AlarmScheduler.CLS_NAME+".run_due(): "
+        now = self.now()
+        heap = self._heap
+        n = 0
+        while heap and heap[0][DEADLINE] <= now:
+            entry = heap[0]
+            self._remove(0)
+            if entry[PERIOD] > 0:
+                t = entry[DEADLINE] + entry[PERIOD]
+                if t <= now:  # missed periods are skipped
+                    t += ((now - t) // entry[PERIOD] + 1) * entry[PERIOD]
+                entry[DEADLINE] = t
+                entry[INDEX] = len(heap)
+                heap.append(entry)
+                self._sift_up(entry[INDEX])
+            if my_debug:
+                print(TAG+f"running alarm seq: {entry[SEQ]}")
+            entry[CALLBACK](entry[ARG])
+            n += 1
+        self._program()
+        return n
+
+    def _on_alarm(self, alarm_nr, t_irq_us):
+        self.run_due()
+
+    # Program the nearest deadline into the hardware alarm, or disable it when there is nothing to do
+    def _program(self):
+        TAG = AlarmScheduler.CLS_NAME+"._program(): "
+        if not self._heap:
+            if self._armed is not None:
+                self._mcp.alarm_enable(self._slot, False)
+                self._armed = None
+            return
+        deadline = self._heap[0][DEADLINE]
+        if deadline == self._armed:
+            return
+        ts = self._mcp.now()  # one read for the time and the weekday register
+        now = ts.epoch
+        if deadline <= now:
+            deadline = now + 1  # already due: let the hardware alarm fire at the next second
+        lt = codec.unpack_time(codec.secs_to_regs(deadline, self._buf))
+        # The alarm matches on seconds, minutes, hour, weekday, date and month.
+        wd = rtc_weekday(ts.weekday, deadline // 86400 - now // 86400)
+        # Alarm.regs() stores weekday + 1
+        t = (lt[1], lt[2], lt[3], lt[4], lt[5], wd - 1)
+        self._mcp.program_alarm(Alarm(self._slot, t, match=Alarm.MATCH_ALL, polarity=1, enabled=True))
+        self._armed = self._heap[0][DEADLINE]
+        if my_debug:
+            print(TAG+f"alarm{self._slot} set for: {t}")
+
+    def _remove(self, i):
+        heap = self._heap
+        entry = heap[i]
+        last = heap.pop()
+        entry[INDEX] = -1
+        if last is not entry:
+            heap[i] = last
+            last[INDEX] = i
+            self._sift_up(i)
+            self._sift_down(last[INDEX])
+
+    def _less(self, a, b):
+        return a[DEADLINE] < b[DEADLINE] or (a[DEADLINE] == b[DEADLINE] and a[SEQ] < b[SEQ])
+
+    def _sift_up(self, i):
+        heap = self._heap
+        entry = heap[i]
+        while i > 0:
+            parent = (i - 1) >> 1
+            p = heap[parent]
+            if not self._less(entry, p):
+                break
+            heap[i] = p
+            p[INDEX] = i
+            i = parent
+        heap[i] = entry
+        entry[INDEX] = i
+
+    def _sift_down(self, i):
+        heap = self._heap
+        n = len(heap)
+        entry = heap[i]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and self._less(heap[child + 1], heap[child]):
+                child += 1
+            c = heap[child]
+            if not self._less(c, entry):
+                break
+            heap[i] = c
+            c[INDEX] = i
+            i = child
+        heap[i] = entry
+        entry[INDEX] = i
@@ -0,0 +1,308 @@
+#
+# Non-blocking NTP synchronisation
+# (c) 2023 Paulus Schulinck (@Paulskpt on GitHub)
+# License: MIT
+#
+# Class NTPSync queries an NTP server without blocking the caller. It is a state machine, stepped by poll():
+# - request() asks for a sync. It is done as soon as the rate limiter allows.
+# - poll() sends the request or checks (non-blocking) for the answer, and returns at once.
+#   Call it from the main loop, or run the coroutine run() as a uasyncio task.
+#   wait() polls until the sync is done. It blocks, e.g. for the first sync at start up.
+# - When an answer arrives, the functions registered with on_sync() are called with
+#   (ntp_ms, t_ticks_ms, delay_ms): the NTP time in mSec since 2000-01-01 (UTC) at time.ticks_ms() t_ticks_ms,
+#   and the round trip delay. The time now is: ntp_ms + time.ticks_diff(time.ticks_ms(), t_ticks_ms).
+#   Use them to set the builtin RTC and the MCP7940 (see main.py).
+# - When there is no answer within timeout_ms, the request is sent again (max. retries times), then the functions
+#   registered with on_fail() are called.
+# - Burst mode (param burst, 4-8): a sync sends burst requests, burst_gap_ms apart, and keeps the answer with the
+#   lowest round trip delay. The delay is where the error of the offset comes from: the answer is taken to be
+#   half way, so the error is at most half the asymmetry of the delay. The best of a few answers is exact to a few mSec.
+#   A lost or bad answer is a lost sample. The sync fails (and is tried again) only when all of the burst got lost.
+# - A "kiss-o'-death" answer (stratum 0, e.g. RATE: the server asks to slow down) ends the burst and is not retried.
+#   No request is sent for kod_backoff_s (default one hour): the TokenBucket is held that long (see TokenBucket.hold()).
+#
+# Rate limiting: every sync (a single request or a burst), also a retry, takes a token from a TokenBucket
+# that gets one token per min_interval_s (default 15 seconds, the minimum poll interval an NTP client must keep,
+# see: https://github.com/orgs/micropython/discussions/10611). A request waits in poll() until there is a token.
+# The requests of a burst are 2 seconds apart by default, like the "iburst" of ntpd (RFC 5905).
+#
+# Only the lookup of the server address (socket.getaddrinfo()) can block. It is done once and again after a failure.
+#
+# Example usage:
+#
+#     from ntp_sync import NTPSync
+#     ntp_sync = NTPSync("pool.ntp.org", burst=4)
+#     ntp_sync.on_sync(my_sync_callback)   # my_sync_callback(ntp_ms, t_ticks_ms, delay_ms)
+#     ntp_sync.request()
+#     while True:
+#         ntp_sync.poll()
+#         ...
+#
+import time
+import socket
+import struct
+
+my_debug = False
+
+NTP_DELTA = 3155673600  # seconds from 1900-01-01 (NTP epoch) to 2000-01-01
+NTP_PORT = 123
+PKT_SIZE = 48
+
+# States
+IDLE = 0
+WAIT = 1  # request sent, waiting for the answer
+GAP = 2   # burst: waiting to send the next request
+
+class TokenBucket:
+
+    # Param interval_s: one token per interval_s. Param capacity: maximum number of tokens
+    def __init__(self, interval_s=15, capacity=1):
+        self.interval_ms = int(interval_s * 1000)
+        self.capacity = capacity
+        self.tokens = capacity
+        self._t_last = time.ticks_ms()
+        self._hold_ms = 0
+
+    # No tokens for ms mSec from now, e.g. after a kiss-o'-death of the NTP server
+    def hold(self, ms):
+        self.tokens = 0
+        self._t_last = time.ticks_ms()
+        self._hold_ms = ms
+
+    def _refill(self):
+        t = time.ticks_ms()
+        if self._hold_ms:
+            if time.ticks_diff(t, self._t_last) < self._hold_ms:
+                return
+            self._t_last = time.ticks_add(self._t_last, self._hold_ms - self.interval_ms)  # one token at the end
+            self._hold_ms = 0
+        el = time.ticks_diff(t, self._t_last)
+        if el < 0:  # not used for more than half the ticks period
+            el = self.interval_ms * self.capacity
+        n = el // self.interval_ms
+        if n:
+            self.tokens = min(self.capacity, self.tokens + n)
+            self._t_last = t if self.tokens == self.capacity else time.ticks_add(self._t_last, n * self.interval_ms)
+
+    # Take a token. Returns False if there is none
+    def take(self):
+        self._refill()
+        if self.tokens:
+            if self.tokens == self.capacity:
+                self._t_last = time.ticks_ms()  # the refill time starts now
+            self.tokens -= 1
+            return True
+        return False
+
+    # mSec until the next token
+    def wait_ms(self):
+        self._refill()
+        if self.tokens:
+            return 0
+        return max(0, (self._hold_ms or self.interval_ms) - time.ticks_diff(time.ticks_ms(), self._t_last))
+
+class NTPSync:
+
+    CLS_NAME = "NTPSync"
+
+    # Param burst: number of requests per sync. Param burst_gap_ms: time between the requests of a burst
+    # Param kod_backoff_s: no requests for this long after a kiss-o'-death
+    def __init__(self, host="pool.ntp.org", port=NTP_PORT, timeout_ms=1000, retries=2, min_interval_s=15,
+                 burst=1, burst_gap_ms=2000, kod_backoff_s=3600):
+        self.host = host
+        self.port = port
+        self.timeout_ms = timeout_ms
+        self.retries = retries
+        self.burst = max(1, burst)
+        self.burst_gap_ms = burst_gap_ms
+        self.kod_backoff_s = kod_backoff_s
+        self.bucket = TokenBucket(min_interval_s)
+        self._addr = None
+        self._sock = None
+        self._buf = bytearray(PKT_SIZE)
+        self._state = IDLE
+        self._wanted = False
+        self._tries = 0
+        self._t_send = 0
+        self._sent = 0            # requests sent in this burst
+        self._best_ms = 0         # best answer of this burst: NTP time, ticks_ms() and delay (-1: none yet)
+        self._best_ticks = 0
+        self._best_delay = -1
+        self._error = None
+        self._sync_cbs = []
+        self._fail_cbs = []
+        self.syncs = 0
+        self.fails = 0
+        self.last_delay_ms = -1
+        self.last_samples = 0     # answers received in the last burst
+        self.kods = 0             # number of kiss-o'-death answers
+
+    # Register function cb(ntp_ms, t_ticks_ms, delay_ms), called after a successful sync
+    def on_sync(self, cb):
+        self._sync_cbs.append(cb)
+
+    # Register function cb(error), called when all tries of a sync failed
+    def on_fail(self, cb):
+        self._fail_cbs.append(cb)
+
+    # Sync as soon as the rate limiter allows
+    def request(self):
+        if not self._wanted:
+            self._wanted = True
+            self._tries = 0
+
+    # True while a sync is requested or running
+    @property
+    def busy(self):
+        return self._wanted
+
+    # Do the next step, without blocking. Returns True when a sync was completed
+    def poll(self):
+        if self._state == IDLE:
+            if self._wanted and self.bucket.take():
+                self._tries += 1
+                self._sent = 0
+                self.last_samples = 0
+                self._best_delay = -1
+                self._send()
+            return False
+        if self._state == GAP:
+            if time.ticks_diff(time.ticks_ms(), self._t_send) >= self.burst_gap_ms:
+                self._send()
+            return False
+        return self._receive()
+
+    # Poll until the sync is done: blocks. Returns True if it succeeded.
+    # Param timeout_ms: stop waiting after this long (None: no limit). The request stays pending: poll() goes on with it
+    def wait(self, poll_ms=10, timeout_ms=None):
+        syncs = self.syncs
+        t0 = time.ticks_ms()
+        while self._wanted:
+            if timeout_ms is not None and time.ticks_diff(time.ticks_ms(), t0) >= timeout_ms:
+                break
+            self.poll()
+            time.sleep_ms(poll_ms)
+        return self.syncs != syncs
+
+    # Run poll() as a uasyncio task
+    async def run(self, period_ms=100):
+        try:
+            import uasyncio as asyncio
+        except ImportError:
+            import asyncio
+        while True:
+            self.poll()
+            if hasattr(asyncio, "sleep_ms"):
+                await asyncio.sleep_ms(period_ms)
+            else:
+                await asyncio.sleep(period_ms / 1000)
+
+    def _send(self):
+        TAG = NTPSync.CLS_NAME+"._send(): "
+        self._sent += 1
+        try:
+            if self._addr is None:
+                self._addr = socket.getaddrinfo(self.host, self.port)[0][-1]
+            self._close()
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.setblocking(False)
+            self._sock = s
+            buf = self._buf
+            for i in range(PKT_SIZE):
+                buf[i] = 0
+            buf[0] = 0x1B  # LI 0, version 3, mode 3 (client)
+            self._t_send = time.ticks_ms()
+            s.sendto(buf, self._addr)
+            self._state = WAIT
+            if my_debug:
+                print(TAG+f"request {self._sent}/{self.burst} of try {self._tries} sent to {self.host}")
+        except OSError as e:
+            self._sample_lost(e)
+
+    def _receive(self):
+        TAG = NTPSync.CLS_NAME+"._receive(): "
+        buf = self._buf
+        try:
+            data = self._sock.recv(PKT_SIZE)
+        except OSError:  # EAGAIN: no answer yet
+            data = None
+        t_recv = time.ticks_ms()
+        if not data:
+            if time.ticks_diff(t_recv, self._t_send) >= self.timeout_ms:
+                return self._sample_lost(OSError("NTP timeout"))
+            return False
+        n = len(data)
+        buf[:n] = data
+        self._close()
+        if n >= 2 and buf[1] == 0:  # stratum 0: a "kiss-o'-death" (e.g. RATE). Stop the burst, no retries
+            self.kods += 1
+            self._sent = self.burst
+            self._tries = self.retries + 1
+            self.bucket.hold(self.kod_backoff_s * 1000)
+            code = bytes(buf[12:16]) if n >= 16 else b""
+            return self._sample_lost(OSError("NTP kiss-o'-death {}".format(code)))
+        # mode 4 (server), not alarm (LI 3)
+        if n < PKT_SIZE or buf[0] & 0x07 != 4 or buf[0] >> 6 == 3:
+            return self._sample_lost(OSError("bad NTP answer"))
+        rtt = time.ticks_diff(t_recv, self._t_send)
+        t2 = self._ts_ms(32)  # server receive time
+        t3 = self._ts_ms(40)  # server transmit time
+        delay = rtt - (t3 - t2)
+        self.last_samples += 1
+        if self._best_delay < 0 or delay < self._best_delay:
+            self._best_ms = t3 + delay // 2  # NTP time at t_recv: the answer took half the delay
+            self._best_ticks = t_recv
+            self._best_delay = delay
+        if my_debug:
+            print(TAG+f"sample {self._sent}: delay: {delay} mSec")
+        return self._next()
+
+    # Send the next request of the burst, or finish the sync with the best answer. Returns True when a sync was completed
+    def _next(self):
+        TAG = NTPSync.CLS_NAME+"._next(): "
+        if self._sent < self.burst:
+            self._state = GAP  # self._t_send: the gap is counted from the previous request
+            return False
+        self._state = IDLE
+        if self._best_delay < 0:
+            self._failed(self._error)
+            return False
+        self._wanted = False
+        self.syncs += 1
+        self.last_delay_ms = self._best_delay
+        if my_debug:
+            print(TAG+f"NTP time: {self._best_ms} mSec, delay: {self._best_delay} mSec, samples: {self.last_samples}/{self._sent}")
+        for cb in self._sync_cbs:
+            cb(self._best_ms, self._best_ticks, self._best_delay)
+        return True
+
+    def _sample_lost(self, e):
+        TAG = NTPSync.CLS_NAME+"._sample_lost(): "
+        self._close()
+        self._error = e
+        if my_debug:
+            print(TAG+f"request {self._sent}: {e}")
+        return self._next()
+
+    # NTP timestamp at offset ofs of the answer in mSec since 2000-01-01
+    def _ts_ms(self, ofs):
+        secs, frac = struct.unpack("!II", self._buf[ofs:ofs+8])
+        return (secs - NTP_DELTA) * 1000 + ((frac * 1000) >> 32)
+
+    def _failed(self, e):
+        TAG = NTPSync.CLS_NAME+"._failed(): "
+        self._close()
+        self._state = IDLE
+        self._addr = None  # look up the address again: the server may have changed
+        if my_debug:
+            print(TAG+f"try {self._tries}: {e}")
+        if self._tries > self.retries:
+            self._wanted = False
+            self.fails += 1
+            for cb in self._fail_cbs:
+                cb(e)
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
@@ -0,0 +1,264 @@
+#
+# Daylight saving time from a POSIX TZ string
+# (c) 2023 Paulus Schulinck (@Paulskpt on GitHub)
+# License: MIT
+#
+# Class PosixTZ parses a POSIX TZ string, e.g. "WET0WEST,M3.5.0/1,M10.5.0" (Portugal), and computes
+# the two transitions of a year from its rules. No table of dates per year: it works for any year.
+# - transitions(year): the start and the end of DST in that year, in seconds since 2000-01-01 (UTC),
+#   the scale of utime.time(). Computed once per year and cached.
+# - is_dst(t): True if DST is on at UTC time t. The interval around t in which the answer does not change
+#   is cached: as long as t stays in it, is_dst() is two integer comparisons. utcoffset(t) and localtime(t) use it.
+# - A zone without DST (e.g. "IST-5:30") never has DST.
+#
+# The TZ string: std offset [dst [offset] [,start[/time],end[/time]]]
+#   std, dst: the names, 3 or more letters, or in <>, e.g. <+0530>
+#   offset: [+-]hh[:mm[:ss]] WEST of Greenwich, so UTC+1 is "-1". The dst offset defaults to one hour more than std
+#   start, end: Mm.w.d: day d (0 = Sunday) of week w (1-5, 5 = the last) of month m
+#               Jn: day n (1-365) of the year, 29 February is never counted
+#               n: day n (0-365) of the year, 29 February is counted
+#   time: local time of the transition, [+-]hh[:mm[:ss]], default 02:00:00. The hours can be more than 24
+#
+# Function tz_for(name) returns the PosixTZ of an IANA zone name in ZONES (e.g. "Europe/Lisbon", the value of
+# "tmzone" in config.json), or of a TZ string. Add the zones you need to ZONES.
+#
+# Example usage:
+#
+#     from posix_tz import tz_for
+#     tz = tz_for("Europe/Lisbon")
+#     if tz.is_dst(utime.time()):
+#         ...
+#     lt = tz.localtime(utime.time())   # like utime.localtime(), in the zone
+#
+import time
+from mcp7940_codec import days_from_civil
+
+my_debug = False
+
+# IANA zone name: POSIX TZ string. From the last line of the zoneinfo files (tzdata)
+ZONES = {
+    "UTC": "UTC0",
+    "Europe/Lisbon": "WET0WEST,M3.5.0/1,M10.5.0",
+    "Europe/London": "GMT0BST,M3.5.0/1,M10.5.0",
+    "Europe/Amsterdam": "CET-1CEST,M3.5.0,M10.5.0/3",
+    "Europe/Berlin": "CET-1CEST,M3.5.0,M10.5.0/3",
+    "Europe/Paris": "CET-1CEST,M3.5.0,M10.5.0/3",
+    "Europe/Madrid": "CET-1CEST,M3.5.0,M10.5.0/3",
+    "Europe/Athens": "EET-2EEST,M3.5.0/3,M10.5.0/4",
+    "America/New_York": "EST5EDT,M3.2.0,M11.1.0",
+    "America/Chicago": "CST6CDT,M3.2.0,M11.1.0",
+    "America/Denver": "MST7MDT,M3.2.0,M11.1.0",
+    "America/Los_Angeles": "PST8PDT,M3.2.0,M11.1.0",
+    "America/Sao_Paulo": "<-03>3",
+    "Asia/Kolkata": "IST-5:30",
+    "Asia/Tokyo": "JST-9",
+    "Australia/Sydney": "AEST-10AEDT,M10.1.0,M4.1.0/3",
+    "Pacific/Auckland": "NZST-12NZDT,M9.5.0,M4.1.0/3",
+}
+
+DIM = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+# Indexes in a rule
+R_TYPE = 0   # "M", "J" or "N"
+R_A = 1      # M: month, J and N: day
+R_B = 2      # M: week
+R_C = 3      # M: weekday
+R_TIME = 4   # local time of the transition, seconds
+
+def is_leap_year(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+class PosixTZ:
+
+    CLS_NAME = "PosixTZ"
+
+    def __init__(self, tz):
+        self.tz = tz
+        self._s = tz
+        self._i = 0
+        self.std_name = self._name()
+        self.std_offset = -self._time()  # seconds EAST of UTC, like State.UTC_OFFSET in main.py
+        self.dst_name = None
+        self.dst_offset = self.std_offset
+        self._start = self._end = None
+        if self._i < len(tz):
+            self.dst_name = self._name()
+            self.dst_offset = self.std_offset + 3600
+            if self._i < len(tz) and tz[self._i] != ",":
+                self.dst_offset = -self._time()
+            if self._i >= len(tz):  # no rules: those of the USA, the POSIX default
+                self._s = tz = tz + ",M3.2.0,M11.1.0"
+            self._expect(",")
+            self._start = self._rule()
+            self._expect(",")
+            self._end = self._rule()
+            if self._i != len(tz):
+                raise ValueError("TZ string '{}': unexpected '{}'".format(self.tz, tz[self._i:]))
+        self._s = None
+        self._year = None   # year of self._trans
+        self._trans = None  # (start, end) of DST in self._year
+        self._lo = 0        # is_dst() is self._dst from self._lo up to self._hi
+        self._hi = -1
+        self._dst = False
+
+    def __repr__(self):
+        return "PosixTZ('{}')".format(self.tz)
+
+    @property
+    def has_dst(self):
+        return self._start is not None
+
+    # Return (start, end) of DST in param year as UTC seconds since 2000-01-01, or None if the zone has no DST.
+    # In the southern hemisphere the end is before the start
+    def transitions(self, year):
+        TAG = PosixTZ.CLS_NAME+".transitions(): "
+        if self._start is None:
+            return None
+        if year != self._year:
+            self._trans = (self._rule_day(self._start, year) * 86400 + self._start[R_TIME] - self.std_offset,
+                           self._rule_day(self._end, year) * 86400 + self._end[R_TIME] - self.dst_offset)
+            self._year = year
+            if my_debug:
+                print(TAG+f"year: {year}, DST from: {self._trans[0]} to: {self._trans[1]}")
+        return self._trans
+
+    # True if DST is on at param t: UTC seconds since 2000-01-01 (utime.time())
+    def is_dst(self, t):
+        if self._lo <= t < self._hi:
+            return self._dst
+        return self._update(t)
+
+    # Offset from UTC in seconds (east positive) at UTC time t
+    def utcoffset(self, t):
+        return self.dst_offset if self.is_dst(t) else self.std_offset
+
+    # Name of the zone at UTC time t, e.g. "WET" or "WEST"
+    def tzname(self, t):
+        return self.dst_name if self.is_dst(t) else self.std_name
+
+    # Local time at UTC time t, like utime.localtime()
+    def localtime(self, t):
+        return time.localtime(t + self.utcoffset(t))
+
+    # Find the interval around t in which is_dst() does not change
+    def _update(self, t):
+        if self._start is None:
+            self._lo, self._hi, self._dst = -(1 << 62), 1 << 62, False
+            return False
+        year = 2000 + (t + self.std_offset) // 31556952  # average length of a Gregorian year
+        y0 = days_from_civil(year, 1, 1) * 86400 - self.std_offset
+        if t < y0:
+            year -= 1
+        elif t >= days_from_civil(year + 1, 1, 1) * 86400 - self.std_offset:
+            year += 1
+        y0 = days_from_civil(year, 1, 1) * 86400 - self.std_offset
+        y1 = days_from_civil(year + 1, 1, 1) * 86400 - self.std_offset
+        start, end = self.transitions(year)
+        a, b = (start, end) if start < end else (end, start)
+        inside = start < end  # northern hemisphere: DST between the start and the end
+        if t < a:
+            self._lo, self._hi, self._dst = y0, a, not inside
+        elif t < b:
+            self._lo, self._hi, self._dst = a, b, inside
+        else:
+            self._lo, self._hi, self._dst = b, y1, not inside
+        return self._dst
+
+    # Days since 2000-01-01 of the day of a rule in param year
+    def _rule_day(self, rule, year):
+        kind = rule[R_TYPE]
+        if kind == "M":
+            month, week, wday = rule[R_A], rule[R_B], rule[R_C]
+            first = days_from_civil(year, month, 1)
+            dim = 29 if month == 2 and is_leap_year(year) else DIM[month - 1]
+            day = (wday - (first + 6) % 7) % 7 + (week - 1) * 7  # 2000-01-01 was a Saturday (6, Sunday = 0)
+            while day >= dim:
+                day -= 7
+            return first + day
+        n = rule[R_A]
+        if kind == "J" and n >= 60 and is_leap_year(year):
+            n += 1  # Jn does not count 29 February
+        return days_from_civil(year, 1, 1) + n - (1 if kind == "J" else 0)
+
+    # The parse functions below read self._s from self._i
+
+    def _name(self):
+        s, i = self._s, self._i
+        if i < len(s) and s[i] == "<":
+            j = s.find(">", i)
+            if j < 0:
+                raise ValueError("TZ string '{}': missing '>'".format(self.tz))
+            self._i = j + 1
+            return s[i+1:j]
+        j = i
+        while j < len(s) and s[j].isalpha():
+            j += 1
+        if j - i < 3:
+            raise ValueError("TZ string '{}': bad zone name at {}".format(self.tz, i))
+        self._i = j
+        return s[i:j]
+
+    # [+-]hh[:mm[:ss]] in seconds
+    def _time(self):
+        s = self._s
+        sign = 1
+        if self._i < len(s) and s[self._i] in "+-":
+            sign = -1 if s[self._i] == "-" else 1
+            self._i += 1
+        secs = 0
+        for mul in (3600, 60, 1):
+            secs += self._num() * mul
+            if self._i >= len(s) or s[self._i] != ":" or mul == 1:
+                break
+            self._i += 1
+        return sign * secs
+
+    def _num(self):
+        s, i = self._s, self._i
+        j = i
+        while j < len(s) and s[j].isdigit():
+            j += 1
+        if j == i:
+            raise ValueError("TZ string '{}': number expected at {}".format(self.tz, i))
+        self._i = j
+        return int(s[i:j])
+
+    def _expect(self, c):
+        if self._i >= len(self._s) or self._s[self._i] != c:
+            raise ValueError("TZ string '{}': '{}' expected at {}".format(self.tz, c, self._i))
+        self._i += 1
+
+    def _rule(self):
+        s = self._s
+        if self._i < len(s) and s[self._i] == "M":
+            self._i += 1
+            month = self._num()
+            self._expect(".")
+            week = self._num()
+            self._expect(".")
+            wday = self._num()
+            if not (1 <= month <= 12 and 1 <= week <= 5 and 0 <= wday <= 6):
+                raise ValueError("TZ string '{}': bad rule M{}.{}.{}".format(self.tz, month, week, wday))
+            rule = ["M", month, week, wday, 7200]
+        else:
+            kind = "N"
+            if self._i < len(s) and s[self._i] == "J":
+                kind = "J"
+                self._i += 1
+            n = self._num()
+            if not ((1 if kind == "J" else 0) <= n <= 365):
+                raise ValueError("TZ string '{}': bad day {}{}".format(self.tz, "J" if kind == "J" else "", n))
+            rule = [kind, n, 0, 0, 7200]
+        if self._i < len(s) and s[self._i] == "/":
+            self._i += 1
+            rule[R_TIME] = self._time()
+        return tuple(rule)
+
+# Return the PosixTZ of param name: a zone in ZONES or a POSIX TZ string.
+# Raises ValueError for an unknown zone name or a bad TZ string
+def tz_for(name):
+    tz = ZONES.get(name)
+    if tz is None:
+        if "/" in name and "," not in name:
+            raise ValueError("time zone '{}' not in ZONES (see posix_tz.py). Use a POSIX TZ string".format(name))
+        tz = name
+    return PosixTZ(tz)